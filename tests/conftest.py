@@ -0,0 +1,14 @@
+# tests/conftest.py
+#
+# web_backend.main crea cache dei piani e database dei job all'import: nei
+# test stanno in una cartella temporanea (cache solo in memoria).
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("PLANNER_CACHE_DB", "")
+os.environ.setdefault("PLANNER_JOBS_DB", str(Path(tempfile.mkdtemp(prefix="planner-tests-")) / "jobs.sqlite3"))
@@ -0,0 +1,117 @@
+# tests/helpers.py
+#
+# Istanze piccole (risolte all'ottimo da CBC in pochi secondi) e controlli
+# di validità dei piani usati da tutti i test.
+
+from __future__ import annotations
+
+import numpy as np
+
+from weekly_planner.benchmark import random_subject_instance
+from weekly_planner.models import PlanResult, PlannerConfig
+from weekly_planner.planner import WeeklyPlanner
+from weekly_planner.subject_planner import SubjectPlanningData
+
+
+def legacy_instance(seed: int = 0) -> PlannerConfig:
+    """3 classi e 6 docenti con 1-2 ore per classe: CBC ne dimostra l'ottimo in pochi secondi."""
+    rng = np.random.default_rng(seed)
+    hours_matrix = rng.integers(1, 3, size=(6, 3))
+    availability = rng.random((6, 5, 2)) > 0.1
+    return PlannerConfig(
+        days=5,
+        daily_hours=6,
+        num_professors=6,
+        num_classes=3,
+        hours_matrix=hours_matrix,
+        availability=availability,
+        last_morning_hour=4,
+        wednesday_afternoon_free=True,
+    )
+
+
+def subject_instance(seed: int = 0, weeks: int = 1) -> tuple[PlannerConfig, SubjectPlanningData]:
+    """
+    Istanza a materie di `weeks` settimane su tre giorni; con due
+    settimane l'ultima materia è Settimana A/B (un'ora in meno per classe
+    nella B).
+    """
+    config, ctx = random_subject_instance(num_classes=2, num_subjects=2, num_professors=4, days=3, seed=seed)
+    if weeks == 2:
+        week_b = ctx.required_hours[0].copy()
+        week_b[:, -1] = np.maximum(week_b[:, -1] - 1, 1)
+        ctx.week_labels = ["A", "B"]
+        ctx.required_hours = [ctx.required_hours[0], week_b]
+        ctx.alt_weeks = np.arange(ctx.num_subjects) == ctx.num_subjects - 1
+    return config, ctx
+
+
+def _blocked(config: PlannerConfig, d: int, h: int) -> bool:
+    return bool(config.wednesday_afternoon_free and d == 2 and h >= config.last_morning_hour)
+
+
+def _available(config: PlannerConfig, p: int, d: int, h: int) -> bool:
+    A = np.asarray(config.availability, dtype=bool)
+    if A.ndim == 2:
+        return bool(A[p, d])
+    return bool(A[p, d, 0 if h < config.last_morning_hour else 1])
+
+
+def assert_teachers_feasible(config: PlannerConfig, P: np.ndarray) -> None:
+    """Nessun docente in due classi alla stessa ora, disponibilità e mercoledì pomeriggio."""
+    assert P.shape == (config.days, config.daily_hours, config.num_classes)
+    for d in range(config.days):
+        for h in range(config.daily_hours):
+            teachers = [int(p) for p in P[d, h] if p > 0]
+            assert len(teachers) == len(set(teachers)), f"docente doppio in ({d}, {h})"
+            if teachers:
+                assert not _blocked(config, d, h), f"lezione nello slot bloccato ({d}, {h})"
+            for p in teachers:
+                assert _available(config, p - 1, d, h), f"docente {p - 1} non disponibile in ({d}, {h})"
+
+
+def assert_legacy_valid(config: PlannerConfig, result: PlanResult) -> None:
+    """Un piano che passa `WeeklyPlanner._control` (ore H[p, c]) e i vincoli di orario."""
+    assert result.plans, "nessun piano"
+    planner = WeeklyPlanner(config)
+    for P in result.plans:
+        assert planner._control(P, show_error=True)
+        assert_teachers_feasible(config, P)
+
+
+def assert_subject_valid(config: PlannerConfig, ctx: SubjectPlanningData, result: PlanResult) -> None:
+    """
+    Piani a materie validi: ore richieste per (classe, materia), docenti
+    abilitati entro le capacità, massimi giornalieri, un solo docente per
+    coppia con single_teacher_rule e orario uguale tra le settimane per le
+    materie comuni.
+    """
+    assert result.plans and result.subject_plans, "nessun piano"
+    assert len(result.plans) == len(ctx.week_labels)
+    caps = np.asarray(ctx.prof_subject_caps)
+    for w, (P, S) in enumerate(zip(result.plans, result.subject_plans)):
+        required = np.asarray(ctx.required_hours[w])
+        assert_teachers_feasible(config, P)
+        assert ((P > 0) == (S > 0)).all(), "docente senza materia o materia senza docente"
+        hours = np.zeros((config.num_professors, ctx.num_subjects), dtype=int)
+        for c in range(config.num_classes):
+            for s in range(ctx.num_subjects):
+                cells = S[:, :, c] == s + 1
+                assert np.count_nonzero(cells) == required[c, s], f"settimana {w}, classe {c}, materia {s}"
+                per_day = cells.sum(axis=1)
+                assert (per_day <= ctx.subject_daily_max[s, c]).all(), f"massimo giornaliero di {s} in {c}"
+                teachers = set(int(p) - 1 for p in P[:, :, c][cells])
+                if ctx.single_teacher_rule:
+                    assert len(teachers) <= 1, f"più docenti per ({c}, {s})"
+                for p in P[:, :, c][cells]:
+                    hours[int(p) - 1, s] += 1
+        assert (hours <= caps).all(), "capacità dei docenti superata"
+
+    shared = ctx.shared_subjects()
+    if len(result.plans) > 1 and shared.any():
+        S0, P0 = result.subject_plans[0], result.plans[0]
+        mask0 = np.isin(S0, np.flatnonzero(shared) + 1)
+        for P, S in zip(result.plans[1:], result.subject_plans[1:]):
+            mask = np.isin(S, np.flatnonzero(shared) + 1)
+            assert (mask == mask0).all() and (S[mask] == S0[mask0]).all() and (P[mask] == P0[mask0]).all(), \
+                "materie comuni diverse tra le settimane"
@@ -0,0 +1,68 @@
+"""I backend pulp e matrix costruiscono lo stesso modello: stesso ottimo."""
+
+import numpy as np
+import pytest
+
+from weekly_planner.mip_planner import MIPWeeklyPlanner
+from weekly_planner.subject_planner import SubjectMIPPlanner
+
+from helpers import assert_legacy_valid, assert_subject_valid, legacy_instance, subject_instance
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("block_formulation", ["pairwise", "block_start"])
+def test_legacy_backends_same_objective(seed, block_formulation):
+    config = legacy_instance(seed)
+    scores = {}
+    for backend in ("pulp", "matrix"):
+        result = MIPWeeklyPlanner(config).solve(time_limit_sec=30, block_formulation=block_formulation, backend=backend)
+        assert_legacy_valid(config, result)
+        assert result.solve_stats[0]["optimal"]
+        scores[backend] = result.scores[0]
+    assert scores["pulp"] == pytest.approx(scores["matrix"])
+
+
+@pytest.mark.parametrize("formulation", ["hourly", "blocks"])
+def test_subject_backends_same_objective(formulation):
+    config, ctx = subject_instance()
+    scores = {}
+    for backend in ("pulp", "matrix"):
+        result = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, backend=backend, formulation=formulation)
+        assert_subject_valid(config, ctx, result)
+        assert result.solve_stats[0]["optimal"]
+        scores[backend] = result.scores[0]
+    assert scores["pulp"] == pytest.approx(scores["matrix"])
+
+
+def _twin_teachers(config):
+    # Il docente 1 diventa una copia del docente 0: un gruppo di docenti intercambiabili
+    config.hours_matrix[1] = config.hours_matrix[0]
+    config.availability[1] = config.availability[0]
+    return config
+
+
+@pytest.mark.parametrize("backend", ["pulp", "matrix"])
+def test_legacy_symmetry_breaking_keeps_optimum(backend):
+    config = _twin_teachers(legacy_instance())
+    on = MIPWeeklyPlanner(config).solve(time_limit_sec=30, backend=backend, symmetry_breaking=True)
+    off = MIPWeeklyPlanner(config).solve(time_limit_sec=30, backend=backend, symmetry_breaking=False)
+    assert_legacy_valid(config, on)
+    assert on.solve_stats[0]["optimal"] and off.solve_stats[0]["optimal"]
+    assert on.scores[0] == pytest.approx(off.scores[0])
+    assert on.solve_stats[0]["symmetry"]["teacher_groups"] == 1
+    assert "symmetry" not in off.solve_stats[0]
+
+
+@pytest.mark.parametrize("formulation", ["hourly", "blocks"])
+def test_subject_symmetry_breaking_keeps_optimum(formulation):
+    config, ctx = subject_instance()
+    # il secondo docente abilitato diventa una copia del primo
+    first, second = np.flatnonzero(ctx.prof_subject_caps.sum(axis=1))[:2]
+    ctx.prof_subject_caps[second] = ctx.prof_subject_caps[first]
+    config.availability[second] = config.availability[first]
+    on = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, formulation=formulation, symmetry_breaking=True)
+    off = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, formulation=formulation, symmetry_breaking=False)
+    assert_subject_valid(config, ctx, on)
+    assert on.solve_stats[0]["optimal"] and off.solve_stats[0]["optimal"]
+    assert on.scores[0] == pytest.approx(off.scores[0])
+    assert on.solve_stats[0]["symmetry"]["fixed_vars"] > 0
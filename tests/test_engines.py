@@ -0,0 +1,124 @@
+"""Ogni motore produce piani validi sulle istanze piccole di helpers."""
+
+import pytest
+
+from weekly_planner.decompose import solve_decomposed
+from weekly_planner.evolve_planner import EvolutionaryPlanner
+from weekly_planner.lns import LNSPlanner
+from weekly_planner.mip_planner import MIPWeeklyPlanner
+from weekly_planner.planner import WeeklyPlanner
+from weekly_planner.subject_greedy_planner import SubjectGreedyPlanner
+from weekly_planner.subject_planner import SubjectMIPPlanner, SubjectRandomPlanner
+
+from helpers import assert_legacy_valid, assert_subject_valid, legacy_instance, subject_instance
+
+
+# ----------------------------------------------------------------------
+# Legacy (matrice H)
+# ----------------------------------------------------------------------
+
+
+def test_weekly_planner_greedy():
+    config = legacy_instance()
+    result = WeeklyPlanner(config).generate_until_time(target_score=0.1, time_limit_sec=2.0, improve_sec=0.5)
+    assert_legacy_valid(config, result)
+
+
+def test_evolutionary_planner():
+    config = legacy_instance()
+    result = EvolutionaryPlanner(config, seed=0).generate(time_limit_sec=5.0, max_generations=20, improve_sec=0.5)
+    assert_legacy_valid(config, result)
+
+
+@pytest.mark.parametrize("backend", ["pulp", "matrix"])
+@pytest.mark.parametrize("block_formulation", ["pairwise", "block_start"])
+def test_mip_weekly_planner(backend, block_formulation):
+    config = legacy_instance()
+    result = MIPWeeklyPlanner(config).solve(time_limit_sec=30, block_formulation=block_formulation, backend=backend)
+    assert_legacy_valid(config, result)
+    assert result.solve_stats[0]["optimal"]
+
+
+def test_mip_weekly_planner_warm_start_is_kept_valid():
+    config = legacy_instance()
+    start = WeeklyPlanner(config).generate_until_time(target_score=0.1, time_limit_sec=2.0)
+    result = MIPWeeklyPlanner(config).solve(time_limit_sec=30, warm_start=start)
+    assert_legacy_valid(config, result)
+    assert result.solve_stats[0]["warm_start_valid"]
+
+
+def test_lns_legacy():
+    config = legacy_instance()
+    start = WeeklyPlanner(config).generate_until_time(target_score=0.1, time_limit_sec=2.0)
+    result = LNSPlanner(config, seed=0).improve(start, time_limit_sec=5, sub_time_limit_sec=2)
+    assert_legacy_valid(config, result)
+
+
+def test_decomposed_legacy():
+    config = legacy_instance()
+    assert_legacy_valid(config, solve_decomposed(config, time_limit_sec=30, workers=1))
+
+
+# ----------------------------------------------------------------------
+# Materie
+# ----------------------------------------------------------------------
+
+
+def test_subject_greedy():
+    config, ctx = subject_instance()
+    result = SubjectGreedyPlanner(config, ctx, seed=0).generate(time_limit_sec=2.0, improve_sec=0.5)
+    assert_subject_valid(config, ctx, result)
+
+
+def test_subject_random():
+    config, ctx = subject_instance()
+    result = SubjectRandomPlanner(config, ctx, seed=0).generate(time_limit_sec=5.0)
+    assert_subject_valid(config, ctx, result)
+
+
+@pytest.mark.parametrize("backend", ["pulp", "matrix"])
+@pytest.mark.parametrize("formulation", ["hourly", "blocks"])
+def test_subject_mip(backend, formulation):
+    config, ctx = subject_instance()
+    result = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, backend=backend, formulation=formulation)
+    assert_subject_valid(config, ctx, result)
+
+
+@pytest.mark.parametrize("mode", ["two_stage", "by_day"])
+def test_subject_mip_modes(mode):
+    config, ctx = subject_instance()
+    result = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, mode=mode)
+    assert_subject_valid(config, ctx, result)
+
+
+def test_subject_mip_warm_start_is_kept_valid():
+    config, ctx = subject_instance()
+    start = SubjectGreedyPlanner(config, ctx, seed=0).generate(time_limit_sec=2.0)
+    result = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, backend="matrix", warm_start=start)
+    assert_subject_valid(config, ctx, result)
+    assert result.solve_stats[0]["warm_start_valid"]
+
+
+def test_subject_joint_weeks_share_common_subjects():
+    config, ctx = subject_instance(weeks=2)
+    result = SubjectMIPPlanner(config, ctx).solve(time_limit_sec=60, joint_weeks=True)
+    assert_subject_valid(config, ctx, result)
+
+
+def test_subject_greedy_shared_weeks():
+    config, ctx = subject_instance(weeks=2)
+    result = SubjectGreedyPlanner(config, ctx, seed=0).generate(time_limit_sec=2.0, shared_weeks=True)
+    assert_subject_valid(config, ctx, result)
+
+
+def test_lns_subject_joint_weeks():
+    config, ctx = subject_instance(weeks=2)
+    start = SubjectGreedyPlanner(config, ctx, seed=0).generate(time_limit_sec=2.0, shared_weeks=True)
+    result = LNSPlanner(config, ctx, seed=0).improve(start, time_limit_sec=6, sub_time_limit_sec=2)
+    assert_subject_valid(config, ctx, result)
+    assert result.solve_stats[0]["mode"] == "joint_weeks"
+
+
+def test_decomposed_subject():
+    config, ctx = subject_instance()
+    assert_subject_valid(config, ctx, solve_decomposed(config, ctx, time_limit_sec=60, workers=1))
@@ -0,0 +1,129 @@
+"""Ciclo di vita dei job: coda, esecuzione, errori, annullamento e job orfani."""
+
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+from web_backend.jobs import (
+    FINISHED_STATES,
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobManager,
+)
+
+
+# Funzioni di modulo: il processo del job le riceve con pickle
+
+
+def _double(payload, emit):
+    emit("incumbent", {"value": payload})
+    return payload * 2
+
+
+def _fail(payload, emit):
+    raise RuntimeError("solver rotto")
+
+
+def _sleep(payload, emit):
+    emit("incumbent", {"value": 0})
+    time.sleep(payload)
+    return payload
+
+
+def _wait(manager, job_id, states=FINISHED_STATES, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job.status in states:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} ancora {manager.get(job_id).status}")
+
+
+def test_job_runs_to_done(tmp_path):
+    manager = JobManager(_double, tmp_path / "jobs.sqlite3", max_workers=1)
+    job = manager.submit(21)
+    assert job.status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE)
+    job = _wait(manager, job.id)
+    assert job.status == JOB_DONE
+    assert job.result == 42
+    assert [e["data"]["status"] for e in job.events if e["type"] == "status"] == [JOB_QUEUED, JOB_RUNNING, JOB_DONE]
+    assert job.summary()["incumbent"] == {"value": 21}
+    seqs = [e["seq"] for e in job.events]
+    assert seqs == sorted(seqs)
+    assert manager.events_since(job.id, seqs[-2]) == job.events[-1:]
+
+
+def test_job_error_is_reported(tmp_path):
+    manager = JobManager(_fail, tmp_path / "jobs.sqlite3", max_workers=1)
+    job = _wait(manager, manager.submit(None).id)
+    assert job.status == JOB_FAILED
+    assert "solver rotto" in job.error
+    assert job.result is None
+
+
+def test_cancel_queued_and_running(tmp_path):
+    manager = JobManager(_sleep, tmp_path / "jobs.sqlite3", max_workers=1, cancel_grace_sec=1.0)
+    running = manager.submit(30)
+    _wait(manager, running.id, states=(JOB_RUNNING,))
+    queued = manager.submit(30)
+    assert manager.get(queued.id).status == JOB_QUEUED
+
+    assert manager.cancel(queued.id)
+    assert manager.get(queued.id).status == JOB_CANCELLED
+
+    started = time.monotonic()
+    assert manager.cancel(running.id)
+    assert _wait(manager, running.id).status == JOB_CANCELLED
+    assert time.monotonic() - started < 10
+
+    # già terminati o inesistenti
+    assert not manager.cancel(running.id)
+    assert not manager.cancel("missing")
+    # il job annullato in coda non è mai partito
+    assert [e["data"]["status"] for e in manager.get(queued.id).events] == [JOB_QUEUED, JOB_CANCELLED]
+
+
+def test_cancel_from_another_manager(tmp_path):
+    # Annullamento arrivato a un altro worker: lo esegue il proprietario
+    db = tmp_path / "jobs.sqlite3"
+    owner = JobManager(_sleep, db, max_workers=1, cancel_grace_sec=1.0)
+    other = JobManager(_sleep, db, max_workers=1)
+    job = owner.submit(30)
+    _wait(owner, job.id, states=(JOB_RUNNING,))
+    assert other.cancel(job.id)
+    assert _wait(other, job.id).status == JOB_CANCELLED
+
+
+def test_orphans_of_dead_worker_are_failed(tmp_path):
+    db = tmp_path / "jobs.sqlite3"
+    manager = JobManager(_double, db, max_workers=1)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with manager._connect() as conn:
+        for job_id, status, owner in [("queued", JOB_QUEUED, dead.pid), ("running", JOB_RUNNING, dead.pid),
+                                      ("alive", JOB_RUNNING, os.getpid())]:
+            conn.execute(
+                "INSERT INTO jobs (id, status, created, payload, owner) VALUES (?, ?, ?, ?, ?)",
+                (job_id, status, time.time(), pickle.dumps(None), owner),
+            )
+
+    JobManager(_double, db, max_workers=1)
+    assert manager.get("queued").status == JOB_FAILED
+    assert manager.get("running").status == JOB_FAILED
+    assert "worker" in manager.get("running").error
+    assert manager.get("alive").status == JOB_RUNNING
+
+
+def test_finished_jobs_expire(tmp_path):
+    manager = JobManager(_double, tmp_path / "jobs.sqlite3", max_workers=1, ttl_sec=0.0)
+    first = _wait(manager, manager.submit(1).id)
+    assert first.status == JOB_DONE
+    time.sleep(0.01)
+    _wait(manager, manager.submit(2).id)
+    assert manager.get(first.id) is None
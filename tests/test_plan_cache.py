@@ -0,0 +1,233 @@
+"""Chiave di cache, due livelli di PlanCache e deduplica con SingleFlight."""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from web_backend.plan_cache import PlanCache, request_cache_key
+from web_backend.single_flight import SingleFlight
+from weekly_planner.models import PlanResult
+
+
+def _result(value: int = 1) -> PlanResult:
+    return PlanResult(
+        plans=[np.full((5, 6, 2), value, dtype=int)],
+        scores=[float(value)],
+        week_labels=["A"],
+        subject_plans=[np.full((5, 6, 2), value, dtype=int)],
+        solve_stats=[{"status": "Optimal"}],
+    )
+
+
+# ----------------------------------------------------------------------
+# request_cache_key
+# ----------------------------------------------------------------------
+
+
+def test_key_ignores_names_and_existing_plans():
+    base = {"days": 5, "hours_matrix": [[1, 2]], "method": "mip", "class_names": ["1A", "1B"]}
+    renamed = dict(base, class_names=["2A", "2B"], professor_names=["Rossi"], plan=[[[1]]])
+    assert request_cache_key(base) == request_cache_key(renamed)
+
+
+def test_key_depends_on_solver_fields_and_method():
+    base = {"days": 5, "hours_matrix": [[1, 2]], "method": "mip"}
+    assert request_cache_key(base) != request_cache_key(dict(base, hours_matrix=[[2, 1]]))
+    assert request_cache_key(base) == request_cache_key(dict(base, method="MIP"))
+    assert request_cache_key(dict(base, method=None)) == request_cache_key(base)
+
+
+@pytest.mark.parametrize("method", ["greedy", "evolve", "mip-warm", "lns", "portfolio"])
+def test_randomized_methods_need_a_seed(method):
+    payload = {"days": 5, "method": method}
+    assert request_cache_key(payload) is None
+    assert request_cache_key(dict(payload, seed=3)) is not None
+
+
+# ----------------------------------------------------------------------
+# PlanCache
+# ----------------------------------------------------------------------
+
+
+def test_memory_cache_returns_copies():
+    cache = PlanCache()
+    cache.put("k", _result(1))
+    first = cache.get("k")
+    first.plans[0][:] = 9
+    first.solve_stats[0]["status"] = "changed"
+    second = cache.get("k")
+    assert (second.plans[0] == 1).all()
+    assert second.solve_stats[0]["status"] == "Optimal"
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["stores"]) == (2, 1, 1)
+
+
+def test_empty_results_are_not_stored():
+    cache = PlanCache()
+    cache.put("k", PlanResult(plans=[], scores=[], week_labels=["A"]))
+    assert cache.get("k") is None
+
+
+def test_disk_cache_is_shared(tmp_path):
+    db = tmp_path / "cache.sqlite3"
+    PlanCache(db_path=db).put("k", _result(3))
+    other = PlanCache(db_path=db)
+    hit = other.get("k")
+    assert hit is not None and hit.scores == [3.0]
+    assert (hit.subject_plans[0] == 3).all()
+    assert other.get("k").scores == [3.0]
+    stats = other.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["disk_entries"]) == (1, 1, 1)
+
+
+def test_memory_lru_eviction():
+    cache = PlanCache(max_memory_entries=2)
+    for key in "abc":
+        cache.put(key, _result())
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expires_entries(tmp_path):
+    cache = PlanCache(db_path=tmp_path / "cache.sqlite3", ttl_sec=0.05)
+    cache.put("k", _result())
+    time.sleep(0.1)
+    assert cache.get("k") is None
+
+
+def test_disk_size_limit(tmp_path):
+    cache = PlanCache(db_path=tmp_path / "cache.sqlite3", max_disk_bytes=1)
+    cache.put("a", _result())
+    cache.put("b", _result())
+    assert cache.stats()["disk_entries"] == 0
+
+
+# ----------------------------------------------------------------------
+# SingleFlight
+# ----------------------------------------------------------------------
+
+
+def _concurrent(flight, key, fn, count=4, recheck=None):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn, recheck=recheck))
+        except Exception as exc:  # noqa: BLE001 - raccolta per il test
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results, errors
+
+
+def test_single_flight_runs_once_per_key():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def solve():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    timer = threading.Timer(0.3, release.set)
+    timer.start()
+    results, errors = _concurrent(flight, "k", solve)
+    timer.join()
+    assert not errors
+    assert len(calls) == 1
+    assert len(results) == 4 and all(r is results[0] for r in results)
+    stats = flight.stats()
+    assert (stats["leaders"], stats["coalesced_local"], stats["inflight"]) == (1, 3, 0)
+    # a risoluzione finita, una nuova chiamata riesegue
+    flight.do("k", solve)
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def solve():
+        release.wait(5)
+        raise ValueError("infattibile")
+
+    timer = threading.Timer(0.3, release.set)
+    timer.start()
+    results, errors = _concurrent(flight, "k", solve)
+    timer.join()
+    assert not results
+    assert len(errors) == 4 and all(isinstance(e, ValueError) for e in errors)
+    assert flight.stats()["inflight"] == 0
+
+
+def test_single_flight_host_lock_rechecks(tmp_path):
+    # Due istanze (come due processi dello stesso host) sulla stessa chiave:
+    # chi attende il lock usa recheck() invece di rieseguire
+    first, second = SingleFlight(tmp_path), SingleFlight(tmp_path)
+    store = {}
+    inside = threading.Event()
+
+    def leader_solve():
+        inside.set()
+        time.sleep(0.3)
+        store["k"] = "piano"
+        return "piano"
+
+    leader = threading.Thread(target=first.do, args=("k", leader_solve))
+    leader.start()
+    inside.wait(5)
+    value = second.do("k", lambda: "ricalcolato", recheck=lambda: store.get("k"))
+    leader.join()
+    assert value == "piano"
+    assert second.stats()["coalesced_host"] == 1
+
+
+# ----------------------------------------------------------------------
+# generate_with_method: cache + single flight
+# ----------------------------------------------------------------------
+
+
+def test_generate_with_method_solves_each_key_once(monkeypatch):
+    from web_backend import main
+
+    calls = []
+    release = threading.Event()
+
+    def fake_solve(config, method, subject_ctx=None, on_incumbent=None):
+        calls.append(method)
+        release.wait(5)
+        return _result(len(calls))
+
+    monkeypatch.setattr(main, "plan_cache", PlanCache())
+    monkeypatch.setattr(main, "single_flight", SingleFlight())
+    monkeypatch.setattr(main, "_solve_with_method", fake_solve)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(main.generate_with_method(None, "mip", cache_key="k")))
+        for _ in range(3)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.3)
+    release.set()
+    for t in threads:
+        t.join(timeout=10)
+    assert len(results) == 3 and all(r.scores == [1.0] for r in results)
+    assert calls == ["mip"]
+
+    # richieste successive: dalla cache, senza risolvere
+    assert main.generate_with_method(None, "mip", cache_key="k").scores == [1.0]
+    assert calls == ["mip"]
+    # senza chiave (metodo randomizzato senza seed) si risolve sempre
+    main.generate_with_method(None, "greedy", cache_key=None)
+    assert calls == ["mip", "greedy"]
@@ -0,0 +1,353 @@
+# web_backend/jobs.py
+#
+# Job asincroni per la generazione dei piani: ogni job gira in un processo
+# separato (al massimo `max_workers` insieme per worker, gli altri restano
+# in coda), così il solver non blocca l'event loop di uvicorn. Il processo
+# pubblica eventi (stato, incumbent, risultato) che il padre raccoglie in un
+# thread di monitoraggio; gli endpoint li espongono via polling o
+# Server-Sent Events.
+#
+# Stato, eventi e risultati stanno in SQLite (lo stesso file della cache dei
+# piani), così qualunque worker gunicorn dell'host risponde su qualunque
+# job. Solo il worker che ha accettato il job ne possiede il processo: un
+# annullamento arrivato a un altro worker viene registrato nel database e
+# il thread di monitoraggio del proprietario lo esegue. Ogni job ricorda il
+# pid del worker proprietario: i job rimasti in coda o in esecuzione di un
+# worker che non esiste più (riavvio, crash) vengono chiusi come falliti.
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import queue as queue_mod
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from weekly_planner.parallel import process_context
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+@dataclass
+class Job:
+    """Fotografia di un job: eventi in ordine (con `seq` crescente) e risultato finale."""
+    id: str
+    payload: Any
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    events: List[dict] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+
+    def summary(self) -> dict:
+        incumbents = [e for e in self.events if e["type"] == "incumbent"]
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+            "incumbent": incumbents[-1]["data"] if incumbents else None,
+            "error": self.error,
+        }
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _job_process_main(fn, payload, events) -> None:
+    # Gruppo di processi proprio (CBC incluso) e SIGTERM come uscita pulita,
+    # così i blocchi finally (es. il portfolio) uccidono i loro figli.
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+
+    def emit(event_type: str, data: Any = None) -> None:
+        events.put((event_type, data))
+
+    try:
+        emit("result", fn(payload, emit))
+    except Exception as exc:
+        emit("error", repr(exc))
+
+
+class JobManager:
+    """
+    Coda di job eseguiti in processi separati, con lo stato in SQLite.
+
+    fn(payload, emit) viene eseguita nel processo figlio: emit(tipo, dati)
+    pubblica un evento (es. "incumbent", dati serializzabili in JSON) e il
+    valore di ritorno (serializzabile con pickle) diventa il risultato del
+    job. `fn` deve essere una funzione di modulo: il figlio parte con
+    forkserver/spawn e non eredita thread né lock del worker. I job
+    terminati restano consultabili per `ttl_sec`. I job orfani (worker
+    proprietario morto) vengono chiusi all'avvio e a ogni submit.
+    """
+
+    def __init__(self, fn: Callable[[Any, Callable[[str, Any], None]], Any], db_path: str | Path,
+                 max_workers: int | None = None, ttl_sec: float = 3600.0, cancel_grace_sec: float = 2.0):
+        self.fn = fn
+        self.db_path = str(db_path)
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.ttl_sec = ttl_sec
+        self.cancel_grace_sec = cancel_grace_sec
+        # processi dei job accettati da questo worker
+        self._procs: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.max_workers)
+        self._mp = process_context()
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, created REAL NOT NULL, finished REAL,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0, error TEXT, payload BLOB NOT NULL, result BLOB,"
+                " owner INTEGER)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                # database creato da una versione senza proprietario
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " job_id TEXT NOT NULL, seq INTEGER NOT NULL, type TEXT NOT NULL, data TEXT,"
+                " at REAL NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+        self._reap_orphans()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Una connessione per operazione: sicuro tra thread e processi
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # API pubblica
+    # ------------------------------------------------------------------
+
+    def submit(self, payload: Any) -> Job:
+        self._purge()
+        self._reap_orphans()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, created, payload, owner) VALUES (?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, time.time(), pickle.dumps(payload), os.getpid()),
+            )
+            self._add_event(conn, job_id, "status", {"status": JOB_QUEUED})
+        threading.Thread(target=self._run, args=(job_id, payload), daemon=True).start()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, created, finished, error, payload, result FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            events = self._events(conn, job_id, 0)
+        status, created, finished, error, payload, result = row
+        return Job(
+            id=job_id,
+            payload=pickle.loads(payload),
+            status=status,
+            created_at=created,
+            finished_at=finished,
+            events=events,
+            result=pickle.loads(result) if result is not None else None,
+            error=error,
+        )
+
+    def events_since(self, job_id: str, seq: int) -> List[dict]:
+        """Eventi del job con seq > `seq` (per polling incrementale e SSE)."""
+        with self._connect() as conn:
+            return self._events(conn, job_id, seq)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Annulla un job in coda o in esecuzione. Un job in coda passa subito a
+        "cancelled"; di uno in esecuzione si manda SIGTERM al gruppo di
+        processi, poi SIGKILL dopo `cancel_grace_sec`. Se il job appartiene
+        a un altro worker lo termina il suo thread di monitoraggio. Ritorna
+        False se il job non esiste o è già terminato.
+        """
+        with self._connect() as conn:
+            queued = conn.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, finished = ? WHERE id = ? AND status = ?",
+                (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED),
+            ).rowcount
+            if queued:
+                self._add_event(conn, job_id, "status", {"status": JOB_CANCELLED, "error": None})
+                return True
+            updated = conn.execute(
+                f"UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status NOT IN ({', '.join('?' * len(FINISHED_STATES))})",
+                (job_id, *FINISHED_STATES),
+            ).rowcount
+        if not updated:
+            return False
+        with self._lock:
+            proc = self._procs.get(job_id)
+        if proc is not None:
+            self._terminate(proc)
+        return True
+
+    # ------------------------------------------------------------------
+    # Interni
+    # ------------------------------------------------------------------
+
+    def _events(self, conn: sqlite3.Connection, job_id: str, seq: int) -> List[dict]:
+        rows = conn.execute(
+            "SELECT seq, type, data, at FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, seq),
+        ).fetchall()
+        return [{"seq": s, "type": t, "data": json.loads(d), "at": at} for s, t, d, at in rows]
+
+    def _add_event(self, conn: sqlite3.Connection, job_id: str, event_type: str, data: Any) -> None:
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, type, data, at)"
+            " SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM job_events WHERE job_id = ?",
+            (job_id, event_type, json.dumps(data), time.time(), job_id),
+        )
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _claim(self, job_id: str) -> bool:
+        """Passa il job da "queued" a "running"; False se nel frattempo è stato annullato."""
+        with self._connect() as conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = ? WHERE id = ? AND status = ?", (JOB_RUNNING, job_id, JOB_QUEUED)
+            ).rowcount
+            if claimed:
+                self._add_event(conn, job_id, "status", {"status": JOB_RUNNING})
+        return bool(claimed)
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: str | None = None) -> None:
+        with self._lock:
+            self._procs.pop(job_id, None)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                (status, pickle.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+            self._add_event(conn, job_id, "status", {"status": status, "error": error})
+
+    def _run(self, job_id: str, payload: Any) -> None:
+        with self._slots:
+            if not self._claim(job_id):
+                return
+            events = self._mp.Queue()
+            proc = self._mp.Process(target=_job_process_main, args=(self.fn, payload, events), daemon=False)
+            proc.start()
+            with self._lock:
+                self._procs[job_id] = proc
+
+            outcome: tuple | None = None
+            next_check = time.monotonic() + 0.5
+            while outcome is None:
+                try:
+                    event_type, data = events.get(timeout=0.5)
+                except queue_mod.Empty:
+                    if not proc.is_alive():
+                        break
+                else:
+                    if event_type in ("result", "error"):
+                        outcome = (event_type, data)
+                        break
+                    with self._connect() as conn:
+                        self._add_event(conn, job_id, event_type, data)
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + 0.5
+                    if self._cancel_requested(job_id):
+                        # annullato da un altro worker
+                        self._terminate(proc)
+
+            proc.join(timeout=self.cancel_grace_sec)
+            events.close()
+
+        if self._cancel_requested(job_id):
+            self._finish(job_id, JOB_CANCELLED)
+        elif outcome is None:
+            self._finish(job_id, JOB_FAILED, error=f"processo terminato (exit code {proc.exitcode})")
+        elif outcome[0] == "error":
+            self._finish(job_id, JOB_FAILED, error=outcome[1])
+        else:
+            self._finish(job_id, JOB_DONE, result=outcome[1])
+
+    def _terminate(self, proc) -> None:
+        if not proc.is_alive():
+            return
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                proc.terminate()
+            proc.join(timeout=self.cancel_grace_sec)
+            if proc.is_alive():
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    proc.kill()
+        else:
+            proc.terminate()
+        proc.join(timeout=self.cancel_grace_sec)
+
+    def _reap_orphans(self) -> None:
+        """Chiude come falliti i job non terminati il cui worker proprietario non esiste più."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+            for job_id, owner in rows:
+                if owner is not None and _pid_alive(owner):
+                    continue
+                error = "job interrotto: il worker che lo eseguiva è terminato"
+                orphaned = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status IN (?, ?)",
+                    (JOB_FAILED, error, time.time(), job_id, JOB_QUEUED, JOB_RUNNING),
+                ).rowcount
+                if orphaned:
+                    self._add_event(conn, job_id, "status", {"status": JOB_FAILED, "error": error})
+
+    def _purge(self) -> None:
+        """Dimentica i job terminati da più di `ttl_sec`."""
+        cutoff = time.time() - self.ttl_sec
+        with self._connect() as conn:
+            expired = [
+                jid for (jid,) in conn.execute(
+                    f"SELECT id FROM jobs WHERE finished < ? AND status IN ({', '.join('?' * len(FINISHED_STATES))})",
+                    (cutoff, *FINISHED_STATES),
+                )
+            ]
+            conn.executemany("DELETE FROM job_events WHERE job_id = ?", [(jid,) for jid in expired])
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(jid,) for jid in expired])
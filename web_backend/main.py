@@ -1,6 +1,8 @@
 # web_backend/main.py
 
 from typing import List, Optional
+import asyncio
+import os
 import random
 import json
 from datetime import datetime
@@ -8,16 +10,18 @@ from pathlib import Path
 
 import numpy as np
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
 from weekly_planner.models import PlanResult, PlannerConfig
 from weekly_planner.planner import WeeklyPlanner
-from weekly_planner.mip_planner import MIPWeeklyPlanner
+from weekly_planner.evolve_planner import EvolutionaryPlanner
+from weekly_planner.decompose import solve_decomposed
+from weekly_planner.lns import LNSPlanner
+from weekly_planner.portfolio import solve_portfolio
 from weekly_planner.subject_planner import (
-    SubjectMIPPlanner,
     SubjectRandomPlanner,
     normalize_subject_input,
     validate_subject_data,
@@ -27,6 +31,10 @@ from weekly_planner.pdf_export import render_classes_pdf, render_professors_pdf
 from weekly_planner.excel_export import render_classes_excel, render_professors_excel
 from weekly_planner.validation import validate_config
 
+from web_backend.jobs import FINISHED_STATES, JOB_CANCELLED, JOB_DONE, JobManager
+from web_backend.plan_cache import cache_from_env, request_cache_key
+from web_backend.single_flight import SingleFlight
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_DIR = BASE_DIR / "web_frontend"
@@ -35,6 +43,9 @@ STATIC_DIR = FRONTEND_DIR / "static"
 EXAMPLES_DIR = BASE_DIR / "examples"
 
 app = FastAPI()
+plan_cache = cache_from_env(BASE_DIR / ".cache")
+# PLANNER_LOCK_DIR abilita il coordinamento tra processi tramite lock file
+single_flight = SingleFlight(lock_dir=os.environ.get("PLANNER_LOCK_DIR") or None)
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 # Serve file statici (CSS/JS) da /static
@@ -145,39 +156,155 @@ def build_config_from_request(req: PlannerRequest) -> PlannerConfig:
     )
 
 
-def generate_with_method(config: PlannerConfig, method: str, subject_ctx=None):
+def generate_with_method(config: PlannerConfig, method: str, subject_ctx=None, on_incumbent=None,
+                         cache_key: Optional[str] = None):
     """
     Helper: lancia il planner giusto in base a 'method'.
     Ritorna sempre un PlanResult.
+
+    on_incumbent(sorgente, PlanResult), se fornita, riceve i piani
+    intermedi (usata dai job asincroni per lo streaming dei progressi).
+    Con cache_key (vedi request_cache_key) il risultato viene prima
+    cercato in plan_cache e, se nuovo, salvato; le richieste identiche
+    concorrenti condividono una sola risoluzione (single_flight).
     """
+    if cache_key is None:
+        return _solve_with_method(config, method, subject_ctx, on_incumbent)
+
+    cached = plan_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    def solve_and_store() -> PlanResult:
+        result = _solve_with_method(config, method, subject_ctx, on_incumbent)
+        plan_cache.put(cache_key, result)
+        return result
+
+    # recheck: un altro processo dell'host potrebbe aver appena risolto la stessa chiave
+    return single_flight.do(cache_key, solve_and_store, recheck=lambda: plan_cache.get(cache_key))
+
+
+def _solve_with_method(config: PlannerConfig, method: str, subject_ctx=None, on_incumbent=None) -> PlanResult:
     method = (method or "mip").lower()
+    if method == "portfolio":
+        # Motori in parallelo in processi separati, vince il piano migliore
+        return solve_portfolio(config, subject_ctx, time_limit_sec=60, on_incumbent=on_incumbent)
     if subject_ctx is not None:
+        # joint_weeks risolve tutte le settimane in un solo modello, con un
+        # solo budget; il backend matrix uccide CBC se sfora il time limit
         if method == "greedy":
-            # Greedy veloce
+            # Greedy veloce + ricerca locale
+            planner = SubjectGreedyPlanner(config, subject_ctx, seed=config.seed)
+            return planner.generate(time_limit_sec=5.0, improve_sec=2.0)
+
+        if method == "evolve":
+            # L'algoritmo evolutivo lavora sui piani senza materie: per le
+            # materie si usa il greedy CSP con un riavvio per CPU
             planner = SubjectGreedyPlanner(config, subject_ctx, seed=config.seed)
-            return planner.generate(time_limit_sec=5.0)
-        
-        # Default per "mip": usa il vero MIPPlanner
-        planner = SubjectMIPPlanner(config, subject_ctx)
-        result = planner.solve(time_limit_sec=60)
+            return planner.generate(time_limit_sec=10.0, workers=os.cpu_count() or 1, improve_sec=2.0)
+
+        if method == "mip-warm":
+            # Greedy (materie comuni uguali tra le settimane) come soluzione
+            # di partenza, poi MIP con budget ridotto
+            greedy = SubjectGreedyPlanner(config, subject_ctx, seed=config.seed).generate(
+                time_limit_sec=5.0, improve_sec=2.0, shared_weeks=True
+            )
+            if greedy.plans and on_incumbent is not None:
+                on_incumbent("greedy", greedy)
+            try:
+                result = solve_decomposed(
+                    config,
+                    subject_ctx,
+                    time_limit_sec=30,
+                    warm_start=greedy if greedy.plans else None,
+                    joint_weeks=True,
+                    backend="matrix",
+                )
+            except Exception:
+                # Errore del solver: il greedy resta un piano valido
+                if not greedy.plans:
+                    raise
+                return greedy
+            return result if result.plans else greedy
+
+        if method == "lns":
+            # Greedy come partenza, poi LNS: sotto-MIP piccoli con il resto fissato.
+            # Con settimane A/B l'LNS lavora sul modello congiunto e richiede
+            # una partenza con le materie comuni uguali nelle due settimane
+            greedy = SubjectGreedyPlanner(config, subject_ctx, seed=config.seed).generate(
+                time_limit_sec=5.0, shared_weeks=True
+            )
+            if not greedy.plans:
+                return solve_decomposed(config, subject_ctx, time_limit_sec=60, joint_weeks=True, backend="matrix")
+            if on_incumbent is not None:
+                on_incumbent("greedy", greedy)
+            return LNSPlanner(config, subject_ctx, seed=config.seed).improve(greedy, time_limit_sec=60)
+
+        # Default per "mip": usa il vero MIPPlanner, una componente indipendente per processo
+        # joint_weeks: le materie senza A/B hanno lo stesso orario nelle due settimane
+        result = solve_decomposed(config, subject_ctx, time_limit_sec=60, joint_weeks=True, backend="matrix")
         if not result.plans:
-            # Se MIP fallisce, ritenta con greedy come fallback
+            # Se MIP fallisce, ritenta con greedy come fallback, sempre con
+            # le materie comuni uguali tra le settimane
             fallback = SubjectGreedyPlanner(config, subject_ctx, seed=config.seed)
-            return fallback.generate(time_limit_sec=5.0)
+            return fallback.generate(time_limit_sec=5.0, shared_weeks=True)
         return result
     if method == "greedy":
         planner = WeeklyPlanner(config)
         if hasattr(config, "seed") and config.seed is not None:
             np.random.seed(config.seed)
             random.seed(config.seed)
-        # Continua finché lo score è adeguato o si esauriscono 5 secondi
+        # Continua finché lo score è adeguato o si esauriscono 5 secondi,
+        # poi ricerca locale sul migliore
         return planner.generate_until_time(
             target_score=0.1,
             time_limit_sec=5.0,
             show_progress=False,
+            improve_sec=2.0,
         )
-    planner = MIPWeeklyPlanner(config)
-    result = planner.solve(time_limit_sec=60)
+    if method == "evolve":
+        # Algoritmo genetico con riparazione, un'isola per CPU
+        planner = EvolutionaryPlanner(config, seed=config.seed)
+        return planner.generate(time_limit_sec=10.0, workers=os.cpu_count() or 1, improve_sec=2.0)
+    if method == "mip-warm":
+        if hasattr(config, "seed") and config.seed is not None:
+            np.random.seed(config.seed)
+            random.seed(config.seed)
+        greedy = WeeklyPlanner(config).generate_until_time(
+            target_score=0.1,
+            time_limit_sec=5.0,
+            show_progress=False,
+            improve_sec=2.0,
+        )
+        if greedy.plans and on_incumbent is not None:
+            on_incumbent("greedy", greedy)
+        try:
+            result = solve_decomposed(
+                config,
+                time_limit_sec=30,
+                warm_start=greedy if greedy.plans else None,
+            )
+        except Exception:
+            # Errore del solver: il greedy resta un piano valido
+            if not greedy.plans:
+                raise
+            return greedy
+        return result if result.plans else greedy
+    if method == "lns":
+        if hasattr(config, "seed") and config.seed is not None:
+            np.random.seed(config.seed)
+            random.seed(config.seed)
+        greedy = WeeklyPlanner(config).generate_until_time(
+            target_score=0.1,
+            time_limit_sec=5.0,
+            show_progress=False,
+        )
+        if not greedy.plans:
+            return solve_decomposed(config, time_limit_sec=60)
+        if on_incumbent is not None:
+            on_incumbent("greedy", greedy)
+        return LNSPlanner(config, seed=config.seed).improve(greedy, time_limit_sec=60)
+    result = solve_decomposed(config, time_limit_sec=60)
     if not result.plans:
         fallback = WeeklyPlanner(config)
         return fallback.generate_until_time(
@@ -194,7 +321,7 @@ def get_or_generate_result(req: PlannerRequest, config: PlannerConfig, subject_c
     evitando di rigenerare. Altrimenti lancia il planner.
     """
     if req.plan is None:
-        return generate_with_method(config, req.method, subject_ctx)
+        return generate_with_method(config, req.method, subject_ctx, cache_key=request_cache_key(req.model_dump()))
 
     plans = []
     scores = []
@@ -313,15 +440,15 @@ def _aggregate_availability_by_prof(req: PlannerRequest, A: np.ndarray) -> Optio
     return agg
 
 
-@app.post("/api/generate-plan")
-async def generate_plan(req: PlannerRequest):
+def prepare_request(req: PlannerRequest):
     """
-    Genera un piano con il metodo scelto (random o MIP).
+    Costruisce config e contesto materie dalla richiesta e li valida.
+    Ritorna (config, subject_ctx, None) oppure (None, None, risposta di errore).
     """
     config = build_config_from_request(req)
     validation_errors = validate_config(config)
     if validation_errors:
-        return {
+        return None, None, {
             "ok": False,
             "message": "Parametri non validi.",
             "errors": validation_errors,
@@ -330,7 +457,7 @@ async def generate_plan(req: PlannerRequest):
     if subject_ctx:
         subject_errors = validate_subject_data(subject_ctx, config)
         if subject_errors:
-            return {
+            return None, None, {
                 "ok": False,
                 "message": "Parametri materie non validi.",
                 "errors": subject_errors,
@@ -338,8 +465,14 @@ async def generate_plan(req: PlannerRequest):
     else:
         # Nessun contesto materie: lascia lavorare il planner legacy (anche se H è vuota produrrà un piano vuoto).
         pass
-    result = generate_with_method(config, req.method, subject_ctx)
+    return config, subject_ctx, None
+
 
+def build_plan_response(req: PlannerRequest, config: PlannerConfig, subject_ctx, result: PlanResult) -> dict:
+    """
+    Converte un PlanResult nella risposta JSON di /api/generate-plan
+    (stessa forma anche per i risultati dei job).
+    """
     if not result.plans:
         return {
             "ok": False,
@@ -398,6 +531,26 @@ async def generate_plan(req: PlannerRequest):
             }
         if result.subject_plans and len(result.subject_plans) > 1:
             response["subject_plan_week_b"] = result.subject_plans[1].tolist()
+    return response
+
+
+@app.post("/api/generate-plan")
+async def generate_plan(req: PlannerRequest):
+    """
+    Genera un piano con il metodo scelto (random o MIP).
+    """
+    config, subject_ctx, error = prepare_request(req)
+    if error:
+        return error
+    # In un thread: l'event loop resta libero e i duplicati concorrenti si accodano al leader
+    result = await asyncio.to_thread(
+        generate_with_method, config, req.method, subject_ctx,
+        cache_key=request_cache_key(req.model_dump()),
+    )
+
+    response = build_plan_response(req, config, subject_ctx, result)
+    if not response["ok"]:
+        return response
     persist_example_plan(
         response
         | {"method": req.method}
@@ -411,36 +564,198 @@ async def generate_plan(req: PlannerRequest):
     return response
 
 
-@app.post("/api/classes-pdf")
-async def classes_pdf(req: PlannerRequest, week_index: int = 0):
+@app.get("/api/cache/stats")
+async def cache_stats():
     """
-    Genera il PDF dei piani per classi usando lo stesso metodo richiesto.
-    Usa week_index per scegliere la settimana (0 = A, 1 = B).
+    Contatori della cache dei piani (hit/miss per livello, evizioni, dimensioni)
+    e delle risoluzioni coalescenti (leader vs duplicati serviti).
     """
-    config = build_config_from_request(req)
-    validation_errors = validate_config(config)
-    if validation_errors:
-        return {
+    return {"ok": True} | plan_cache.stats() | {"single_flight": single_flight.stats()}
+
+
+# ----------------------------------------------------------------------
+# Job asincroni
+# ----------------------------------------------------------------------
+
+def _run_job(payload: dict, emit) -> dict:
+    """
+    Corpo di un job (eseguito nel processo figlio): stessa logica di
+    /api/generate-plan, con gli incumbent pubblicati come eventi.
+    """
+    req = PlannerRequest(**payload)
+    config, subject_ctx, error = prepare_request(req)
+    if error:
+        return {"response": error, "result": None}
+
+    def on_incumbent(source: str, result: PlanResult) -> None:
+        emit("incumbent", {
+            "source": source,
+            "score": float(sum(result.scores)) if result.scores else None,
+            "plan": result.plans[0].tolist() if result.plans else None,
+        })
+
+    result = generate_with_method(
+        config, req.method, subject_ctx,
+        on_incumbent=on_incumbent,
+        cache_key=request_cache_key(payload),
+    )
+    response = build_plan_response(req, config, subject_ctx, result)
+    if response["ok"]:
+        persist_example_plan(
+            response
+            | {"method": req.method}
+            | {"request": {"payload": payload, "using_subject_planner": bool(subject_ctx)}}
+        )
+    return {"response": response, "result": result if response["ok"] else None}
+
+
+# Stato dei job in SQLite, condiviso dai worker gunicorn (di default nel file della cache)
+job_manager = JobManager(
+    _run_job,
+    db_path=os.environ.get("PLANNER_JOBS_DB") or plan_cache.db_path or str(BASE_DIR / ".cache" / "jobs.sqlite3"),
+    max_workers=int(os.environ.get("PLANNER_JOB_WORKERS", "0")) or None,
+)
+
+
+def _job_not_found(job_id: str) -> dict:
+    return {"ok": False, "message": f"Job non trovato: {job_id}"}
+
+
+@app.post("/api/jobs")
+async def create_job(req: PlannerRequest):
+    """
+    Accoda la generazione del piano e ritorna subito l'id del job.
+    """
+    job = job_manager.submit(req.model_dump())
+    return {"ok": True, "job_id": job.id, "status": job.status}
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, since: int = 0):
+    """
+    Stato del job per il polling: ultimo incumbent, eventi con seq > since
+    e, se concluso, la stessa risposta di /api/generate-plan.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    out = {"ok": True} | job.summary()
+    out["new_events"] = job_manager.events_since(job_id, since)
+    if job.status == JOB_DONE:
+        out["response"] = job.result["response"]
+    return out
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Stream Server-Sent Events del job (status, incumbent). Lo stream si
+    chiude dopo l'evento di stato finale; `Last-Event-ID` riprende da lì.
+    """
+    if job_manager.get(job_id) is None:
+        return _job_not_found(job_id)
+
+    async def stream():
+        last_seq = int(request.headers.get("last-event-id") or 0)
+        while True:
+            job = job_manager.get(job_id)
+            if job is None or await request.is_disconnected():
+                return
+            for event in job_manager.events_since(job_id, last_seq):
+                last_seq = event["seq"]
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+            if job.status in FINISHED_STATES and not job_manager.events_since(job_id, last_seq):
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """
+    Risposta finale del job (forma di /api/generate-plan).
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    if job.status != JOB_DONE:
+        return {"ok": False, "message": f"Job non concluso (stato: {job.status}).", "status": job.status,
+                "error": job.error}
+    return job.result["response"]
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Annulla un job in coda o in esecuzione (il solver CBC viene terminato).
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    if not await asyncio.to_thread(job_manager.cancel, job_id):
+        return {"ok": False, "message": f"Job già concluso (stato: {job.status})."}
+    return {"ok": True, "job_id": job_id, "status": JOB_CANCELLED}
+
+
+def _job_export(job_id: str):
+    """
+    Richiesta e PlanResult di un job concluso, per gli endpoint di
+    esportazione. Ritorna (req, config, subject_ctx, result, None) oppure
+    (None, None, None, None, risposta di errore).
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return None, None, None, None, _job_not_found(job_id)
+    if job.status != JOB_DONE or job.result["result"] is None:
+        return None, None, None, None, {
             "ok": False,
-            "message": "Parametri non validi per generare il PDF.",
-            "errors": validation_errors,
+            "message": f"Nessun piano disponibile per il job (stato: {job.status}).",
         }
+    req = PlannerRequest(**job.payload)
+    config = build_config_from_request(req)
     subject_ctx = normalize_subject_input(req, config)
-    if subject_ctx:
-        subject_errors = validate_subject_data(subject_ctx, config)
-        if subject_errors:
+    return req, config, subject_ctx, job.result["result"], None
+
+
+@app.post("/api/classes-pdf")
+async def classes_pdf(req: Optional[PlannerRequest] = None, week_index: int = 0, job_id: Optional[str] = None):
+    """
+    Genera il PDF dei piani per classi usando lo stesso metodo richiesto.
+    Usa week_index per scegliere la settimana (0 = A, 1 = B); con job_id
+    usa il piano di un job concluso invece di rigenerarlo.
+    """
+    if job_id is not None:
+        req, config, subject_ctx, result, err = _job_export(job_id)
+        if err:
+            return err
+    elif req is None:
+        return {"ok": False, "message": "Serve il payload della richiesta oppure job_id."}
+    else:
+        config = build_config_from_request(req)
+        validation_errors = validate_config(config)
+        if validation_errors:
             return {
                 "ok": False,
-                "message": "Parametri materie non validi per il PDF.",
-                "errors": subject_errors,
+                "message": "Parametri non validi per generare il PDF.",
+                "errors": validation_errors,
+            }
+        subject_ctx = normalize_subject_input(req, config)
+        if subject_ctx:
+            subject_errors = validate_subject_data(subject_ctx, config)
+            if subject_errors:
+                return {
+                    "ok": False,
+                    "message": "Parametri materie non validi per il PDF.",
+                    "errors": subject_errors,
+                }
+        try:
+            result = await asyncio.to_thread(get_or_generate_result, req, config, subject_ctx)
+        except ValueError as e:
+            return {
+                "ok": False,
+                "message": str(e),
             }
-    try:
-        result = get_or_generate_result(req, config, subject_ctx)
-    except ValueError as e:
-        return {
-            "ok": False,
-            "message": str(e),
-        }
 
     if not result.plans:
         return {
@@ -461,35 +776,43 @@ async def classes_pdf(req: PlannerRequest, week_index: int = 0):
 
 
 @app.post("/api/professors-pdf")
-async def professors_pdf(req: PlannerRequest, week_index: int = 0):
+async def professors_pdf(req: Optional[PlannerRequest] = None, week_index: int = 0, job_id: Optional[str] = None):
     """
     Genera il PDF dei piani per professori usando lo stesso metodo richiesto.
-    Usa week_index per scegliere la settimana (0 = A, 1 = B).
+    Usa week_index per scegliere la settimana (0 = A, 1 = B); con job_id
+    usa il piano di un job concluso invece di rigenerarlo.
     """
-    config = build_config_from_request(req)
-    validation_errors = validate_config(config)
-    if validation_errors:
-        return {
-            "ok": False,
-            "message": "Parametri non validi per generare il PDF.",
-            "errors": validation_errors,
-        }
-    subject_ctx = normalize_subject_input(req, config)
-    if subject_ctx:
-        subject_errors = validate_subject_data(subject_ctx, config)
-        if subject_errors:
+    if job_id is not None:
+        req, config, subject_ctx, result, err = _job_export(job_id)
+        if err:
+            return err
+    elif req is None:
+        return {"ok": False, "message": "Serve il payload della richiesta oppure job_id."}
+    else:
+        config = build_config_from_request(req)
+        validation_errors = validate_config(config)
+        if validation_errors:
             return {
                 "ok": False,
-                "message": "Parametri materie non validi per il PDF.",
-                "errors": subject_errors,
+                "message": "Parametri non validi per generare il PDF.",
+                "errors": validation_errors,
+            }
+        subject_ctx = normalize_subject_input(req, config)
+        if subject_ctx:
+            subject_errors = validate_subject_data(subject_ctx, config)
+            if subject_errors:
+                return {
+                    "ok": False,
+                    "message": "Parametri materie non validi per il PDF.",
+                    "errors": subject_errors,
+                }
+        try:
+            result = await asyncio.to_thread(get_or_generate_result, req, config, subject_ctx)
+        except ValueError as e:
+            return {
+                "ok": False,
+                "message": str(e),
             }
-    try:
-        result = get_or_generate_result(req, config, subject_ctx)
-    except ValueError as e:
-        return {
-            "ok": False,
-            "message": str(e),
-        }
 
     if not result.plans:
         return {
@@ -528,14 +851,20 @@ def _build_result_for_export(req: PlannerRequest, config: PlannerConfig, subject
 
 
 @app.post("/api/classes-excel")
-async def classes_excel(req: PlannerRequest, week_index: int = 0):
+async def classes_excel(req: Optional[PlannerRequest] = None, week_index: int = 0, job_id: Optional[str] = None):
     """
     Genera il file Excel dei piani per classi (un foglio per classe).
-    Usa week_index per scegliere la settimana (0 = A, 1 = B).
+    Usa week_index per scegliere la settimana (0 = A, 1 = B); con job_id
+    usa il piano di un job concluso.
     """
-    config = build_config_from_request(req)
-    subject_ctx = normalize_subject_input(req, config)
-    result, err = _build_result_for_export(req, config, subject_ctx)
+    if job_id is not None:
+        req, config, subject_ctx, result, err = _job_export(job_id)
+    elif req is None:
+        err = {"ok": False, "message": "Serve il payload della richiesta oppure job_id."}
+    else:
+        config = build_config_from_request(req)
+        subject_ctx = normalize_subject_input(req, config)
+        result, err = await asyncio.to_thread(_build_result_for_export, req, config, subject_ctx)
     if err:
         return err
 
@@ -552,14 +881,20 @@ async def classes_excel(req: PlannerRequest, week_index: int = 0):
 
 
 @app.post("/api/professors-excel")
-async def professors_excel(req: PlannerRequest, week_index: int = 0):
+async def professors_excel(req: Optional[PlannerRequest] = None, week_index: int = 0, job_id: Optional[str] = None):
     """
     Genera il file Excel dei piani per professori (un foglio per professore).
-    Usa week_index per scegliere la settimana (0 = A, 1 = B).
+    Usa week_index per scegliere la settimana (0 = A, 1 = B); con job_id
+    usa il piano di un job concluso.
     """
-    config = build_config_from_request(req)
-    subject_ctx = normalize_subject_input(req, config)
-    result, err = _build_result_for_export(req, config, subject_ctx)
+    if job_id is not None:
+        req, config, subject_ctx, result, err = _job_export(job_id)
+    elif req is None:
+        err = {"ok": False, "message": "Serve il payload della richiesta oppure job_id."}
+    else:
+        config = build_config_from_request(req)
+        subject_ctx = normalize_subject_input(req, config)
+        result, err = await asyncio.to_thread(_build_result_for_export, req, config, subject_ctx)
     if err:
         return err
 
@@ -0,0 +1,243 @@
+# web_backend/plan_cache.py
+#
+# Cache dei PlanResult indirizzata per contenuto: la chiave è l'hash SHA-256
+# della richiesta normalizzata (solo i campi che influenzano il solver, più
+# method e seed). I metodi randomizzati senza seed non vengono messi in
+# cache: ogni richiesta deve poter dare un piano diverso. Due livelli: LRU in memoria per processo e SQLite su disco
+# condiviso da tutti i worker gunicorn dello stesso host.
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from weekly_planner.models import PlanResult
+
+# Campi della richiesta che non cambiano il risultato del solver: piani già
+# generati ed etichette (classi, docenti, materie e ore sono riferiti per indice)
+NON_SOLVER_FIELDS = {
+    "plan",
+    "plan_week_b",
+    "subject_plan",
+    "subject_plan_week_b",
+    "hour_names",
+    "class_names",
+    "professor_names",
+    "subject_names",
+}
+
+# Metodi con una componente casuale (o dipendente dai tempi, come la gara
+# del portfolio): senza seed non sono ripetibili
+RANDOMIZED_METHODS = {"greedy", "evolve", "mip-warm", "lns", "portfolio"}
+
+
+def request_cache_key(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Hash canonico di una richiesta (dict di PlannerRequest.model_dump()):
+    esclude i piani già generati e i nomi (rinominare una classe non
+    rilancia il solver), normalizza `method` e serializza con chiavi
+    ordinate. Ritorna None (niente cache) per i metodi randomizzati
+    senza `seed`.
+    """
+    data = {k: v for k, v in payload.items() if k not in NON_SOLVER_FIELDS}
+    data["method"] = (data.get("method") or "mip").lower()
+    if data["method"] in RANDOMIZED_METHODS and data.get("seed") is None:
+        return None
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def result_to_json(result: PlanResult) -> str:
+    return json.dumps({
+        "plans": [P.tolist() for P in result.plans],
+        "scores": [float(s) for s in result.scores],
+        "week_labels": result.week_labels,
+        "subject_plans": [S.tolist() for S in result.subject_plans] if result.subject_plans else None,
+        "solve_stats": result.solve_stats,
+    })
+
+
+def result_from_json(text: str) -> PlanResult:
+    data = json.loads(text)
+    return PlanResult(
+        plans=[np.array(P, dtype=int) for P in data["plans"]],
+        scores=data["scores"],
+        week_labels=data["week_labels"],
+        subject_plans=[np.array(S, dtype=int) for S in data["subject_plans"]] if data["subject_plans"] else None,
+        solve_stats=data["solve_stats"],
+    )
+
+
+class PlanCache:
+    """
+    Cache a due livelli per i PlanResult.
+
+    - memoria: LRU di `max_memory_entries` elementi (per processo)
+    - disco: SQLite in `db_path` (None = solo memoria), al massimo
+      `max_disk_bytes` di dati; le voci più vecchie di `ttl_sec` scadono
+      in entrambi i livelli
+
+    Si salvano solo risultati con almeno un piano. Ogni `get` ritorna una
+    copia, così chi la modifica non tocca i risultati degli altri. `stats()`
+    riporta hit/miss per livello ed evizioni.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path | None = None,
+        max_memory_entries: int = 64,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        ttl_sec: float = 7 * 24 * 3600,
+    ):
+        self.db_path = str(db_path) if db_path is not None else None
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_sec = ttl_sec
+        self._memory: "OrderedDict[str, tuple[float, PlanResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if self.db_path is not None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS plans ("
+                    " key TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL,"
+                    " size INTEGER NOT NULL, data TEXT NOT NULL)"
+                )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Una connessione per operazione: sicuro tra thread e processi
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # API pubblica
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[PlanResult]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, result = entry
+                if now - created <= self.ttl_sec:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return copy.deepcopy(result)
+                del self._memory[key]
+                self.counters["evictions"] += 1
+
+        if self.db_path is not None:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT created, data FROM plans WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl_sec),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE plans SET accessed = ? WHERE key = ?", (now, key))
+            if row is not None:
+                result = result_from_json(row[1])
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                    self._remember(key, row[0], result)
+                return copy.deepcopy(result)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, result: PlanResult) -> None:
+        if not result.plans:
+            return
+        now = time.time()
+        with self._lock:
+            self.counters["stores"] += 1
+            self._remember(key, now, copy.deepcopy(result))
+        if self.db_path is None:
+            return
+        data = result_to_json(result)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plans (key, created, accessed, size, data) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(data), data),
+            )
+            self._evict_disk(conn, now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.db_path is not None:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM plans")
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["memory_entries"] = len(self._memory)
+        lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_ratio"] = (out["memory_hits"] + out["disk_hits"]) / lookups if lookups else 0.0
+        if self.db_path is not None:
+            with self._connect() as conn:
+                count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM plans").fetchone()
+            out["disk_entries"] = count
+            out["disk_bytes"] = size
+        return out
+
+    # ------------------------------------------------------------------
+    # Interni
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, created: float, result: PlanResult) -> None:
+        # Da chiamare con self._lock acquisito
+        self._memory[key] = (created, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _evict_disk(self, conn: sqlite3.Connection, now: float) -> None:
+        """Rimuove le voci scadute, poi le meno usate finché si sta nel limite di byte."""
+        expired = conn.execute("DELETE FROM plans WHERE created < ?", (now - self.ttl_sec,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM plans").fetchone()[0]
+        removed = 0
+        if total > self.max_disk_bytes:
+            for key, size in conn.execute("SELECT key, size FROM plans ORDER BY accessed").fetchall():
+                if total <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        with self._lock:
+            self.counters["evictions"] += expired + removed
+
+
+def cache_from_env(default_dir: Path) -> PlanCache:
+    """
+    PlanCache configurata da variabili d'ambiente:
+    PLANNER_CACHE_DB (percorso SQLite, "" = solo memoria), PLANNER_CACHE_TTL
+    (secondi), PLANNER_CACHE_MAX_MB, PLANNER_CACHE_MEMORY_ENTRIES.
+    """
+    db_path = os.environ.get("PLANNER_CACHE_DB", str(default_dir / "plan_cache.sqlite3"))
+    return PlanCache(
+        db_path=db_path or None,
+        max_memory_entries=int(os.environ.get("PLANNER_CACHE_MEMORY_ENTRIES", "64")),
+        max_disk_bytes=int(float(os.environ.get("PLANNER_CACHE_MAX_MB", "256")) * 1024 * 1024),
+        ttl_sec=float(os.environ.get("PLANNER_CACHE_TTL", str(7 * 24 * 3600))),
+    )
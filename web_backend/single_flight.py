@@ -0,0 +1,103 @@
+# web_backend/single_flight.py
+#
+# Deduplica delle risoluzioni in corso: la prima richiesta con una certa
+# chiave esegue il solver, i duplicati concorrenti attendono lo stesso
+# Future e ricevono lo stesso PlanResult. Con `lock_dir` il coordinamento
+# si estende ai processi dello stesso host tramite un lock file per chiave.
+
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: niente lock tra processi
+    fcntl = None
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    do(key, fn, recheck) esegue fn() una sola volta per chiave tra i thread
+    del processo; i chiamanti concorrenti con la stessa chiave ricevono lo
+    stesso risultato (o la stessa eccezione).
+
+    Se `lock_dir` è impostato, il leader prende anche un lock esclusivo su
+    `<lock_dir>/<key>.lock`. Se il lock era già di un altro processo, dopo
+    averlo ottenuto chiama recheck() (es. lettura della cache condivisa) e,
+    se restituisce un valore, lo usa senza rieseguire fn().
+    """
+
+    def __init__(self, lock_dir: str | Path | None = None):
+        self.lock_dir = Path(lock_dir) if lock_dir and fcntl is not None else None
+        if self.lock_dir is not None:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {"leaders": 0, "coalesced_local": 0, "coalesced_host": 0}
+
+    def do(self, key: str, fn: Callable[[], T], recheck: Optional[Callable[[], Optional[T]]] = None) -> T:
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.counters["coalesced_local"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            with self._host_lock(key) as waited:
+                value = recheck() if waited and recheck is not None else None
+                with self._lock:
+                    if value is not None:
+                        self.counters["coalesced_host"] += 1
+                    else:
+                        self.counters["leaders"] += 1
+                if value is None:
+                    value = fn()
+            future.set_result(value)
+            return value
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["inflight"] = len(self._inflight)
+        out["host_locks"] = self.lock_dir is not None
+        return out
+
+    @contextmanager
+    def _host_lock(self, key: str) -> Iterator[bool]:
+        """Lock file esclusivo per chiave; produce True se è stato necessario attendere."""
+        if self.lock_dir is None:
+            yield False
+            return
+        fd = os.open(self.lock_dir / f"{key}.lock", os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except BlockingIOError:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                waited = True
+            try:
+                yield waited
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
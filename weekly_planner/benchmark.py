@@ -0,0 +1,381 @@
+# weekly_planner/benchmark.py
+#
+# Benchmark riproducibili dei planner su istanze sintetiche.
+#
+# Uso:
+#   python -m weekly_planner.benchmark mip-blocks --hours 8 10 --time-limit 30
+#   python -m weekly_planner.benchmark mip-backends --professors 12 48 --time-limit 30
+#   python -m weekly_planner.benchmark weekly-throughput --professors 12 48 --seconds 5
+#   python -m weekly_planner.benchmark subject-formulations --classes 4 8 --time-limit 30
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+import tracemalloc
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pulp
+
+from .mip_planner import BLOCK_FORMULATIONS, MIP_BACKENDS, MIPWeeklyPlanner
+from .models import PlannerConfig
+from .planner import WeeklyPlanner
+from .subject_planner import SUBJECT_FORMULATIONS, SubjectMIPPlanner, SubjectPlanningData
+
+
+def random_config(
+    num_professors: int = 12,
+    num_classes: int = 6,
+    days: int = 5,
+    daily_hours: int = 8,
+    fill_ratio: float = 0.6,
+    seed: int = 0,
+) -> PlannerConfig:
+    """
+    Genera una configurazione legacy casuale ma plausibile: ogni classe
+    riempie circa `fill_ratio` dei suoi slot con 1-5 ore per docente.
+    """
+    rng = np.random.default_rng(seed)
+    slots = days * daily_hours
+    prof_limit = int(slots * fill_ratio)
+
+    H = np.zeros((num_professors, num_classes), dtype=int)
+    for c in range(num_classes):
+        target = int(slots * fill_ratio)
+        for p in rng.permutation(num_professors):
+            if target <= 0:
+                break
+            room = min(target, 5, prof_limit - int(H[p].sum()))
+            if room <= 0:
+                continue
+            hours = int(rng.integers(1, room + 1))
+            H[p, c] = hours
+            target -= hours
+
+    availability = rng.random((num_professors, days, 2)) > 0.1
+    last_morning_hour = max(1, daily_hours // 2 + 1)
+
+    return PlannerConfig(
+        days=days,
+        daily_hours=daily_hours,
+        num_professors=num_professors,
+        num_classes=num_classes,
+        hours_matrix=H,
+        availability=availability,
+        last_morning_hour=min(last_morning_hour, daily_hours),
+        wednesday_afternoon_free=days > 2,
+        class_names=[f"C{c + 1}" for c in range(num_classes)],
+        professor_names=[f"P{p + 1}" for p in range(num_professors)],
+    )
+
+
+def random_subject_instance(
+    num_classes: int = 4,
+    num_subjects: int = 5,
+    num_professors: int = 8,
+    days: int = 5,
+    daily_hours: int = 6,
+    seed: int = 0,
+) -> Tuple[PlannerConfig, SubjectPlanningData]:
+    """
+    Istanza a materie casuale di una settimana: 2-4 ore per materia e
+    classe, due docenti abilitati per materia con ore sufficienti in
+    totale, massimo 2 ore al giorno per materia.
+    """
+    rng = np.random.default_rng(seed)
+    required = rng.integers(2, 5, size=(num_classes, num_subjects))
+    caps = np.zeros((num_professors, num_subjects), dtype=int)
+    for s in range(num_subjects):
+        need = int(required[:, s].sum())
+        first, second = rng.choice(num_professors, size=2, replace=False)
+        caps[first, s] = need // 2 + 3
+        caps[second, s] = need - need // 2 + 3
+
+    config = PlannerConfig(
+        days=days,
+        daily_hours=daily_hours,
+        num_professors=num_professors,
+        num_classes=num_classes,
+        hours_matrix=np.zeros((num_professors, num_classes), dtype=int),
+        availability=rng.random((num_professors, days, 2)) > 0.1,
+        last_morning_hour=min(4, daily_hours),
+        wednesday_afternoon_free=days > 2,
+        class_names=[f"C{c + 1}" for c in range(num_classes)],
+        professor_names=[f"P{p + 1}" for p in range(num_professors)],
+    )
+    ctx = SubjectPlanningData(
+        week_labels=["A"],
+        required_hours=[required],
+        prof_subject_caps=caps,
+        subject_daily_max=np.full((num_subjects, num_classes), 2, dtype=int),
+        preferences=np.zeros((num_professors, num_classes), dtype=bool),
+        aggregate_hours_rule=True,
+        single_teacher_rule=True,
+        subject_names=[f"S{s + 1}" for s in range(num_subjects)],
+    )
+    return config, ctx
+
+
+def bench_mip_block_formulations(
+    configs: Sequence[PlannerConfig],
+    time_limit_sec: int | None = 30,
+) -> List[dict]:
+    """
+    Confronta le formulazioni dei blocchi di MIPWeeklyPlanner:
+    tempo di build, righe/colonne del modello, tempo di solve e obiettivo.
+    """
+    rows: List[dict] = []
+    for i, config in enumerate(configs):
+        for formulation in BLOCK_FORMULATIONS:
+            planner = MIPWeeklyPlanner(config)
+
+            t0 = time.perf_counter()
+            built = planner._build_model(block_formulation=formulation)
+            build_sec = time.perf_counter() - t0
+            if built is None:
+                rows.append({"instance": i, "formulation": formulation, "status": "Infeasible"})
+                continue
+            prob = built[0]
+
+            solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit_sec)
+            t0 = time.perf_counter()
+            prob.solve(solver)
+            solve_sec = time.perf_counter() - t0
+
+            rows.append({
+                "instance": i,
+                "daily_hours": config.daily_hours,
+                "formulation": formulation,
+                "rows": len(prob.constraints),
+                "cols": len(prob.variables()),
+                "build_sec": build_sec,
+                "solve_sec": solve_sec,
+                "status": pulp.LpSolution[prob.sol_status],
+                "objective": pulp.value(prob.objective),
+            })
+    return rows
+
+
+def bench_mip_backends(
+    configs: Sequence[PlannerConfig],
+    time_limit_sec: int | None = 30,
+) -> List[dict]:
+    """
+    Confronta l'assemblaggio PuLP e quello matriciale di MIPWeeklyPlanner
+    sullo stesso insieme di vincoli: tempo e memoria di build (picco
+    tracemalloc) accanto al tempo di solve.
+    """
+    rows: List[dict] = []
+    for i, config in enumerate(configs):
+        for backend in MIP_BACKENDS:
+            planner = MIPWeeklyPlanner(config)
+            build = planner._build_matrix_model if backend == "matrix" else planner._build_model
+
+            tracemalloc.start()
+            build()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            result = planner.solve(time_limit_sec=time_limit_sec, backend=backend)
+            stats = (result.solve_stats or [{}])[0]
+            rows.append({
+                "instance": i,
+                "backend": backend,
+                "rows": stats.get("rows"),
+                "cols": stats.get("cols"),
+                "build_sec": stats.get("build_sec"),
+                "build_peak_mb": peak / (1024 * 1024),
+                "solve_sec": stats.get("solve_sec"),
+                "status": stats.get("status"),
+                "objective": result.scores[0] if result.scores else None,
+            })
+    return rows
+
+
+def bench_subject_formulations(
+    instances: Sequence[Tuple[PlannerConfig, SubjectPlanningData]],
+    time_limit_sec: int | None = 30,
+) -> List[dict]:
+    """
+    Confronta il modello orario e quello a blocchi di SubjectMIPPlanner
+    (prima settimana): dimensione del modello, bound del rilassamento LP,
+    tempo di solve e obiettivo.
+    """
+    rows: List[dict] = []
+    for i, (config, ctx) in enumerate(instances):
+        required = ctx.required_hours[0]
+        for formulation in SUBJECT_FORMULATIONS:
+            planner = SubjectMIPPlanner(config, ctx)
+            if formulation == "blocks":
+                build_index, is_feasible, build = (
+                    planner._build_block_index, planner._block_index_is_feasible, planner._build_block_model
+                )
+            else:
+                build_index, is_feasible, build = planner._build_index, planner._index_is_feasible, planner._build_model
+
+            t0 = time.perf_counter()
+            idx = build_index(required)
+            if not is_feasible(required, idx):
+                rows.append({"instance": i, "formulation": formulation, "status": "Infeasible"})
+                continue
+            prob, _ = build(required, idx)
+            build_sec = time.perf_counter() - t0
+
+            prob.solve(pulp.PULP_CBC_CMD(msg=False, mip=False))
+            lp_bound = pulp.value(prob.objective) if prob.status == pulp.LpStatusOptimal else None
+
+            solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit_sec)
+            t0 = time.perf_counter()
+            prob.solve(solver)
+            solve_sec = time.perf_counter() - t0
+
+            solved = prob.sol_status in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible)
+            rows.append({
+                "instance": i,
+                "classes": config.num_classes,
+                "formulation": formulation,
+                "rows": len(prob.constraints),
+                "cols": len(prob.variables()),
+                "build_sec": build_sec,
+                "lp_bound": lp_bound,
+                "solve_sec": solve_sec,
+                "status": pulp.LpSolution[prob.sol_status],
+                "objective": pulp.value(prob.objective) if solved else None,
+            })
+    return rows
+
+
+def bench_weekly_throughput(
+    configs: Sequence[PlannerConfig],
+    seconds: float = 5.0,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Throughput del generatore random di WeeklyPlanner: piani generati al
+    secondo, piani validi (_control) al secondo e miglior score, con lo
+    stesso ciclo di generate_until_time ma senza target di uscita.
+    """
+    rows: List[dict] = []
+    for i, config in enumerate(configs):
+        planner = WeeklyPlanner(config)
+        random.seed(seed)
+        np.random.seed(seed)
+
+        generated = valid = 0
+        best = float("inf")
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            P = planner._generate_single_plan_basic()
+            generated += 1
+            if P is None or not planner._control(P):
+                continue
+            valid += 1
+            best = min(best, planner._optimization_value(P))
+        elapsed = time.perf_counter() - t0
+
+        rows.append({
+            "instance": i,
+            "professors": config.num_professors,
+            "classes": config.num_classes,
+            "plans_per_sec": generated / elapsed,
+            "valid_per_sec": valid / elapsed,
+            "best_score": best if valid else None,
+        })
+    return rows
+
+
+def _print_table(rows: List[dict], columns: Sequence[str]) -> None:
+    def fmt(v):
+        if isinstance(v, float):
+            return f"{v:.3f}"
+        return "-" if v is None else str(v)
+
+    widths = {c: max(len(c), *(len(fmt(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(fmt(r.get(c)).ljust(widths[c]) for c in columns))
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark dei planner")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_blocks = sub.add_parser("mip-blocks", help="pairwise vs block_start in MIPWeeklyPlanner")
+    p_blocks.add_argument("--hours", type=int, nargs="+", default=[6, 8, 10])
+    p_blocks.add_argument("--professors", type=int, default=12)
+    p_blocks.add_argument("--classes", type=int, default=6)
+    p_blocks.add_argument("--seeds", type=int, default=2)
+    p_blocks.add_argument("--time-limit", type=int, default=30)
+
+    p_backends = sub.add_parser("mip-backends", help="PuLP vs assemblaggio matriciale in MIPWeeklyPlanner")
+    p_backends.add_argument("--professors", type=int, nargs="+", default=[12, 24, 48])
+    p_backends.add_argument("--hours", type=int, default=8)
+    p_backends.add_argument("--time-limit", type=int, default=30)
+
+    p_weekly = sub.add_parser("weekly-throughput", help="piani/secondo del generatore random di WeeklyPlanner")
+    p_weekly.add_argument("--professors", type=int, nargs="+", default=[12, 24, 48])
+    p_weekly.add_argument("--hours", type=int, default=8)
+    p_weekly.add_argument("--fill", type=float, default=0.5)
+    p_weekly.add_argument("--seconds", type=float, default=5.0)
+
+    p_subject = sub.add_parser("subject-formulations", help="modello orario vs a blocchi in SubjectMIPPlanner")
+    p_subject.add_argument("--classes", type=int, nargs="+", default=[4, 6, 8])
+    p_subject.add_argument("--subjects", type=int, default=5)
+    p_subject.add_argument("--professors", type=int, default=8)
+    p_subject.add_argument("--hours", type=int, default=6)
+    p_subject.add_argument("--seeds", type=int, default=2)
+    p_subject.add_argument("--time-limit", type=int, default=30)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "mip-blocks":
+        configs = [
+            random_config(args.professors, args.classes, daily_hours=h, seed=seed)
+            for h in args.hours
+            for seed in range(args.seeds)
+        ]
+        rows = bench_mip_block_formulations(configs, time_limit_sec=args.time_limit)
+        _print_table(
+            rows,
+            ["instance", "daily_hours", "formulation", "rows", "cols",
+             "build_sec", "solve_sec", "status", "objective"],
+        )
+    elif args.command == "mip-backends":
+        configs = [
+            random_config(n, max(1, n // 2), daily_hours=args.hours, seed=0)
+            for n in args.professors
+        ]
+        rows = bench_mip_backends(configs, time_limit_sec=args.time_limit)
+        _print_table(
+            rows,
+            ["instance", "backend", "rows", "cols", "build_sec",
+             "build_peak_mb", "solve_sec", "status", "objective"],
+        )
+    elif args.command == "weekly-throughput":
+        configs = [
+            random_config(n, max(1, n // 2), daily_hours=args.hours, fill_ratio=args.fill, seed=0)
+            for n in args.professors
+        ]
+        rows = bench_weekly_throughput(configs, seconds=args.seconds)
+        _print_table(
+            rows,
+            ["instance", "professors", "classes", "plans_per_sec", "valid_per_sec", "best_score"],
+        )
+    elif args.command == "subject-formulations":
+        instances = [
+            random_subject_instance(m, args.subjects, args.professors, daily_hours=args.hours, seed=seed)
+            for m in args.classes
+            for seed in range(args.seeds)
+        ]
+        rows = bench_subject_formulations(instances, time_limit_sec=args.time_limit)
+        _print_table(
+            rows,
+            ["instance", "classes", "formulation", "rows", "cols", "build_sec",
+             "lp_bound", "solve_sec", "status", "objective"],
+        )
+
+
+if __name__ == "__main__":
+    main()
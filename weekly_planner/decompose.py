@@ -0,0 +1,231 @@
+# weekly_planner/decompose.py
+#
+# Scomposizione delle istanze in parti indipendenti prima dei MIP.
+# Classi e docenti formano un grafo bipartito (arco = il docente può
+# insegnare nella classe: H[p, c] > 0, oppure una materia richiesta dalla
+# classe rientra in prof_subject_caps del docente). Ogni componente
+# connessa è un problema a sé: viene risolta come modello più piccolo in
+# un pool di processi e i piani vengono ricomposti in un solo PlanResult.
+
+from __future__ import annotations
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import List, Optional
+
+import numpy as np
+
+from .mip_planner import MIPWeeklyPlanner
+from .models import PlanResult, PlannerConfig
+from .parallel import process_context
+from .subject_planner import SubjectMIPPlanner, SubjectPlanningData
+
+
+@dataclass
+class Component:
+    """Una parte indipendente dell'istanza: indici globali (ordinati) di classi e docenti."""
+    classes: np.ndarray
+    profs: np.ndarray
+
+
+def teaching_graph(config: PlannerConfig, subject_ctx: SubjectPlanningData | None = None) -> np.ndarray:
+    """
+    Matrice di adiacenza (N, M) bool docenti × classi: H[p, c] > 0 senza
+    materie; con materie, p è collegato a c se in almeno una settimana c
+    richiede una materia per cui p ha ore in prof_subject_caps.
+    """
+    if subject_ctx is None:
+        return np.asarray(config.hours_matrix) > 0
+    needed = np.zeros((config.num_classes, subject_ctx.num_subjects), dtype=bool)
+    for required in subject_ctx.required_hours:
+        needed |= np.asarray(required) > 0
+    capable = np.asarray(subject_ctx.prof_subject_caps) > 0
+    return (capable.astype(int) @ needed.T.astype(int)) > 0
+
+
+def connected_components(adjacency: np.ndarray) -> List[Component]:
+    """
+    Componenti connesse del grafo bipartito (N docenti, M classi) con
+    almeno un arco, ordinate per classe minima. Classi e docenti isolati
+    non compaiono (non c'è niente da pianificare).
+    """
+    n, m = adjacency.shape
+    class_label = np.full(m, -1, dtype=int)
+    prof_label = np.full(n, -1, dtype=int)
+    components: List[Component] = []
+    for root in range(m):
+        if class_label[root] >= 0 or not adjacency[:, root].any():
+            continue
+        label = len(components)
+        class_label[root] = label
+        frontier = np.array([root])
+        while frontier.size:
+            profs = np.flatnonzero(adjacency[:, frontier].any(axis=1) & (prof_label < 0))
+            prof_label[profs] = label
+            frontier = np.flatnonzero(adjacency[profs].any(axis=0) & (class_label < 0))
+            class_label[frontier] = label
+        components.append(
+            Component(classes=np.flatnonzero(class_label == label), profs=np.flatnonzero(prof_label == label))
+        )
+    return components
+
+
+def _take(names: Optional[List[str]], idx: np.ndarray) -> Optional[List[str]]:
+    return None if names is None else [names[i] for i in idx]
+
+
+def component_config(config: PlannerConfig, comp: Component) -> PlannerConfig:
+    """Configurazione ridotta alle classi e ai docenti della componente (id locali)."""
+    availability = None if config.availability is None else np.asarray(config.availability)[comp.profs]
+    class_teachers = None
+    if config.class_teachers is not None:
+        class_teachers = [bool(config.class_teachers[p]) for p in comp.profs]
+    return replace(
+        config,
+        num_professors=len(comp.profs),
+        num_classes=len(comp.classes),
+        hours_matrix=np.asarray(config.hours_matrix)[np.ix_(comp.profs, comp.classes)],
+        availability=availability,
+        class_names=_take(config.class_names, comp.classes),
+        professor_names=_take(config.professor_names, comp.profs),
+        class_teachers=class_teachers,
+    )
+
+
+def component_subject_ctx(ctx: SubjectPlanningData, comp: Component) -> SubjectPlanningData:
+    """Dati materie ridotti alla componente (le materie restano tutte, con id globali)."""
+    return replace(
+        ctx,
+        required_hours=[np.asarray(r)[comp.classes] for r in ctx.required_hours],
+        prof_subject_caps=np.asarray(ctx.prof_subject_caps)[comp.profs],
+        subject_daily_max=np.asarray(ctx.subject_daily_max)[:, comp.classes],
+        preferences=np.asarray(ctx.preferences)[np.ix_(comp.profs, comp.classes)],
+    )
+
+
+def _to_local(plan: np.ndarray, comp: Component, num_prof: int) -> np.ndarray:
+    """Piano globale -> piano della componente (id docenti locali, 0 per gli altri)."""
+    local_ids = np.zeros(num_prof + 1, dtype=int)
+    local_ids[comp.profs + 1] = np.arange(1, len(comp.profs) + 1)
+    sub = np.asarray(plan)[:, :, comp.classes]
+    return local_ids[np.clip(sub, 0, num_prof)]
+
+
+def _slice_warm_start(
+    warm_start: PlanResult | None,
+    comp: Component,
+    num_prof: int,
+) -> PlanResult | None:
+    if warm_start is None or not warm_start.plans:
+        return None
+    subject_plans = None
+    if warm_start.subject_plans:
+        subject_plans = [np.asarray(S)[:, :, comp.classes] for S in warm_start.subject_plans]
+    return PlanResult(
+        plans=[_to_local(P, comp, num_prof) for P in warm_start.plans],
+        scores=list(warm_start.scores),
+        week_labels=warm_start.week_labels,
+        subject_plans=subject_plans,
+    )
+
+
+def _solve_component(
+    config: PlannerConfig,
+    subject_ctx: SubjectPlanningData | None,
+    time_limit_sec: int | None,
+    solve_kwargs: dict,
+) -> PlanResult:
+    if subject_ctx is not None:
+        return SubjectMIPPlanner(config, subject_ctx).solve(time_limit_sec=time_limit_sec, **solve_kwargs)
+    return MIPWeeklyPlanner(config).solve(time_limit_sec=time_limit_sec, **solve_kwargs)
+
+
+def solve_decomposed(
+    config: PlannerConfig,
+    subject_ctx: SubjectPlanningData | None = None,
+    time_limit_sec: int | None = 60,
+    workers: int | None = None,
+    warm_start: PlanResult | None = None,
+    **solve_kwargs,
+) -> PlanResult:
+    """
+    Risolve ogni componente connessa con MIPWeeklyPlanner (o
+    SubjectMIPPlanner con subject_ctx) e ricompone i piani: id docenti e
+    colonne delle classi tornano globali, gli score (obiettivi separabili
+    per docente e classe) si sommano.
+
+    Con più componenti girano in un pool di `workers` processi (default:
+    una CPU ciascuna); se le componenti sono più dei worker il budget
+    viene diviso tra i turni. Con una sola componente è esattamente il
+    MIP di partenza (anche quando una classe non ha docenti possibili).
+    Se una componente fallisce, fallisce tutto.
+
+    In `solve_stats`, per settimana: numero di componenti, le statistiche
+    di ciascuna e `optimal` solo se tutte sono ottime.
+    """
+    week_labels = subject_ctx.week_labels if subject_ctx is not None else ["A"]
+    adjacency = teaching_graph(config, subject_ctx)
+    components = connected_components(adjacency)
+    if subject_ctx is not None:
+        # Una classe con ore richieste ma senza docenti non sta in nessuna
+        # componente: il modello intero ne dimostra l'infattibilità
+        needed = np.any([np.asarray(r).sum(axis=1) > 0 for r in subject_ctx.required_hours], axis=0)
+        if (needed & ~adjacency.any(axis=0)).any():
+            components = components[:1]
+    if len(components) <= 1:
+        return _solve_component(config, subject_ctx, time_limit_sec, dict(solve_kwargs, warm_start=warm_start))
+
+    workers = min(workers or os.cpu_count() or 1, len(components))
+    budget = time_limit_sec
+    if time_limit_sec:
+        budget = max(1, int(time_limit_sec / math.ceil(len(components) / workers)))
+
+    jobs = []
+    for comp in components:
+        sub_ctx = component_subject_ctx(subject_ctx, comp) if subject_ctx is not None else None
+        kwargs = dict(solve_kwargs, warm_start=_slice_warm_start(warm_start, comp, config.num_professors))
+        jobs.append((component_config(config, comp), sub_ctx, budget, kwargs))
+
+    if workers <= 1:
+        results = [_solve_component(*job) for job in jobs]
+    else:
+        ctx = process_context()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_solve_component, *job) for job in jobs]
+            results = [f.result() for f in futures]
+
+    stats = []
+    for week in range(len(week_labels)):
+        parts = [r.solve_stats[week] if r.solve_stats and week < len(r.solve_stats) else {} for r in results]
+        stats.append({
+            "engine": "decomposed",
+            "components": len(components),
+            "workers": workers,
+            "sizes": [(len(c.classes), len(c.profs)) for c in components],
+            "parts": parts,
+            "optimal": all(p.get("optimal") for p in parts),
+        })
+    if any(not r.plans for r in results):
+        return PlanResult(plans=[], scores=[], week_labels=week_labels, solve_stats=stats)
+
+    shape = (config.days, config.daily_hours, config.num_classes)
+    plans = [np.zeros(shape, dtype=int) for _ in week_labels]
+    subject_plans = [np.zeros(shape, dtype=int) for _ in week_labels] if subject_ctx is not None else None
+    scores = [0.0] * len(week_labels)
+    for comp, result in zip(components, results):
+        global_ids = np.concatenate([[0], comp.profs + 1])
+        for week in range(len(week_labels)):
+            plans[week][:, :, comp.classes] = global_ids[result.plans[week]]
+            if subject_plans is not None:
+                subject_plans[week][:, :, comp.classes] = result.subject_plans[week]
+            scores[week] += float(result.scores[week])
+
+    return PlanResult(
+        plans=plans,
+        scores=scores,
+        week_labels=week_labels,
+        subject_plans=subject_plans,
+        solve_stats=stats,
+    )
@@ -0,0 +1,303 @@
+# weekly_planner/evolve_planner.py
+#
+# Motore evolutivo (algoritmo memetico) per il problema di WeeklyPlanner.
+# La popolazione è un unico tensore (K, D, H, M): fitness (scoring) e
+# violazioni dei vincoli rigidi si calcolano per tutta la popolazione con
+# poche operazioni NumPy. Il crossover scambia orari interi di classi o
+# giornate intere tra due genitori; ogni figlio viene poi riparato
+# ricostruendone i blocchi con lo stato incrementale di WeeklyPlanner
+# (catene di espulsione comprese). Con workers > 1 girano isole
+# indipendenti in processi separati e vince il migliore.
+
+from __future__ import annotations
+
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .models import PlanResult, PlannerConfig
+from .parallel import process_context
+from .planner import WeeklyPlanner
+from .scoring import ANTI_GAP_WEIGHTS, score_plans
+
+# Peso di ogni violazione nella fitness: domina qualunque score anti-buche
+VIOLATION_WEIGHT = 100.0
+
+
+class EvolutionaryPlanner:
+    """
+    Algoritmo genetico con riparazione sui piani di WeeklyPlanner (stessi
+    vincoli e stessa funzione di costo `_optimization_value`).
+
+    Ogni generazione: selezione a torneo binario, crossover per classi o per
+    giorni (metà dei figli ciascuno), riparazione con mutazione (una quota
+    `mutation_rate` dei blocchi ereditati viene ricollocata a caso) ed
+    elitismo dei migliori `elite` piani.
+    """
+
+    def __init__(self, config: PlannerConfig, seed: Optional[int] = None):
+        self.config = config
+        self.base = WeeklyPlanner(config)
+        self.days = config.days
+        self.daily_hours = config.daily_hours
+        self.n = config.num_professors
+        self.m = config.num_classes
+        self.last_morning_hour = config.last_morning_hour
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(10_000_000_000)
+
+        b = self.base
+        self.capped = ~b.class_teachers
+        # allowed[p + 1, d, h]: il prof p può insegnare in (d, h); riga 0 = cella libera,
+        # riga n + 1 = id fuori intervallo (sempre una violazione)
+        afternoon = np.arange(self.daily_hours) >= self.last_morning_hour
+        allowed = b.D[:, :, afternoon.astype(int)]
+        if b.wednesday_afternoon_free and self.days > 2:
+            allowed[:, 2, afternoon] = False
+        self.allowed = np.concatenate(
+            [np.ones((1, self.days, self.daily_hours), dtype=bool), allowed,
+             np.zeros((1, self.days, self.daily_hours), dtype=bool)]
+        )
+
+    # ------------------------------------------------------------------
+    # Valutazione vettorizzata della popolazione
+    # ------------------------------------------------------------------
+
+    def violations(self, pop: np.ndarray) -> np.ndarray:
+        """
+        Numero di violazioni dei vincoli rigidi per ogni piano di una pila
+        (K, D, H, M) -> array (K,) di interi: ore (prof, classe) diverse da
+        H, prof in due classi nella stessa ora, ore fuori disponibilità o nel
+        mercoledì pomeriggio e, per i docenti non di classe, più di 2 ore al
+        giorno con una classe, 2 ore non consecutive (o a cavallo della pausa
+        pranzo) e più ore singole del necessario. Zero = piano valido.
+        """
+        K, D, H, M = pop.shape
+        n = self.n
+        ids = np.clip(pop, 0, n + 1)
+        k_idx, d_idx, h_idx, c_idx = np.indices(pop.shape, sparse=True)
+
+        # ore per (k, d, c, p) con un solo bincount
+        dh_keys = ids + (n + 2) * (c_idx + M * (d_idx + D * k_idx))
+        day_hours = np.bincount(dh_keys.ravel(), minlength=K * D * M * (n + 2))
+        day_hours = day_hours.reshape(K, D, M, n + 2)[..., 1:n + 1]
+        counts = day_hours.sum(axis=1)                              # (K, M, N)
+        bad = np.abs(counts - self.base.H.T).sum(axis=(1, 2))
+
+        # sovrapposizioni: stesso prof più volte nella stessa (d, h)
+        slot_keys = ids + (n + 2) * (h_idx + H * (d_idx + D * k_idx))
+        per_slot = np.bincount(slot_keys.ravel(), minlength=K * D * H * (n + 2))
+        per_slot = per_slot.reshape(K, D, H, n + 2)[..., 1:n + 1]
+        bad += np.clip(per_slot - 1, 0, None).sum(axis=(1, 2, 3))
+
+        bad += (~self.allowed[ids, d_idx, h_idx]).sum(axis=(1, 2, 3))
+
+        # limiti giornalieri dei docenti non di classe
+        capped = self.capped[None, None, None, :]
+        bad += (np.clip(day_hours - 2, 0, None) * capped).sum(axis=(1, 2, 3))
+        pair = (pop[:, :, :-1] == pop[:, :, 1:]) & (pop[:, :, :-1] > 0)
+        if 0 < self.last_morning_hour < H:
+            pair[:, :, self.last_morning_hour - 1] = False
+        pair_keys = dh_keys[:, :, :-1]
+        pairs = np.bincount(pair_keys[pair], minlength=K * D * M * (n + 2))
+        pairs = pairs.reshape(K, D, M, n + 2)[..., 1:n + 1]
+        bad += ((day_hours == 2) & (pairs == 0) & capped).sum(axis=(1, 2, 3))
+        singles = ((day_hours == 1) & capped).sum(axis=1)            # (K, M, N)
+        bad += np.clip(singles - self.base.H.T % 2, 0, None).sum(axis=(1, 2))
+        return bad
+
+    def fitness(self, pop: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(fitness, violazioni) per la pila (K, D, H, M); fitness = score + VIOLATION_WEIGHT * violazioni."""
+        scores = score_plans(
+            pop, self.n, self.last_morning_hour, ANTI_GAP_WEIGHTS,
+            day_mask=self.base.D.any(axis=2),
+        )
+        bad = self.violations(pop)
+        return scores + VIOLATION_WEIGHT * bad, bad
+
+    # ------------------------------------------------------------------
+    # Operatori genetici
+    # ------------------------------------------------------------------
+
+    def crossover(self, pop: np.ndarray, fit: np.ndarray, num_children: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Figli (num_children, D, H, M): genitori scelti con tornei binari,
+        poi ogni classe (crossover per classi) o ogni giorno (crossover per
+        giorni) viene presa da uno dei due genitori.
+        """
+        K = pop.shape[0]
+
+        def tournament() -> np.ndarray:
+            a = rng.integers(K, size=num_children)
+            b = rng.integers(K, size=num_children)
+            return np.where(fit[a] <= fit[b], a, b)
+
+        mother, father = tournament(), tournament()
+        by_class = rng.random(num_children) < 0.5
+        class_mask = rng.random((num_children, self.m)) < 0.5
+        day_mask = rng.random((num_children, self.days)) < 0.5
+        mask = np.where(
+            by_class[:, None, None, None],
+            class_mask[:, None, None, :],
+            day_mask[:, :, None, None],
+        )
+        return np.where(mask, pop[mother], pop[father])
+
+    def repair(self, child: np.ndarray, mutation_rate: float = 0.0) -> np.ndarray:
+        """
+        Ricostruisce un piano valido (quando possibile) a partire da un figlio:
+        i blocchi ereditati vengono ripiazzati in ordine casuale finché i
+        vincoli lo consentono e (prof, classe) ne ha ancora bisogno; quelli
+        mancanti vengono estratti tra le partenze valide o inseriti con
+        le catene di espulsione di WeeklyPlanner.
+        """
+        b = self.base
+        lmh = self.last_morning_hour
+        P = np.zeros_like(child)
+        state = b._empty_state()
+
+        need = {}
+        for p, c in zip(*np.nonzero(b.H)):
+            need[(p, c, 2)] = int(b.H[p, c]) // 2
+            need[(p, c, 1)] = int(b.H[p, c]) % 2
+
+        # Pezzi ereditati: sequenze uguali spezzate in blocchi da 2 (non a
+        # cavallo della pausa pranzo) più eventuali ore singole
+        pieces: List[Tuple[int, int, int, int, int]] = []
+        for d, c in zip(*np.nonzero(child.any(axis=1))):
+            col = child[d, :, c]
+            h = 0
+            while h < self.daily_hours:
+                p = int(col[h]) - 1
+                if p < 0 or p >= self.n:
+                    h += 1
+                    continue
+                size = 2 if h + 1 < self.daily_hours and col[h + 1] == p + 1 and h + 1 != lmh else 1
+                pieces.append((p, int(c), int(d), h, size))
+                h += size
+        random.shuffle(pieces)
+
+        for (p, c, d, h, size) in pieces:
+            if need.get((p, c, size), 0) <= 0 or random.random() < mutation_rate:
+                continue
+            if not state.slots.valid_starts(p, c, size)[d, h]:
+                continue
+            if not b._is_class_teacher(p) and state.day_hours[p, c, d] + size > 2:
+                continue
+            state.place(P, p, c, d, h, size)
+            need[(p, c, size)] -= 1
+
+        missing = [(p, c, size) for (p, c, size), k in need.items() for _ in range(k)]
+        random.shuffle(missing)
+        for (p, c, size) in missing:
+            slot = b._sample_slot(state, p, c, size)
+            if slot is not None:
+                state.place(P, p, c, slot[0], slot[1], size)
+            else:
+                b._eject_and_place(P, state, (p, c, size), 3, set())
+        return P
+
+    # ------------------------------------------------------------------
+    # Ciclo evolutivo
+    # ------------------------------------------------------------------
+
+    def _evolve(
+        self,
+        island: int,
+        time_limit_sec: float,
+        population: int,
+        elite: int,
+        mutation_rate: float,
+        max_generations: Optional[int],
+    ) -> Tuple[np.ndarray, float, int, dict]:
+        """Un'isola: ritorna (piano migliore, fitness, violazioni, statistiche)."""
+        start = time.perf_counter()
+        deadline = start + time_limit_sec
+        random.seed(f"{self.seed}:{island}")
+        rng = np.random.default_rng(random.getrandbits(64))
+
+        plans = []
+        for _ in range(population):
+            P = self.base._generate_single_plan_basic()
+            plans.append(P if P is not None else np.zeros((self.days, self.daily_hours, self.m), dtype=int))
+        pop = np.stack(plans)
+        fit, bad = self.fitness(pop)
+        evaluations = population
+
+        generations = 0
+        elite = min(elite, population)
+        while time.perf_counter() < deadline and (max_generations is None or generations < max_generations):
+            if bad.min() == 0 and fit.min() <= 1e-9:
+                break
+            children = self.crossover(pop, fit, population - elite, rng)
+            for i in range(children.shape[0]):
+                children[i] = self.repair(children[i], mutation_rate)
+            child_fit, child_bad = self.fitness(children)
+            evaluations += children.shape[0]
+
+            keep = np.argsort(fit, kind="stable")[:elite]
+            pop = np.concatenate([pop[keep], children])
+            fit = np.concatenate([fit[keep], child_fit])
+            bad = np.concatenate([bad[keep], child_bad])
+            generations += 1
+
+        best = int(np.argmin(fit))
+        stats = {
+            "island": island,
+            "generations": generations,
+            "evaluations": evaluations,
+            "valid": int((bad == 0).sum()),
+            "elapsed_sec": time.perf_counter() - start,
+        }
+        return pop[best], float(fit[best]), int(bad[best]), stats
+
+    def generate(
+        self,
+        time_limit_sec: float = 10.0,
+        population: int = 32,
+        elite: int = 4,
+        mutation_rate: float = 0.05,
+        workers: int = 1,
+        max_generations: Optional[int] = None,
+        improve_sec: float = 0.0,
+    ) -> PlanResult:
+        """
+        Evolve `population` piani per `time_limit_sec` (o `max_generations`)
+        e ritorna il migliore valido, migliorato con improve_sec secondi di
+        ricerca locale (se > 0). Con workers > 1 girano altrettante isole
+        in un pool di processi, ognuna col proprio flusso casuale derivato
+        da seed e indice dell'isola (riproducibile con max_generations).
+        Nessun piano se alla fine nessun individuo rispetta tutti i vincoli.
+        `PlanResult.solve_stats` riporta generazioni e valutazioni per isola.
+        """
+        args = (time_limit_sec, population, elite, mutation_rate, max_generations)
+        if workers <= 1:
+            outcomes = [self._evolve(0, *args)]
+        else:
+            ctx = process_context()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [pool.submit(self._evolve, island, *args) for island in range(workers)]
+                outcomes = [f.result() for f in futures]
+
+        # a parità di fitness vince l'isola con indice minore (deterministico)
+        plan, _, bad, _ = min(outcomes, key=lambda o: o[1])
+        stats = {
+            "engine": "evolve",
+            "population": population,
+            "workers": workers,
+            "generations": sum(o[3]["generations"] for o in outcomes),
+            "evaluations": sum(o[3]["evaluations"] for o in outcomes),
+            "violations": bad,
+            "islands": [o[3] for o in outcomes],
+        }
+        if bad > 0:
+            return PlanResult(plans=[], scores=[], week_labels=["A"], solve_stats=[stats])
+
+        score = self.base._optimization_value(plan)
+        if improve_sec > 0 and score > 0:
+            plan, score, stats["local_search"] = self.base.improve_plan(
+                plan, improve_sec, seed=random.Random(f"{self.seed}:{workers}").getrandbits(32)
+            )
+        return PlanResult(plans=[plan], scores=[score], week_labels=["A"], solve_stats=[stats])
@@ -0,0 +1,389 @@
+# weekly_planner/lns.py
+#
+# Large Neighborhood Search sopra i modelli MIP (SubjectMIPPlanner o
+# MIPWeeklyPlanner). Si parte da un piano ammissibile; a ogni passo si
+# libera un intorno (due giorni, un gruppo di classi che condividono
+# docenti, la settimana di un docente), tutte le altre variabili x vengono
+# fissate ai valori correnti tramite i bound e CBC risolve il sotto-MIP con
+# un time limit breve. Il modello è costruito una sola volta per settimana:
+# tra un passo e l'altro cambiano solo i bound, e il presolve di CBC
+# elimina le variabili fissate.
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pulp
+
+from .mip_matrix import STATUS_NOT_SOLVED, set_pulp_start, solve_pulp, variable_values
+from .mip_planner import BLOCK_FORMULATIONS, MIPWeeklyPlanner
+from .models import PlanResult, PlannerConfig
+from .subject_planner import SUBJECT_FORMULATIONS, SubjectMIPPlanner, SubjectPlanningData
+
+# Intorni disponibili: due giorni interi, un gruppo di classi con docenti in
+# comune, tutte le lezioni di un docente
+LNS_NEIGHBORHOODS = ("days", "classes", "teacher")
+
+
+@dataclass
+class Neighborhood:
+    """Parte del piano lasciata libera in un passo LNS (le altre x restano fissate)."""
+    kind: str
+    days: Tuple[int, ...] = ()
+    classes: Tuple[int, ...] = ()
+    prof: Optional[int] = None
+
+    def mask(self, day: np.ndarray, cls: np.ndarray, prof: np.ndarray) -> np.ndarray:
+        """Maschera bool delle variabili libere, date le colonne giorno/classe/prof delle chiavi."""
+        if self.kind == "days":
+            return np.isin(day, self.days)
+        if self.kind == "classes":
+            return np.isin(cls, self.classes)
+        return prof == self.prof
+
+
+@dataclass
+class _WeekModel:
+    """Modello PuLP di una settimana con le chiavi di x e le colonne (giorno, classe, prof)."""
+    prob: pulp.LpProblem
+    variables: List[pulp.LpVariable]
+    day: np.ndarray
+    cls: np.ndarray
+    prof: np.ndarray
+    to_plans: object   # valori di x -> (P, S o None)
+    warm_start: object  # (P, S o None) -> assegnamento per set_pulp_start
+
+
+class LNSPlanner:
+    """
+    LNS sopra SubjectMIPPlanner (con subject_ctx) o MIPWeeklyPlanner.
+    `improve` migliora un PlanResult esistente; `solve` parte dal warm
+    start fornito o, senza, da un MIP breve sull'istanza intera.
+    """
+
+    def __init__(
+        self,
+        config: PlannerConfig,
+        subject_ctx: SubjectPlanningData | None = None,
+        seed: Optional[int] = None,
+        formulation: str | None = None,
+    ):
+        self.config = config
+        self.subject_ctx = subject_ctx
+        self.rng = np.random.default_rng(seed)
+        if subject_ctx is not None:
+            self.formulation = formulation or "hourly"
+            allowed = SUBJECT_FORMULATIONS
+        else:
+            self.formulation = formulation or "pairwise"
+            allowed = BLOCK_FORMULATIONS
+        if self.formulation not in allowed:
+            raise ValueError(f"formulation non valida: {self.formulation!r} (ammesse: {', '.join(allowed)})")
+
+    # ------------------------------------------------------------------
+    # Modelli
+    # ------------------------------------------------------------------
+
+    def _week_model(self, week: int) -> _WeekModel | None:
+        if self.subject_ctx is None:
+            planner = MIPWeeklyPlanner(self.config)
+            built = planner._build_model(block_formulation=self.formulation)
+            if built is None:
+                return None
+            prob, x, idx = built
+            keys = np.array(idx.keys, dtype=np.int64).reshape(-1, 4)
+            return _WeekModel(
+                prob=prob,
+                variables=[x[k] for k in idx.keys],
+                day=keys[:, 0],
+                cls=keys[:, 2],
+                prof=keys[:, 3],
+                to_plans=lambda values: (planner._plan_from_values(idx, values), None),
+                warm_start=lambda P, S: planner._warm_start_assignment(idx, P, self.formulation),
+            )
+
+        planner = SubjectMIPPlanner(self.config, self.subject_ctx)
+        required = self.subject_ctx.required_hours[week]
+        if self.formulation == "blocks":
+            idx = planner._build_block_index(required)
+        else:
+            idx = planner._build_index(required)
+        return self._subject_model(planner, required, idx)
+
+    def _joint_model(self, shared: np.ndarray) -> _WeekModel | None:
+        """
+        Modello congiunto delle settimane A/B (vedi
+        `SubjectMIPPlanner._solve_joint_weeks`): le lezioni delle materie
+        comuni sono una sola variabile per tutte le settimane, quindi ogni
+        intorno le sposta insieme e restano identiche tra A e B.
+        """
+        planner = SubjectMIPPlanner(self.config, self.subject_ctx)
+        virtual, required = planner._weeks_planner(shared)
+        idx = planner._build_weeks_index(virtual, required, shared, self.formulation)
+        return self._subject_model(virtual, required, idx)
+
+    def _subject_model(self, planner: SubjectMIPPlanner, required: np.ndarray, idx) -> _WeekModel | None:
+        if self.formulation == "blocks":
+            if not planner._block_index_is_feasible(required, idx):
+                return None
+            prob, x = planner._build_block_model(required, idx)
+            keys = np.array(idx.keys, dtype=np.int64).reshape(-1, 6)
+            day, cls, prof = keys[:, 3], keys[:, 0], keys[:, 2]
+            to_plans, warm_start = planner._plans_from_blocks, planner._warm_start_blocks
+        else:
+            if not planner._index_is_feasible(required, idx):
+                return None
+            prob, x = planner._build_model(required, idx)
+            keys = np.array(idx.keys, dtype=np.int64).reshape(-1, 5)
+            day, cls, prof = keys[:, 0], keys[:, 2], keys[:, 4]
+            to_plans, warm_start = planner._plans_from_values, planner._warm_start_assignment
+        return _WeekModel(
+            prob=prob,
+            variables=[x[k] for k in idx.keys],
+            day=day,
+            cls=cls,
+            prof=prof,
+            to_plans=lambda values: to_plans(idx, values),
+            warm_start=lambda P, S: warm_start(idx, P, S),
+        )
+
+    # ------------------------------------------------------------------
+    # Intorni
+    # ------------------------------------------------------------------
+
+    def _pick_neighborhood(self, kind: str, plan: np.ndarray, class_group: int) -> Neighborhood:
+        """
+        Sceglie a caso un intorno del tipo `kind` sul piano corrente:
+          - "days": due giorni distinti
+          - "classes": una classe e fino a `class_group - 1` classi che
+            condividono con lei almeno un docente
+          - "teacher": un docente che ha lezioni nel piano
+        """
+        D, _, M = plan.shape
+        if kind == "days":
+            days = self.rng.choice(D, size=min(2, D), replace=False)
+            return Neighborhood(kind, days=tuple(int(d) for d in days))
+        if kind == "classes":
+            root = int(self.rng.integers(M))
+            teachers = np.unique(plan[:, :, root])
+            teachers = teachers[teachers > 0]
+            linked = np.flatnonzero(np.isin(plan, teachers).any(axis=(0, 1)))
+            linked = linked[linked != root]
+            extra = self.rng.choice(linked, size=min(class_group - 1, len(linked)), replace=False) if len(linked) else []
+            return Neighborhood(kind, classes=tuple(sorted([root, *(int(c) for c in extra)])))
+        teachers = np.unique(plan)
+        teachers = teachers[teachers > 0]
+        prof = int(self.rng.choice(teachers)) - 1 if len(teachers) else 0
+        return Neighborhood(kind, prof=prof)
+
+    # ------------------------------------------------------------------
+    # Ciclo LNS
+    # ------------------------------------------------------------------
+
+    def _improve_week(
+        self,
+        model: _WeekModel | None,
+        plan: np.ndarray,
+        subject_plan: np.ndarray | None,
+        deadline: float,
+        sub_time_limit_sec: int,
+        neighborhoods: Sequence[str],
+        class_group: int,
+        threads: int | None,
+    ) -> Tuple[np.ndarray, np.ndarray | None, float, dict]:
+        t0 = time.perf_counter()
+        stats = {"engine": "lns", "formulation": self.formulation, "iterations": 0, "improvements": 0,
+                 "failed": 0, "by_kind": {k: 0 for k in neighborhoods}}
+        if model is None:
+            stats.update(status="Infeasible", solve_sec=time.perf_counter() - t0)
+            return plan, subject_plan, float("inf"), stats
+
+        set_pulp_start(model.prob, model.warm_start(plan, subject_plan))
+        current = variable_values(model.variables)
+        objective = float(pulp.value(model.prob.objective))
+        stats["start_objective"] = objective
+
+        while True:
+            remaining = int(deadline - time.perf_counter())
+            if remaining < 1:
+                break
+            kind = neighborhoods[stats["iterations"] % len(neighborhoods)]
+            free = self._pick_neighborhood(kind, plan, class_group).mask(model.day, model.cls, model.prof)
+            for var, value, is_free in zip(model.variables, current, free):
+                if is_free:
+                    var.lowBound, var.upBound = 0, 1
+                else:
+                    var.lowBound = var.upBound = round(value)
+            set_pulp_start(model.prob, model.warm_start(plan, subject_plan))
+
+            stats["iterations"] += 1
+            status = solve_pulp(model.prob, pulp.PULP_CBC_CMD(
+                msg=False, timeLimit=min(sub_time_limit_sec, remaining), warmStart=True, threads=threads
+            ))
+            if status == STATUS_NOT_SOLVED or model.prob.sol_status not in (
+                pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible
+            ):
+                stats["failed"] += 1
+                continue
+            value = float(pulp.value(model.prob.objective))
+            if value < objective - 1e-6:
+                objective = value
+                current = variable_values(model.variables)
+                plan, subject_plan = model.to_plans(current)
+                stats["improvements"] += 1
+                stats["by_kind"][kind] += 1
+
+        for var in model.variables:
+            var.lowBound, var.upBound = 0, 1
+        stats.update(status="Feasible", objective=objective, solve_sec=time.perf_counter() - t0)
+        return plan, subject_plan, objective, stats
+
+    def improve(
+        self,
+        start: PlanResult,
+        time_limit_sec: float = 60,
+        sub_time_limit_sec: int = 5,
+        neighborhoods: Sequence[str] = LNS_NEIGHBORHOODS,
+        class_group: int = 3,
+        threads: int | None = None,
+    ) -> PlanResult:
+        """
+        Migliora `start` (un piano per settimana, con subject_plans se ci
+        sono materie) alternando gli intorni in `neighborhoods`; ogni
+        sotto-MIP ha al più `sub_time_limit_sec` secondi e si accettano
+        solo miglioramenti dell'obiettivo del MIP. Il budget è diviso in
+        parti uguali tra le settimane; con settimane A/B e materie comuni si
+        lavora invece sul modello congiunto (vedi `_improve_joint`).
+
+        Gli score sono gli obiettivi del MIP; in `solve_stats`, per
+        settimana: obiettivo di partenza e finale, passi, miglioramenti
+        (anche per tipo di intorno) e sotto-MIP senza soluzione.
+        """
+        unknown = [k for k in neighborhoods if k not in LNS_NEIGHBORHOODS]
+        if unknown or not neighborhoods:
+            raise ValueError(f"neighborhoods non validi: {unknown} (ammessi: {', '.join(LNS_NEIGHBORHOODS)})")
+        if not start.plans:
+            return start
+        if self.subject_ctx is not None and len(start.plans) > 1:
+            shared = self.subject_ctx.shared_subjects()
+            if shared.any():
+                return self._improve_joint(
+                    start, shared, time_limit_sec, sub_time_limit_sec, neighborhoods, class_group, threads
+                )
+
+        week_labels = start.week_labels
+        plans: List[np.ndarray] = []
+        subject_plans: List[np.ndarray] = []
+        scores: List[float] = []
+        stats: List[dict] = []
+        t_end = time.perf_counter() + time_limit_sec
+        for week in range(len(start.plans)):
+            deadline = time.perf_counter() + (t_end - time.perf_counter()) / (len(start.plans) - week)
+            subject_plan = start.subject_plans[week] if start.subject_plans else None
+            plan, subject_plan, score, week_stats = self._improve_week(
+                self._week_model(week),
+                np.asarray(start.plans[week]),
+                subject_plan,
+                deadline,
+                sub_time_limit_sec,
+                neighborhoods,
+                class_group,
+                threads,
+            )
+            plans.append(plan)
+            subject_plans.append(subject_plan)
+            scores.append(score)
+            stats.append(week_stats)
+
+        return PlanResult(
+            plans=plans,
+            scores=scores,
+            week_labels=week_labels,
+            subject_plans=subject_plans if start.subject_plans else None,
+            solve_stats=stats,
+        )
+
+    def _improve_joint(
+        self,
+        start: PlanResult,
+        shared: np.ndarray,
+        time_limit_sec: float,
+        sub_time_limit_sec: int,
+        neighborhoods: Sequence[str],
+        class_group: int,
+        threads: int | None,
+    ) -> PlanResult:
+        """
+        LNS sul modello congiunto delle settimane: le lezioni delle materie
+        comuni restano uguali in tutte le settimane a ogni passo. `start`
+        deve già rispettarlo (es. SubjectGreedyPlanner.generate con
+        shared_weeks). Gli score sono gli obiettivi settimanali valutati sui
+        piani, come in `SubjectMIPPlanner._solve_joint_weeks`.
+        """
+        deadline = time.perf_counter() + time_limit_sec
+        planner = SubjectMIPPlanner(self.config, self.subject_ctx)
+        W = len(self.subject_ctx.week_labels)
+        P_v, S_v = planner._join_weeks(start.plans, start.subject_plans, shared)
+        plans, subject_plans = planner._split_weeks(P_v, S_v, shared)
+        if not all(
+            np.array_equal(P, P_start) and np.array_equal(S, S_start)
+            for P, S, P_start, S_start in zip(plans, subject_plans, start.plans, start.subject_plans)
+        ):
+            raise ValueError(
+                "start ha orari diversi tra le settimane per materie comuni: "
+                "serve un piano con orario comune (es. SubjectGreedyPlanner.generate(shared_weeks=True))"
+            )
+
+        P_v, S_v, _, stats = self._improve_week(
+            self._joint_model(shared),
+            P_v,
+            S_v,
+            deadline,
+            sub_time_limit_sec,
+            neighborhoods,
+            class_group,
+            threads,
+        )
+        stats.update(mode="joint_weeks", shared_subjects=int(shared.sum()))
+        plans, subject_plans = planner._split_weeks(P_v, S_v, shared)
+        scores = [
+            planner._plan_objective(self.subject_ctx.required_hours[w], plans[w], subject_plans[w], self.formulation)
+            for w in range(W)
+        ]
+        return PlanResult(
+            plans=plans,
+            scores=scores,
+            week_labels=start.week_labels,
+            subject_plans=subject_plans,
+            solve_stats=[stats] * W,
+        )
+
+    def solve(
+        self,
+        time_limit_sec: float = 60,
+        warm_start: PlanResult | None = None,
+        start_time_limit_sec: int = 10,
+        **improve_kwargs,
+    ) -> PlanResult:
+        """
+        Come `improve`, ma senza piano di partenza usa un MIP sull'istanza
+        intera limitato a `start_time_limit_sec`. Se non c'è nemmeno quello
+        ritorna il risultato vuoto del MIP.
+        """
+        t0 = time.perf_counter()
+        start = warm_start
+        if start is None or not start.plans:
+            if self.subject_ctx is not None:
+                start = SubjectMIPPlanner(self.config, self.subject_ctx).solve(
+                    time_limit_sec=start_time_limit_sec, formulation=self.formulation, joint_weeks=True
+                )
+            else:
+                start = MIPWeeklyPlanner(self.config).solve(
+                    time_limit_sec=start_time_limit_sec, block_formulation=self.formulation
+                )
+            if not start.plans:
+                return start
+        return self.improve(start, time_limit_sec=max(1.0, time_limit_sec - (time.perf_counter() - t0)), **improve_kwargs)
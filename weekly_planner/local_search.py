@@ -0,0 +1,425 @@
+# weekly_planner/local_search.py
+#
+# Miglioramento a ricerca locale (simulated annealing) dei piani prodotti
+# dai planner costruttivi (SubjectGreedyPlanner, SubjectRandomPlanner,
+# WeeklyPlanner). Il piano è visto come insieme di blocchi: sequenze
+# massimali di ore consecutive con la stessa classe, materia e docente.
+# Mosse:
+#   - move: sposta un blocco in una posizione libera
+#   - swap: scambia due blocchi della stessa classe
+#   - teacher: cambia docente a tutti i blocchi di (classe, materia, docente),
+#     eventualmente scambiandolo con quello di un'altra classe
+# Ogni mossa mantiene tutti i vincoli rigidi; lo score (scoring.GapWeights)
+# è la somma di termini per (docente, giorno) e ogni mossa tocca al più
+# pochi termini, ricalcolati in O(1) su bitmask delle ore.
+
+from __future__ import annotations
+
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .scoring import ANTI_GAP_WEIGHTS, GapWeights, score_plan
+from .slots import SlotIndex
+
+MOVES = ("move", "swap", "teacher")
+
+
+@dataclass
+class Block:
+    """Un blocco del piano: `size` ore da `start` nel giorno `day`."""
+    cls: int
+    subject: int   # 0-based; 0 per i piani senza materie
+    teacher: int   # 0-based
+    day: int
+    start: int
+    size: int
+
+
+def extract_blocks(plan: np.ndarray, subject_plan: Optional[np.ndarray] = None) -> List[Block]:
+    """Blocchi (sequenze massimali uguali per docente e materia) di un piano (D, H, M)."""
+    D, H, M = plan.shape
+    blocks: List[Block] = []
+    for c in range(M):
+        for d in range(D):
+            h = 0
+            while h < H:
+                p = int(plan[d, h, c])
+                if p <= 0:
+                    h += 1
+                    continue
+                s = int(subject_plan[d, h, c]) if subject_plan is not None else 1
+                end = h + 1
+                while end < H and plan[d, end, c] == p and (subject_plan is None or subject_plan[d, end, c] == s):
+                    end += 1
+                blocks.append(Block(c, s - 1, p - 1, d, h, end - h))
+                h = end
+    return blocks
+
+
+class BlockLocalSearch:
+    """
+    Simulated annealing sui blocchi di un piano.
+
+    Vincoli rigidi mantenuti da ogni mossa:
+      - vincoli statici di SlotIndex (disponibilità, pausa pranzo, mercoledì)
+      - docente e classe liberi nelle ore del blocco
+      - ore al giorno per chiave di carico (classe+materia, oppure
+        classe+docente con `load_by_teacher`) entro `day_caps[key]`
+        (None = senza limite), senza ore della stessa chiave a cavallo
+        della pausa pranzo; con `one_block_per_day` al più un blocco al
+        giorno per chiave
+      - con `prof_subject_caps`, ore per (docente, materia) entro la capacità
+        (e la mossa "teacher" è abilitata)
+
+    Lo score coincide con scoring.score_plan(weights, day_mask).
+    """
+
+    def __init__(
+        self,
+        days: int,
+        daily_hours: int,
+        num_prof: int,
+        num_classes: int,
+        availability: np.ndarray,  # (N, D, 2)
+        last_morning_hour: int,
+        wednesday_afternoon_free: bool,
+        blocks: List[Block],
+        day_caps: Dict[Tuple[int, int], Optional[int]],
+        weights: GapWeights = ANTI_GAP_WEIGHTS,
+        day_mask: Optional[np.ndarray] = None,  # (N, D)
+        load_by_teacher: bool = False,
+        one_block_per_day: bool = False,
+        prof_subject_caps: Optional[np.ndarray] = None,  # (N, materie)
+        rng: Optional[random.Random] = None,
+    ):
+        self.days = days
+        self.daily_hours = daily_hours
+        self.num_prof = num_prof
+        self.num_classes = num_classes
+        self.blocks = blocks
+        self.day_caps = day_caps
+        self.weights = weights
+        self.load_by_teacher = load_by_teacher
+        self.one_block_per_day = one_block_per_day
+        self.rng = rng or random.Random()
+        self.lmh = min(max(last_morning_hour, 0), daily_hours)
+        self.morning_bits = (1 << self.lmh) - 1
+        self.day_mask = (
+            np.asarray(day_mask, dtype=bool) if day_mask is not None
+            else np.ones((num_prof, days), dtype=bool)
+        )
+
+        # Partenze statiche valide per (size, docente, giorno) come bitmask sulle ore
+        slots = SlotIndex(days, daily_hours, num_classes, availability, last_morning_hour, wednesday_afternoon_free)
+        self._slots = slots
+        self._static: Dict[int, List[List[int]]] = {}
+
+        self.prof_bits = [[0] * days for _ in range(num_prof)]
+        self.class_bits = [[0] * days for _ in range(num_classes)]
+        # Ore occupate per chiave di carico e giorno (bitmask)
+        self.key_bits: Dict[Tuple[int, int], List[int]] = {}
+        self.class_blocks: List[List[int]] = [[] for _ in range(num_classes)]
+        for i, b in enumerate(blocks):
+            self.class_blocks[b.cls].append(i)
+            self._add(b)
+
+        self.caps = None if prof_subject_caps is None else np.array(prof_subject_caps, dtype=int)
+        if self.caps is not None:
+            self.used = np.zeros_like(self.caps)
+            for b in blocks:
+                self.used[b.teacher, b.subject] += b.size
+
+        self.terms = [[self._term(p, d) for d in range(days)] for p in range(num_prof)]
+        self.score = sum(sum(row) for row in self.terms)
+        self.stats: dict = {}
+
+    # ------------------------------------------------------------------
+    # Stato
+    # ------------------------------------------------------------------
+
+    def _load_key(self, b: Block) -> Tuple[int, int]:
+        return (b.cls, b.teacher) if self.load_by_teacher else (b.cls, b.subject)
+
+    def _static_ok(self, teacher: int, size: int, day: int, start: int) -> bool:
+        per_size = self._static.get(size)
+        if per_size is None:
+            static = self._slots.static_starts(size)
+            per_size = [
+                [sum(1 << int(h) for h in np.flatnonzero(static[p, d])) for d in range(self.days)]
+                for p in range(self.num_prof)
+            ]
+            self._static[size] = per_size
+        return bool(per_size[teacher][day] >> start & 1)
+
+    def _add(self, b: Block) -> None:
+        mask = ((1 << b.size) - 1) << b.start
+        self.prof_bits[b.teacher][b.day] |= mask
+        self.class_bits[b.cls][b.day] |= mask
+        self.key_bits.setdefault(self._load_key(b), [0] * self.days)[b.day] |= mask
+
+    def _remove(self, b: Block) -> None:
+        mask = ((1 << b.size) - 1) << b.start
+        self.prof_bits[b.teacher][b.day] &= ~mask
+        self.class_bits[b.cls][b.day] &= ~mask
+        self.key_bits[self._load_key(b)][b.day] &= ~mask
+
+    def _fits(self, b: Block) -> bool:
+        """Il blocco (non ancora aggiunto) rispetta i vincoli rigidi nello stato corrente."""
+        if b.start < 0 or b.start + b.size > self.daily_hours:
+            return False
+        if not self._static_ok(b.teacher, b.size, b.day, b.start):
+            return False
+        mask = ((1 << b.size) - 1) << b.start
+        if self.prof_bits[b.teacher][b.day] & mask or self.class_bits[b.cls][b.day] & mask:
+            return False
+        key = self._load_key(b)
+        bits = self.key_bits[key][b.day] if key in self.key_bits else 0
+        if self.one_block_per_day and bits:
+            return False
+        # accostato a un blocco della stessa chiave non deve attraversare la pausa pranzo
+        merged = bits | mask
+        if 0 < self.lmh < self.daily_hours and merged >> (self.lmh - 1) & 3 == 3:
+            return False
+        cap = self.day_caps.get(key)
+        return cap is None or merged.bit_count() <= cap
+
+    def _term(self, p: int, d: int) -> float:
+        """Contributo allo score di (docente, giorno), come scoring.gap_terms."""
+        x = self.prof_bits[p][d]
+        if not self.day_mask[p, d] or x & (x - 1) == 0:
+            return 0.0
+        count = x.bit_count()
+        first = (x & -x).bit_length() - 1
+        last = x.bit_length() - 1
+        gaps = last - first + 1 - count
+        segments = (x & ~(x << 1)).bit_count()
+        cross = 1 if (x & self.morning_bits) and (x >> self.lmh) else 0
+        w = self.weights
+        return gaps * w.gap + (segments - 1) * w.segments + cross * w.lunch_cross
+
+    # ------------------------------------------------------------------
+    # Mosse
+    # ------------------------------------------------------------------
+
+    def _apply(self, changes: List[Tuple[int, Block]], check: bool = True) -> Optional[float]:
+        """
+        Sostituisce i blocchi indicati con le nuove versioni se tutte sono
+        valide; ritorna la variazione di score (None = mossa non valida,
+        stato invariato). check=False serve solo ad annullare una mossa.
+        """
+        old = [(i, self.blocks[i]) for i, _ in changes]
+        for _, b in old:
+            self._remove(b)
+        added: List[Block] = []
+        for _, nb in changes:
+            if check and not self._fits(nb):
+                for b in added:
+                    self._remove(b)
+                for _, b in old:
+                    self._add(b)
+                return None
+            self._add(nb)
+            added.append(nb)
+
+        if self.caps is not None:
+            for (_, b), (_, nb) in zip(old, changes):
+                if b.teacher != nb.teacher:
+                    self.used[b.teacher, b.subject] -= b.size
+                    self.used[nb.teacher, nb.subject] += nb.size
+            over = any(
+                self.used[nb.teacher, nb.subject] > self.caps[nb.teacher, nb.subject]
+                for (_, b), (_, nb) in zip(old, changes) if b.teacher != nb.teacher
+            )
+            if check and over:
+                for (_, b), (_, nb) in zip(old, changes):
+                    if b.teacher != nb.teacher:
+                        self.used[b.teacher, b.subject] += b.size
+                        self.used[nb.teacher, nb.subject] -= nb.size
+                for b in added:
+                    self._remove(b)
+                for _, b in old:
+                    self._add(b)
+                return None
+
+        for i, nb in changes:
+            self.blocks[i] = nb
+        touched = {(b.teacher, b.day) for _, b in old} | {(b.teacher, b.day) for b in added}
+        delta = 0.0
+        for p, d in touched:
+            new = self._term(p, d)
+            delta += new - self.terms[p][d]
+            self.terms[p][d] = new
+        self.score += delta
+        return delta
+
+    def _propose(self, kind: str) -> Optional[List[Tuple[int, Block]]]:
+        rng = self.rng
+        i = rng.randrange(len(self.blocks))
+        b = self.blocks[i]
+        if kind == "move":
+            day = rng.randrange(self.days)
+            start = rng.randrange(self.daily_hours - b.size + 1) if b.size <= self.daily_hours else 0
+            if (day, start) == (b.day, b.start):
+                return None
+            return [(i, Block(b.cls, b.subject, b.teacher, day, start, b.size))]
+
+        if kind == "swap":
+            others = self.class_blocks[b.cls]
+            j = others[rng.randrange(len(others))]
+            if j == i:
+                return None
+            o = self.blocks[j]
+            return [
+                (i, Block(b.cls, b.subject, b.teacher, o.day, o.start, b.size)),
+                (j, Block(o.cls, o.subject, o.teacher, b.day, b.start, o.size)),
+            ]
+
+        # teacher: tutti i blocchi di (classe, materia, docente) passano a un
+        # altro docente con capacità; altrimenti scambio con un gruppo dello
+        # stesso docente e materia in un'altra classe
+        candidates = np.flatnonzero(self.caps[:, b.subject] > 0)
+        if len(candidates) == 0:
+            return None
+        q = int(candidates[rng.randrange(len(candidates))])
+        if q == b.teacher:
+            return None
+        group = [k for k in self.class_blocks[b.cls]
+                 if self.blocks[k].subject == b.subject and self.blocks[k].teacher == b.teacher]
+        hours = sum(self.blocks[k].size for k in group)
+        changes = [(k, _with_teacher(self.blocks[k], q)) for k in group]
+        if self.used[q, b.subject] + hours > self.caps[q, b.subject]:
+            theirs = [k for k, o in enumerate(self.blocks)
+                      if o.subject == b.subject and o.teacher == q and o.cls != b.cls]
+            if not theirs:
+                return None
+            other_cls = self.blocks[theirs[rng.randrange(len(theirs))]].cls
+            changes += [(k, _with_teacher(self.blocks[k], b.teacher)) for k in theirs
+                        if self.blocks[k].cls == other_cls]
+        return changes
+
+    # ------------------------------------------------------------------
+    # Ricerca
+    # ------------------------------------------------------------------
+
+    def run(
+        self,
+        time_limit_sec: float = 2.0,
+        max_iters: Optional[int] = None,
+        start_temp: float = 0.5,
+        end_temp: float = 0.005,
+    ) -> List[Block]:
+        """
+        Simulated annealing con raffreddamento geometrico sul tempo (o sulle
+        iterazioni, con max_iters). Ritorna i blocchi della soluzione migliore;
+        `stats` riporta iterazioni, mosse provate/accettate per tipo e score.
+        """
+        moves = [m for m in MOVES if m != "teacher" or self.caps is not None]
+        tried = dict.fromkeys(moves, 0)
+        accepted = dict.fromkeys(moves, 0)
+        best_score = self.score
+        best = list(self.blocks)
+        initial = self.score
+        t0 = time.perf_counter()
+        iters = 0
+        progress = 0.0
+        while self.blocks and best_score > 1e-9:
+            if max_iters is not None:
+                if iters >= max_iters:
+                    break
+                progress = iters / max_iters
+            elif iters % 128 == 0:
+                progress = (time.perf_counter() - t0) / time_limit_sec if time_limit_sec > 0 else 1.0
+                if progress >= 1.0:
+                    break
+            iters += 1
+            temp = start_temp * (end_temp / start_temp) ** progress
+
+            kind = moves[self.rng.randrange(len(moves))]
+            changes = self._propose(kind)
+            if not changes:
+                continue
+            tried[kind] += 1
+            undo = [(i, self.blocks[i]) for i, _ in changes]
+            delta = self._apply(changes)
+            if delta is None:
+                continue
+            if delta <= 1e-12 or self.rng.random() < math.exp(-delta / temp):
+                accepted[kind] += 1
+                if self.score < best_score - 1e-12:
+                    best_score = self.score
+                    best = list(self.blocks)
+            else:
+                self._apply(undo, check=False)
+
+        self.stats = {
+            "engine": "local_search",
+            "iterations": iters,
+            "tried": tried,
+            "accepted": accepted,
+            "initial_score": initial,
+            "best_score": best_score,
+            "elapsed_sec": time.perf_counter() - t0,
+        }
+        return best
+
+
+def _with_teacher(b: Block, teacher: int) -> Block:
+    return Block(b.cls, b.subject, teacher, b.day, b.start, b.size)
+
+
+def blocks_to_plans(
+    blocks: List[Block], days: int, daily_hours: int, num_classes: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Ricostruisce (plan, subject_plan) con id 1-based."""
+    plan = np.zeros((days, daily_hours, num_classes), dtype=int)
+    subject_plan = np.zeros_like(plan)
+    for b in blocks:
+        plan[b.day, b.start:b.start + b.size, b.cls] = b.teacher + 1
+        subject_plan[b.day, b.start:b.start + b.size, b.cls] = b.subject + 1
+    return plan, subject_plan
+
+
+def improve_subject_plan(
+    config,
+    ctx,
+    plan: np.ndarray,
+    subject_plan: np.ndarray,
+    weights: GapWeights,
+    prof_subject_caps: np.ndarray,
+    time_limit_sec: float = 2.0,
+    one_block_per_day: bool = False,
+    seed: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, float, dict]:
+    """
+    Migliora un piano a materie (SubjectGreedyPlanner / SubjectRandomPlanner)
+    rispettando subject_daily_max e le capacità `prof_subject_caps` della
+    settimana. Ritorna (plan, subject_plan, score, stats).
+    """
+    if config.availability is None:
+        avail = np.ones((config.num_professors, config.days, 2), dtype=bool)
+    else:
+        avail = np.array(config.availability, dtype=bool)
+        if avail.ndim == 2:
+            avail = np.repeat(avail[:, :, None], 2, axis=2)
+    blocks = extract_blocks(plan, subject_plan)
+    day_caps = {
+        (c, s): int(ctx.subject_daily_max[s, c])
+        for c in range(config.num_classes) for s in range(ctx.num_subjects)
+    }
+    search = BlockLocalSearch(
+        config.days, config.daily_hours, config.num_professors, config.num_classes,
+        avail, config.last_morning_hour, config.wednesday_afternoon_free,
+        blocks, day_caps, weights,
+        one_block_per_day=one_block_per_day,
+        prof_subject_caps=prof_subject_caps,
+        rng=random.Random(seed),
+    )
+    best = search.run(time_limit_sec)
+    new_plan, new_subject_plan = blocks_to_plans(best, config.days, config.daily_hours, config.num_classes)
+    score = score_plan(new_plan, config.num_professors, config.last_morning_hour, weights)
+    return new_plan, new_subject_plan, score, search.stats
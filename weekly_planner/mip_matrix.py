@@ -0,0 +1,492 @@
+# weekly_planner/mip_matrix.py
+#
+# Assemblaggio diretto di modelli MIP in forma matriciale (COO/CSC) con
+# scrittura MPS e risoluzione tramite l'eseguibile CBC distribuito con PuLP.
+#
+# Evita gli oggetti LpVariable/LpAffineExpression e i nomi f-string di PuLP:
+# i coefficienti sono accumulati come array di indici/valori e i nomi di righe
+# e colonne sono generati solo se richiesti.
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pulp
+
+# Stati restituiti da `MatrixModel.solve`, allineati a pulp.LpStatus
+STATUS_OPTIMAL = "Optimal"
+STATUS_FEASIBLE = "Feasible"
+STATUS_INFEASIBLE = "Infeasible"
+STATUS_NOT_SOLVED = "Not Solved"
+
+_SENSE_CODES = {"<=": "L", ">=": "G", "==": "E"}
+
+# CBC controlla il time limit solo tra le sue fasi: il rilassamento
+# continuo alla radice di un modello grande può durare ben oltre. Oltre
+# time limit + margine il processo viene ucciso (senza soluzione).
+KILL_GRACE_SEC = 5.0
+KILL_GRACE_RATIO = 0.1
+
+
+@dataclass
+class MatrixSolution:
+    """Risultato di una risoluzione: valori indicizzati per colonna."""
+    status: str
+    objective: float
+    values: np.ndarray  # shape (num_cols,)
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (STATUS_OPTIMAL, STATUS_FEASIBLE)
+
+
+@dataclass
+class _ColumnBlock:
+    prefix: str
+    start: int
+    keys: List[tuple]
+
+
+@dataclass
+class MatrixModel:
+    """
+    Modello MIP (minimizzazione) costruito per array.
+
+    Le colonne sono aggiunte a blocchi (`add_vars`) e restituite come mappa
+    chiave -> indice di colonna. Le righe sono accumulate in forma COO:
+    `row_ptr` delimita le entrate di ciascuna riga in `cols`/`coefs`, come
+    in una matrice CSR. I nomi delle righe sono memorizzati come coppie
+    (template, argomenti) e formattati solo alla scrittura con `names=True`.
+    """
+    name: str = "MODEL"
+    num_cols: int = 0
+    lower: List[float] = field(default_factory=list)
+    upper: List[float] = field(default_factory=list)
+    integer: List[bool] = field(default_factory=list)
+    obj: Dict[int, float] = field(default_factory=dict)
+    blocks: List[_ColumnBlock] = field(default_factory=list)
+
+    cols: List[int] = field(default_factory=list)
+    coefs: List[float] = field(default_factory=list)
+    row_ptr: List[int] = field(default_factory=lambda: [0])
+    senses: List[str] = field(default_factory=list)
+    rhs: List[float] = field(default_factory=list)
+    row_names: List[Tuple[str, tuple]] = field(default_factory=list)
+
+    # ------------------------------------------------------------------
+    # Costruzione
+    # ------------------------------------------------------------------
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.senses)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.cols)
+
+    def add_vars(
+        self,
+        prefix: str,
+        keys: Iterable[tuple],
+        binary: bool = True,
+        lower: float = 0.0,
+        upper: float = 1.0,
+    ) -> Dict[tuple, int]:
+        """Aggiunge un blocco di colonne e ritorna la mappa chiave -> colonna."""
+        keys = list(keys)
+        start = self.num_cols
+        self.num_cols += len(keys)
+        self.lower.extend([lower] * len(keys))
+        self.upper.extend([upper] * len(keys))
+        self.integer.extend([binary] * len(keys))
+        self.blocks.append(_ColumnBlock(prefix=prefix, start=start, keys=keys))
+        return {k: start + i for i, k in enumerate(keys)}
+
+    def add_row(
+        self,
+        cols: Sequence[int],
+        coefs: Sequence[float] | float,
+        sense: str,
+        rhs: float,
+        name: Tuple[str, tuple] = ("R{}", ()),
+    ) -> None:
+        """
+        Aggiunge la riga sum(coefs * x[cols]) <sense> rhs.
+        `coefs` può essere uno scalare (stesso coefficiente per tutte le colonne).
+        """
+        self.cols.extend(cols)
+        if isinstance(coefs, (int, float)):
+            self.coefs.extend([float(coefs)] * len(cols))
+        else:
+            self.coefs.extend(coefs)
+        self.row_ptr.append(len(self.cols))
+        self.senses.append(_SENSE_CODES[sense])
+        self.rhs.append(float(rhs))
+        self.row_names.append(name)
+
+    def add_objective(self, cols: Iterable[int], coef: float) -> None:
+        for j in cols:
+            self.obj[j] = self.obj.get(j, 0.0) + coef
+
+    # ------------------------------------------------------------------
+    # Forme matriciali
+    # ------------------------------------------------------------------
+
+    def to_coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ritorna (righe, colonne, valori) della matrice dei vincoli."""
+        ptr = np.asarray(self.row_ptr, dtype=np.int64)
+        rows = np.repeat(np.arange(self.num_rows, dtype=np.int64), np.diff(ptr))
+        return rows, np.asarray(self.cols, dtype=np.int64), np.asarray(self.coefs, dtype=float)
+
+    def to_csr(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ritorna (indptr, indices, data) in forma CSR."""
+        return (
+            np.asarray(self.row_ptr, dtype=np.int64),
+            np.asarray(self.cols, dtype=np.int64),
+            np.asarray(self.coefs, dtype=float),
+        )
+
+    def to_csc(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ritorna (indptr, indices, data) in forma CSC (colonne ordinate)."""
+        rows, cols, vals = self.to_coo()
+        order = np.lexsort((rows, cols))
+        counts = np.bincount(cols, minlength=self.num_cols)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return indptr, rows[order], vals[order]
+
+    # ------------------------------------------------------------------
+    # Nomi
+    # ------------------------------------------------------------------
+
+    def col_names(self, names: bool = False) -> List[str]:
+        if not names:
+            return [f"X{j:07d}" for j in range(self.num_cols)]
+        out: List[str] = []
+        for block in self.blocks:
+            out.extend(var_name(block.prefix, key) for key in block.keys)
+        return out
+
+    def formatted_row_names(self, names: bool = False) -> List[str]:
+        if not names:
+            return [f"C{i:07d}" for i in range(self.num_rows)]
+        return [tpl.format(*args) for tpl, args in self.row_names]
+
+    def initial_values(self, assignment: Dict[str, Dict[tuple, float]]) -> np.ndarray:
+        """
+        Vettore di partenza per colonna da un assegnamento per famiglia di
+        variabili ({prefisso: {chiave: valore}}); le chiavi assenti valgono 0.
+        """
+        values = np.zeros(self.num_cols, dtype=float)
+        for block in self.blocks:
+            family = assignment.get(block.prefix)
+            if not family:
+                continue
+            for i, key in enumerate(block.keys):
+                v = family.get(key)
+                if v:
+                    values[block.start + i] = v
+        return values
+
+    def objective_value(self, values: np.ndarray) -> float:
+        """Valore dell'obiettivo per un vettore di valori per colonna."""
+        return float(sum(c * values[j] for j, c in self.obj.items()))
+
+    def is_feasible(self, values: np.ndarray, tol: float = 1e-6) -> bool:
+        """True se `values` rispetta bound, interezza e tutte le righe del modello."""
+        values = np.asarray(values, dtype=float)
+        if (values < np.asarray(self.lower) - tol).any() or (values > np.asarray(self.upper) + tol).any():
+            return False
+        integer = values[np.asarray(self.integer, dtype=bool)]
+        if (np.abs(integer - np.round(integer)) > tol).any():
+            return False
+        rows, cols, coefs = self.to_coo()
+        activity = np.bincount(rows, weights=coefs * values[cols], minlength=self.num_rows)
+        rhs, senses = np.asarray(self.rhs), np.asarray(self.senses)
+        violated = (
+            ((senses == "L") & (activity > rhs + tol))
+            | ((senses == "G") & (activity < rhs - tol))
+            | ((senses == "E") & (np.abs(activity - rhs) > tol))
+        )
+        return not violated.any()
+
+    # ------------------------------------------------------------------
+    # Scrittura MPS
+    # ------------------------------------------------------------------
+
+    def write_mps(self, path: str, names: bool = False) -> None:
+        """Scrive il modello in formato MPS (stesso layout usato da PuLP)."""
+        col_names = self.col_names(names)
+        row_names = self.formatted_row_names(names)
+        indptr, rows, vals = self.to_csc()
+
+        lines: List[str] = ["*SENSE:Minimize", f"NAME          {self.name}", "ROWS", " N  OBJ"]
+        lines.extend(f" {sense}  {rn}" for sense, rn in zip(self.senses, row_names))
+        lines.append("COLUMNS")
+
+        in_int = False
+        for j in range(self.num_cols):
+            if self.integer[j] and not in_int:
+                lines.append("    MARK      'MARKER'                 'INTORG'")
+                in_int = True
+            elif not self.integer[j] and in_int:
+                lines.append("    MARK      'MARKER'                 'INTEND'")
+                in_int = False
+            cn = col_names[j]
+            for k in range(indptr[j], indptr[j + 1]):
+                lines.append(f"    {cn:<8}  {row_names[rows[k]]:<8}  {vals[k]: .12e}")
+            cost = self.obj.get(j)
+            if cost:
+                lines.append(f"    {cn:<8}  OBJ       {cost: .12e}")
+            elif indptr[j] == indptr[j + 1]:
+                # colonna senza coefficienti: va comunque dichiarata
+                lines.append(f"    {cn:<8}  OBJ       {0.0: .12e}")
+        if in_int:
+            lines.append("    MARK      'MARKER'                 'INTEND'")
+
+        lines.append("RHS")
+        lines.extend(
+            f"    RHS       {row_names[i]:<8}  {self.rhs[i]: .12e}"
+            for i in range(self.num_rows)
+            if self.rhs[i] != 0.0
+        )
+
+        lines.append("BOUNDS")
+        for j in range(self.num_cols):
+            lo, up = self.lower[j], self.upper[j]
+            if self.integer[j] and lo == 0.0 and up == 1.0:
+                lines.append(f" BV BND       {col_names[j]}")
+                continue
+            if lo != 0.0:
+                lines.append(f" LO BND       {col_names[j]:<8}  {lo: .12e}")
+            if up != float("inf"):
+                lines.append(f" UP BND       {col_names[j]:<8}  {up: .12e}")
+        lines.append("ENDATA")
+
+        with open(path, "w", encoding="ascii") as f:
+            f.write("\n".join(lines))
+            f.write("\n")
+
+    # ------------------------------------------------------------------
+    # Risoluzione
+    # ------------------------------------------------------------------
+
+    def write_start(self, path: str, values: np.ndarray, names: bool = False) -> None:
+        """Scrive una soluzione di partenza nel formato letto da `cbc -mips`."""
+        col_names = self.col_names(names)
+        lines = ["Stopped on time - objective value 0\n"]
+        lines += [
+            "{:>7} {} {:>15} {:>23}\n".format(j, col_names[j], values[j], 0)
+            for j in range(self.num_cols)
+        ]
+        with open(path, "w", encoding="ascii") as f:
+            f.writelines(lines)
+
+    def solve(
+        self,
+        time_limit_sec: int | None = 60,
+        names: bool = False,
+        threads: int | None = None,
+        initial: np.ndarray | None = None,
+    ) -> MatrixSolution:
+        """
+        Scrive il modello su file MPS temporaneo, lancia CBC e rilegge la
+        soluzione in un array indicizzato per colonna. `initial` (valori per
+        colonna) viene passato a CBC come soluzione di partenza. Con un time
+        limit CBC viene ucciso se sfora di più del margine di tolleranza
+        (KILL_GRACE_SEC, o KILL_GRACE_RATIO del limite) e la soluzione è
+        STATUS_NOT_SOLVED.
+        """
+        cbc_path = pulp.PULP_CBC_CMD().path
+        with tempfile.TemporaryDirectory(prefix="wp_mip_") as tmp:
+            mps_path = os.path.join(tmp, "model.mps")
+            sol_path = os.path.join(tmp, "model.sol")
+            self.write_mps(mps_path, names=names)
+
+            args = [cbc_path, mps_path]
+            if initial is not None:
+                mst_path = os.path.join(tmp, "model.mst")
+                self.write_start(mst_path, initial, names=names)
+                args += ["-mips", mst_path]
+            if time_limit_sec is not None:
+                # come PuLP: senza timeMode elapsed CBC conta il tempo CPU di tutti i thread
+                args += ["-sec", str(time_limit_sec), "-timeMode", "elapsed"]
+            if threads is not None:
+                args += ["-threads", str(threads)]
+            args += ["-branch", "-printingOptions", "all", "-solution", sol_path]
+
+            kill_after = None
+            if time_limit_sec is not None:
+                kill_after = time_limit_sec + max(KILL_GRACE_SEC, KILL_GRACE_RATIO * time_limit_sec)
+            t0 = time.perf_counter()
+            with open(os.devnull, "w") as devnull:
+                try:
+                    subprocess.run(
+                        args, stdout=devnull, stderr=devnull, stdin=subprocess.DEVNULL, check=False, timeout=kill_after
+                    )
+                except subprocess.TimeoutExpired:
+                    return MatrixSolution(STATUS_NOT_SOLVED, float("inf"), np.zeros(self.num_cols))
+            timed_out = time_limit_sec is not None and time.perf_counter() - t0 >= time_limit_sec
+
+            if not os.path.exists(sol_path):
+                return MatrixSolution(STATUS_NOT_SOLVED, float("inf"), np.zeros(self.num_cols))
+            return self._read_solution(sol_path, names_used=names, timed_out=timed_out)
+
+    def _read_solution(self, sol_path: str, names_used: bool = False, timed_out: bool = False) -> MatrixSolution:
+        """
+        Legge il file di soluzione di CBC. "Integer infeasible" è anche
+        l'intestazione scritta quando il time limit scade nel preprocessing:
+        con `timed_out` non è una prova di infeasibilità e diventa
+        STATUS_NOT_SOLVED.
+        """
+        with open(sol_path) as f:
+            header = f.readline().split()
+            body = f.read().split()
+
+        status = STATUS_NOT_SOLVED
+        if header:
+            if header[0] == "Optimal":
+                status = STATUS_OPTIMAL
+            elif header[0] == "Infeasible":
+                status = STATUS_INFEASIBLE
+            elif header[0] == "Integer":
+                status = STATUS_NOT_SOLVED if timed_out else STATUS_INFEASIBLE
+            elif header[0] == "Stopped" and len(header) >= 5 and header[4] == "objective":
+                status = STATUS_FEASIBLE
+
+        values = np.zeros(self.num_cols, dtype=float)
+        # Con "-printingOptions all" CBC elenca prima le righe e poi le colonne:
+        # "[**] indice nome valore costo_ridotto". Teniamo solo le colonne.
+        tokens = [t for t in body if t != "**"]
+        if tokens:
+            table = np.array(tokens, dtype=object).reshape(-1, 4)
+            names = table[:, 1]
+            if names_used:
+                lookup = {n: j for j, n in enumerate(self.col_names(True))}
+                cols = np.fromiter((lookup.get(n, -1) for n in names), dtype=np.int64, count=len(names))
+            else:
+                cols = np.fromiter((_col_from_name(n) for n in names), dtype=np.int64, count=len(names))
+            valid = cols >= 0
+            values[cols[valid]] = table[valid, 2].astype(float)
+
+        return MatrixSolution(status=status, objective=self.objective_value(values), values=values)
+
+
+def var_name(prefix: str, key: tuple) -> str:
+    """Nome di variabile nello stesso formato di `pulp.LpVariable.dicts`."""
+    return f"{prefix}_{key}".replace(" ", "_")
+
+
+def set_pulp_start(prob: pulp.LpProblem, assignment: Dict[str, Dict[tuple, float]]) -> None:
+    """
+    Imposta i valori iniziali (warm start) di tutte le variabili di `prob` da
+    un assegnamento per famiglia ({prefisso: {chiave: valore}}); le variabili
+    non elencate partono da 0. I nomi seguono `var_name`.
+    """
+    named = {
+        var_name(prefix, key): value
+        for prefix, family in assignment.items()
+        for key, value in family.items()
+    }
+    for v in prob.variables():
+        v.setInitialValue(named.get(v.name, 0))
+
+
+def solve_pulp(prob: pulp.LpProblem, solver: pulp.LpSolver) -> str:
+    """
+    Risolve `prob` e ritorna lo stato come pulp.LpStatus. Se l'eseguibile
+    CBC termina con errore (succede con una soluzione di partenza quando il
+    time limit scade nel preprocessing) ritorna STATUS_NOT_SOLVED invece di
+    propagare PulpSolverError.
+    """
+    try:
+        prob.solve(solver)
+    except pulp.PulpSolverError:
+        return STATUS_NOT_SOLVED
+    return pulp.LpStatus[prob.status]
+
+
+def _col_from_name(name: str) -> int:
+    if len(name) == 8 and name[0] == "X" and name[1:].isdigit():
+        return int(name[1:])
+    return -1
+
+
+def variable_values(variables: Sequence[pulp.LpVariable]) -> np.ndarray:
+    """Legge in un solo passaggio i valori di una lista di variabili PuLP (None -> 0)."""
+    return np.fromiter(
+        (0.0 if v.varValue is None else v.varValue for v in variables),
+        dtype=float,
+        count=len(variables),
+    )
+
+
+def key_array(keys: Sequence[tuple], width: int) -> np.ndarray:
+    """Converte una lista di tuple-indice in un array intero (K, width)."""
+    return np.array(keys, dtype=np.int64).reshape(-1, width)
+
+
+def solution_tensor(keys: np.ndarray, values: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Riporta i valori di un insieme (anche sparso) di variabili in un tensore
+    denso indicizzato come le tuple: le tuple assenti valgono 0.
+    """
+    tensor = np.zeros(shape, dtype=float)
+    tensor[tuple(keys.T)] = values
+    return tensor
+
+
+def active_keys(keys: np.ndarray, values: np.ndarray, threshold: float = 0.5) -> np.ndarray:
+    """Righe di `keys` le cui variabili binarie valgono 1 nella soluzione."""
+    return keys[values > threshold]
+
+
+def remaining_limit(time_limit_sec: float | None, t0: float) -> int | None:
+    """
+    Time limit per CBC (secondi interi, almeno 1) che resta di
+    `time_limit_sec` contando da `t0` (time.perf_counter()): così il
+    budget copre anche la costruzione del modello. None senza limite.
+    """
+    if not time_limit_sec:
+        return None
+    return max(1, int(time_limit_sec - (time.perf_counter() - t0)))
+
+
+def peak_rss_mb() -> float | None:
+    """Picco di memoria residente del processo in MB (None se non disponibile)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class BuildTimer:
+    """Misura tempo di build/solve e picco di memoria per le statistiche MIP."""
+
+    def __init__(self, backend: str):
+        self.stats: dict = {"backend": backend}
+        self._t0 = time.perf_counter()
+
+    def built(self, rows: int, cols: int) -> None:
+        self.stats["build_sec"] = time.perf_counter() - self._t0
+        self.stats["rows"] = rows
+        self.stats["cols"] = cols
+        self.stats["peak_rss_mb"] = peak_rss_mb()
+        self._t0 = time.perf_counter()
+
+    def solved(self, status: str, optimal: bool = False) -> dict:
+        """`optimal` è True solo se CBC ha dimostrato l'ottimalità (non a tempo scaduto)."""
+        self.stats["solve_sec"] = time.perf_counter() - self._t0
+        self.stats["status"] = status
+        self.stats["optimal"] = optimal
+        return self.stats
@@ -2,12 +2,57 @@
 
 from __future__ import annotations
 
-from typing import List, Tuple
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
 
 import numpy as np
 import pulp
 
+from .mip_matrix import (
+    STATUS_FEASIBLE,
+    STATUS_OPTIMAL,
+    BuildTimer,
+    MatrixModel,
+    active_keys,
+    key_array,
+    remaining_limit,
+    set_pulp_start,
+    solve_pulp,
+    var_name,
+    variable_values,
+)
 from .models import PlannerConfig, PlanResult
+from .symmetry import SymmetryGroups, canonical_teachers, legacy_symmetry
+
+
+@dataclass
+class WeeklyVarIndex:
+    """
+    Indice sparso delle variabili x[d,h,c,p] del modello MIP legacy,
+    con le liste di adiacenza usate per costruire i vincoli.
+    """
+    pairs: List[Tuple[int, int]]  # coppie (prof, classe) con H[p, c] > 0
+    keys: List[Tuple[int, int, int, int]] = field(default_factory=list)
+    by_pc: Dict[Tuple[int, int], List[tuple]] = field(default_factory=dict)
+    by_dhc: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    by_dhp: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    hours_by_dpc: Dict[Tuple[int, int, int], List[int]] = field(default_factory=dict)
+
+    def add(self, key: Tuple[int, int, int, int]) -> None:
+        d, h, c, p = key
+        self.keys.append(key)
+        self.by_pc.setdefault((p, c), []).append(key)
+        self.by_dhc.setdefault((d, h, c), []).append(key)
+        self.by_dhp.setdefault((d, h, p), []).append(key)
+        self.hours_by_dpc.setdefault((d, p, c), []).append(h)
+
+
+# Formulazioni disponibili per il vincolo "0, 1 o 2 ore consecutive al giorno"
+BLOCK_FORMULATIONS = ("pairwise", "block_start")
+
+# Modi di assemblare il modello: espressioni PuLP o array (vedi mip_matrix)
+MIP_BACKENDS = ("pulp", "matrix")
 
 
 class MIPWeeklyPlanner:
@@ -67,30 +112,68 @@ class MIPWeeklyPlanner:
         slot = 0 if hour < self.last_morning_hour else 1
         return bool(self.A[prof, day, slot])
 
-    def solve(self, time_limit_sec: int | None = 60) -> PlanResult:
+    def _is_blocked_slot(self, day: int, hour: int) -> bool:
+        """True se lo slot è escluso a priori (mercoledì pomeriggio libero)."""
+        return bool(self.wed_free and self.days > 2 and day == 2 and hour >= self.last_morning_hour)
+
+    def _build_index(self) -> WeeklyVarIndex:
         """
-        Costruisce e risolve il modello MIP con PuLP.
+        Enumera le sole tuple (d, h, c, p) ammissibili:
+          - H[p, c] > 0
+          - prof disponibile nello slot
+          - slot non bloccato dal mercoledì pomeriggio libero
         """
-        D = self.days
+        pairs = [
+            (p, c)
+            for p in range(self.n)
+            for c in range(self.m)
+            if int(self.H[p, c]) > 0
+        ]
+        idx = WeeklyVarIndex(pairs=pairs)
+        for d in range(self.days):
+            for h in range(self.daily_hours):
+                if self._is_blocked_slot(d, h):
+                    continue
+                for p, c in pairs:
+                    if self._is_available(p, d, h):
+                        idx.add((d, h, c, p))
+        return idx
+
+    def _build_model(
+        self,
+        block_formulation: str = "pairwise",
+    ) -> Tuple[pulp.LpProblem, Dict[tuple, pulp.LpVariable], WeeklyVarIndex] | None:
+        """
+        Costruisce il modello MIP senza risolverlo.
+
+        Le variabili sono create solo per le tuple ammissibili (vedi
+        `_build_index`): gli slot bloccati non entrano nel modello.
+        Ritorna None se il modello è banalmente infeasible.
+        """
+        if block_formulation not in BLOCK_FORMULATIONS:
+            raise ValueError(
+                f"block_formulation non valida: {block_formulation!r} "
+                f"(ammesse: {', '.join(BLOCK_FORMULATIONS)})"
+            )
+
         H = self.daily_hours
-        M = self.m
-        N = self.n
+
+        idx = self._build_index()
+
+        # Una coppia (prof, classe) con meno slot ammissibili delle ore richieste
+        # rende il modello infeasible: inutile costruirlo
+        for p, c in idx.pairs:
+            if len(idx.by_pc.get((p, c), [])) < int(self.H[p, c]):
+                return None
 
         prob = pulp.LpProblem("WeeklyTimetable", pulp.LpMinimize)
 
         # -----------------------------------------------------------
-        # Variabili principali: x[d,h,c,p] ∈ {0,1}
+        # Variabili principali: x[d,h,c,p] ∈ {0,1} (solo tuple ammissibili)
         # -----------------------------------------------------------
-        x_index: List[Tuple[int, int, int, int]] = [
-            (d, h, c, p)
-            for d in range(D)
-            for h in range(H)
-            for c in range(M)
-            for p in range(N)
-        ]
         x = pulp.LpVariable.dicts(
             "x",
-            x_index,
+            idx.keys,
             lowBound=0,
             upBound=1,
             cat=pulp.LpBinary,
@@ -99,128 +182,67 @@ class MIPWeeklyPlanner:
         # -----------------------------------------------------------
         # 1) Ore totali per prof / classe
         # -----------------------------------------------------------
-        for p in range(N):
-            for c in range(M):
-                vars_list = [
-                    x[(d, h, c, p)]
-                    for d in range(D)
-                    for h in range(H)
-                ]
-                required_hours = int(self.H[p, c])
-                prob += (
-                    pulp.lpSum(vars_list) == required_hours,
-                    f"Hours_p{p}_c{c}",
-                )
+        for (p, c), keys in idx.by_pc.items():
+            prob += (
+                pulp.lpSum(x[k] for k in keys) == int(self.H[p, c]),
+                f"Hours_p{p}_c{c}",
+            )
 
         # -----------------------------------------------------------
         # 2) Una classe ha al massimo un prof per slot
         # -----------------------------------------------------------
-        for d in range(D):
-            for h in range(H):
-                for c in range(M):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, p)] for p in range(N)) <= 1,
-                        f"ClassOneProf_d{d}_h{h}_c{c}",
-                    )
+        for (d, h, c), keys in idx.by_dhc.items():
+            if len(keys) > 1:
+                prob += (
+                    pulp.lpSum(x[k] for k in keys) <= 1,
+                    f"ClassOneProf_d{d}_h{h}_c{c}",
+                )
 
         # -----------------------------------------------------------
         # 3) Un prof non può essere in due classi nello stesso slot
         # -----------------------------------------------------------
-        for d in range(D):
-            for h in range(H):
-                for p in range(N):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, p)] for c in range(M)) <= 1,
-                        f"ProfOneClass_d{d}_h{h}_p{p}",
-                    )
-
-        # -----------------------------------------------------------
-        # 4) Disponibilità dei professori
-        # -----------------------------------------------------------
-        for p in range(N):
-            for d in range(D):
-                for h in range(H):
-                    if not self._is_available(p, d, h):
-                        for c in range(M):
-                            prob += (
-                                x[(d, h, c, p)] == 0,
-                                f"Unavailable_p{p}_d{d}_h{h}_c{c}",
-                            )
-
-        # -----------------------------------------------------------
-        # 5) Mercoledì pomeriggio libero (se attivo)
-        # -----------------------------------------------------------
-        if self.wed_free and D > 2:
-            wed = 2  # giorno 2 = mercoledì (0-based)
-            for h in range(self.last_morning_hour, H):
-                for c in range(M):
-                    for p in range(N):
-                        prob += (
-                            x[(wed, h, c, p)] == 0,
-                            f"WedFree_d{wed}_h{h}_c{c}_p{p}",
-                        )
+        for (d, h, p), keys in idx.by_dhp.items():
+            if len(keys) > 1:
+                prob += (
+                    pulp.lpSum(x[k] for k in keys) <= 1,
+                    f"ProfOneClass_d{d}_h{h}_p{p}",
+                )
 
         # -----------------------------------------------------------
-        # 6) Max 2 ore al giorno per (prof, classe)
+        # 4-5) Disponibilità e mercoledì pomeriggio libero:
+        #      gestiti in `_build_index`, gli slot bloccati non hanno variabili.
         # -----------------------------------------------------------
-        for d in range(D):
-            for p in range(N):
-                for c in range(M):
-                    if self.class_teachers[p]:
-                        continue
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, p)] for h in range(H)) <= 2,
-                        f"Max2Hours_d{d}_p{p}_c{c}",
-                    )
 
-        # -----------------------------------------------------------
-        # 6b) Per (prof, classe, giorno) le eventuali 2 ore
-        #     devono essere consecutive:
-        #
-        #     vietiamo che per lo stesso (d,p,c) ci siano due ore
-        #     NON adiacenti (differenza >= 2).
-        #
-        #     Con il vincolo precedente (max 2 ore/dì) questo implica:
-        #       - 0 ore
-        #       - 1 ora
-        #       - 2 ore consecutive soltanto.
-        # -----------------------------------------------------------
-        for d in range(D):
-            for p in range(N):
-                if self.class_teachers[p]:
-                    continue
-                for c in range(M):
-                    for h1 in range(H):
-                        for h2 in range(h1 + 2, H):
-                            prob += (
-                                x[(d, h1, c, p)] + x[(d, h2, c, p)] <= 1,
-                                f"ConsecutiveBlock_d{d}_p{p}_c{c}_h{h1}_{h2}",
-                            )
+        if block_formulation == "block_start":
+            # 6, 6b, 7) per i non docenti di classe: formulazione a blocchi
+            self._add_block_start_rows(prob, x, idx)
+        else:
+            self._add_pairwise_block_rows(prob, x, idx)
 
         # -----------------------------------------------------------
         # 7) Nessun blocco di 2 ore che attraversi mattina/pomeriggio
         #    (cioè non permettere (L-1, L) entrambe a 1)
+        #
+        #    Con "block_start" i non docenti di classe lo rispettano per
+        #    costruzione: la riga serve solo per i docenti di classe.
         # -----------------------------------------------------------
         L = self.last_morning_hour
         if 0 < L < H:
-            for d in range(D):
-                for c in range(M):
-                    for p in range(N):
-                        prob += (
-                            x[(d, L - 1, c, p)] + x[(d, L, c, p)] <= 1,
-                            f"NoCrossLunchBlock_d{d}_c{c}_p{p}",
-                        )
+            for (d, h, c, p) in idx.keys:
+                if h != L - 1 or (d, L, c, p) not in x:
+                    continue
+                if block_formulation == "block_start" and not self.class_teachers[p]:
+                    continue
+                prob += (
+                    x[(d, L - 1, c, p)] + x[(d, L, c, p)] <= 1,
+                    f"NoCrossLunchBlock_d{d}_c{c}_p{p}",
+                )
 
         # -----------------------------------------------------------
         # Variabili ausiliarie per l'obiettivo anti-buche
         # -----------------------------------------------------------
         # z[d,h,p] ∈ {0,1} = 1 se il prof p lavora in (d,h) (con qualunque classe)
-        z_index: List[Tuple[int, int, int]] = [
-            (d, h, p)
-            for d in range(D)
-            for h in range(H)
-            for p in range(N)
-        ]
+        z_index: List[Tuple[int, int, int]] = list(idx.by_dhp)
         z = pulp.LpVariable.dicts(
             "z",
             z_index,
@@ -230,15 +252,9 @@ class MIPWeeklyPlanner:
         )
 
         # s[d,h,p] ∈ {0,1} = 1 se (d,h) è l'inizio di un segmento di lavoro
-        s_index: List[Tuple[int, int, int]] = [
-            (d, h, p)
-            for d in range(D)
-            for h in range(H)
-            for p in range(N)
-        ]
         s = pulp.LpVariable.dicts(
             "s",
-            s_index,
+            z_index,
             lowBound=0,
             upBound=1,
             cat=pulp.LpBinary,
@@ -247,38 +263,32 @@ class MIPWeeklyPlanner:
         # Legare z a x:
         # dato che sum_c x <= 1, possiamo imporre:
         #   z[d,h,p] = sum_c x[d,h,c,p]
-        for d in range(D):
-            for h in range(H):
-                for p in range(N):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, p)] for c in range(M)) - z[(d, h, p)] == 0,
-                        f"Def_z_d{d}_h{h}_p{p}",
-                    )
+        for (d, h, p), keys in idx.by_dhp.items():
+            prob += (
+                pulp.lpSum(x[k] for k in keys) - z[(d, h, p)] == 0,
+                f"Def_z_d{d}_h{h}_p{p}",
+            )
 
         # Definizione di s (inizio segmento):
-        # h = 0: s[d,0,p] = z[d,0,p]
-        # h > 0: s[d,h,p] >= z[d,h,p] - z[d,h-1,p], s[d,h,p] <= z[d,h,p]
-        for d in range(D):
-            for p in range(N):
-                # h = 0
+        # z[d,h-1,p] assente (h = 0 o slot senza variabili): s[d,h,p] >= z[d,h,p]
+        # altrimenti: s[d,h,p] >= z[d,h,p] - z[d,h-1,p]
+        # sempre: s[d,h,p] <= z[d,h,p]
+        for (d, h, p) in z_index:
+            prev = z.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
                 prob += (
-                    s[(d, 0, p)] >= z[(d, 0, p)],
-                    f"StartSeg_h0_d{d}_p{p}",
+                    s[(d, h, p)] >= z[(d, h, p)],
+                    f"StartSeg_d{d}_h{h}_p{p}",
                 )
+            else:
                 prob += (
-                    s[(d, 0, p)] <= z[(d, 0, p)],
-                    f"StartSegUpper_h0_d{d}_p{p}",
+                    s[(d, h, p)] >= z[(d, h, p)] - prev,
+                    f"StartSeg_d{d}_h{h}_p{p}",
                 )
-                # h > 0
-                for h in range(1, H):
-                    prob += (
-                        s[(d, h, p)] >= z[(d, h, p)] - z[(d, h - 1, p)],
-                        f"StartSeg_d{d}_h{h}_p{p}",
-                    )
-                    prob += (
-                        s[(d, h, p)] <= z[(d, h, p)],
-                        f"StartSegUpper_d{d}_h{h}_p{p}",
-                    )
+            prob += (
+                s[(d, h, p)] <= z[(d, h, p)],
+                f"StartSegUpper_d{d}_h{h}_p{p}",
+            )
 
         # -----------------------------------------------------------
         # Funzione obiettivo:
@@ -288,52 +298,447 @@ class MIPWeeklyPlanner:
         w_last = 1.0
 
         # numero segmenti = sum s[d,h,p]
-        gap_terms = [
-            s[(d, h, p)]
-            for d in range(D)
-            for h in range(H)
-            for p in range(N)
-        ]
+        gap_terms = list(s.values())
 
         # lezioni all'ultima ora
         last_hour = H - 1
-        last_terms = [
-            x[(d, last_hour, c, p)]
-            for d in range(D)
-            for c in range(M)
-            for p in range(N)
-        ]
+        last_terms = [x[k] for k in idx.keys if k[1] == last_hour]
 
         prob += (
             w_gap * pulp.lpSum(gap_terms) + w_last * pulp.lpSum(last_terms),
             "MinimizeGapsAndLastHour",
         )
 
+        return prob, x, idx
+
+    def _add_pairwise_block_rows(
+        self,
+        prob: pulp.LpProblem,
+        x: Dict[tuple, pulp.LpVariable],
+        idx: WeeklyVarIndex,
+    ) -> None:
+        """
+        Formulazione "pairwise" dei blocchi per (prof, classe, giorno):
+        massimo 2 ore e divieto di ogni coppia di ore non adiacenti.
+        Le righe crescono come O(H^2) per ogni (d, p, c).
+        """
         # -----------------------------------------------------------
-        # Risoluzione
+        # 6) Max 2 ore al giorno per (prof, classe)
+        # -----------------------------------------------------------
+        for (d, p, c), hours in idx.hours_by_dpc.items():
+            if self.class_teachers[p] or len(hours) <= 2:
+                continue
+            prob += (
+                pulp.lpSum(x[(d, h, c, p)] for h in hours) <= 2,
+                f"Max2Hours_d{d}_p{p}_c{c}",
+            )
+
         # -----------------------------------------------------------
-        if time_limit_sec is not None:
-            solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit_sec)
+        # 6b) Per (prof, classe, giorno) le eventuali 2 ore
+        #     devono essere consecutive:
+        #
+        #     vietiamo che per lo stesso (d,p,c) ci siano due ore
+        #     NON adiacenti (differenza >= 2).
+        #
+        #     Con il vincolo precedente (max 2 ore/dì) questo implica:
+        #       - 0 ore
+        #       - 1 ora
+        #       - 2 ore consecutive soltanto.
+        # -----------------------------------------------------------
+        for (d, p, c), hours in idx.hours_by_dpc.items():
+            if self.class_teachers[p]:
+                continue
+            for i, h1 in enumerate(hours):
+                for h2 in hours[i + 1:]:
+                    if h2 - h1 < 2:
+                        continue
+                    prob += (
+                        x[(d, h1, c, p)] + x[(d, h2, c, p)] <= 1,
+                        f"ConsecutiveBlock_d{d}_p{p}_c{c}_h{h1}_{h2}",
+                    )
+
+    def _add_block_start_rows(
+        self,
+        prob: pulp.LpProblem,
+        x: Dict[tuple, pulp.LpVariable],
+        idx: WeeklyVarIndex,
+    ) -> None:
+        """
+        Formulazione "block_start" dei blocchi per (prof, classe, giorno).
+
+        b1[d,h,c,p] = 1 se inizia in h un blocco da 1 ora,
+        b2[d,h,c,p] = 1 se inizia in h un blocco da 2 ore (h, h+1 ammissibili
+        e non a cavallo della pausa pranzo). Con
+
+            x[d,h,c,p] = b1[h] + b2[h] + b2[h-1]
+            sum_h (b1[h] + b2[h]) <= 1
+
+        per (d, p, c) restano solo 0 ore, 1 ora o 2 ore consecutive, con un
+        numero di righe lineare in H e un rilassamento LP più stretto.
+        """
+        H = self.daily_hours
+        L = self.last_morning_hour
+
+        for (d, p, c), hours in idx.hours_by_dpc.items():
+            if self.class_teachers[p]:
+                continue
+            allowed = set(hours)
+            b1 = {
+                h: pulp.LpVariable(var_name("b1", (d, h, c, p)), cat=pulp.LpBinary)
+                for h in hours
+            }
+            b2 = {
+                h: pulp.LpVariable(var_name("b2", (d, h, c, p)), cat=pulp.LpBinary)
+                for h in hours
+                if h + 1 in allowed and not (0 < L < H and h == L - 1)
+            }
+            for h in hours:
+                covering = [b1[h]]
+                if h in b2:
+                    covering.append(b2[h])
+                if h - 1 in b2:
+                    covering.append(b2[h - 1])
+                prob += (
+                    x[(d, h, c, p)] - pulp.lpSum(covering) == 0,
+                    f"BlockLink_d{d}_h{h}_c{c}_p{p}",
+                )
+            prob += (
+                pulp.lpSum(b1.values()) + pulp.lpSum(b2.values()) <= 1,
+                f"OneBlock_d{d}_p{p}_c{c}",
+            )
+
+    def _build_matrix_model(
+        self,
+        block_formulation: str = "pairwise",
+    ) -> Tuple[MatrixModel, Dict[tuple, int], WeeklyVarIndex] | None:
+        """
+        Stesso modello di `_build_model`, assemblato direttamente per array
+        con `MatrixModel` (niente oggetti espressione PuLP). Righe, colonne,
+        coefficienti e nomi (con names=True) coincidono con la versione PuLP.
+        """
+        if block_formulation not in BLOCK_FORMULATIONS:
+            raise ValueError(
+                f"block_formulation non valida: {block_formulation!r} "
+                f"(ammesse: {', '.join(BLOCK_FORMULATIONS)})"
+            )
+
+        H = self.daily_hours
+        L = self.last_morning_hour
+
+        idx = self._build_index()
+        for p, c in idx.pairs:
+            if len(idx.by_pc.get((p, c), [])) < int(self.H[p, c]):
+                return None
+
+        model = MatrixModel(name="WeeklyTimetable")
+        x = model.add_vars("x", idx.keys)
+
+        # 1) Ore totali per prof / classe
+        for (p, c), keys in idx.by_pc.items():
+            model.add_row([x[k] for k in keys], 1.0, "==", int(self.H[p, c]), ("Hours_p{}_c{}", (p, c)))
+
+        # 2) Una classe ha al massimo un prof per slot
+        for (d, h, c), keys in idx.by_dhc.items():
+            if len(keys) > 1:
+                model.add_row([x[k] for k in keys], 1.0, "<=", 1, ("ClassOneProf_d{}_h{}_c{}", (d, h, c)))
+
+        # 3) Un prof non può essere in due classi nello stesso slot
+        for (d, h, p), keys in idx.by_dhp.items():
+            if len(keys) > 1:
+                model.add_row([x[k] for k in keys], 1.0, "<=", 1, ("ProfOneClass_d{}_h{}_p{}", (d, h, p)))
+
+        if block_formulation == "block_start":
+            # 6, 6b, 7) per i non docenti di classe: formulazione a blocchi
+            for (d, p, c), hours in idx.hours_by_dpc.items():
+                if self.class_teachers[p]:
+                    continue
+                allowed = set(hours)
+                b1 = model.add_vars("b1", [(d, h, c, p) for h in hours])
+                b2 = model.add_vars(
+                    "b2",
+                    [
+                        (d, h, c, p)
+                        for h in hours
+                        if h + 1 in allowed and not (0 < L < H and h == L - 1)
+                    ],
+                )
+                for h in hours:
+                    covering = [b1[(d, h, c, p)]]
+                    if (d, h, c, p) in b2:
+                        covering.append(b2[(d, h, c, p)])
+                    if (d, h - 1, c, p) in b2:
+                        covering.append(b2[(d, h - 1, c, p)])
+                    model.add_row(
+                        [x[(d, h, c, p)]] + covering,
+                        [1.0] + [-1.0] * len(covering),
+                        "==",
+                        0,
+                        ("BlockLink_d{}_h{}_c{}_p{}", (d, h, c, p)),
+                    )
+                model.add_row(
+                    list(b1.values()) + list(b2.values()), 1.0, "<=", 1, ("OneBlock_d{}_p{}_c{}", (d, p, c))
+                )
         else:
-            solver = pulp.PULP_CBC_CMD(msg=False)
+            # 6) Max 2 ore al giorno per (prof, classe)
+            for (d, p, c), hours in idx.hours_by_dpc.items():
+                if self.class_teachers[p] or len(hours) <= 2:
+                    continue
+                model.add_row(
+                    [x[(d, h, c, p)] for h in hours], 1.0, "<=", 2, ("Max2Hours_d{}_p{}_c{}", (d, p, c))
+                )
+            # 6b) Coppie di ore non adiacenti vietate
+            for (d, p, c), hours in idx.hours_by_dpc.items():
+                if self.class_teachers[p]:
+                    continue
+                for i, h1 in enumerate(hours):
+                    for h2 in hours[i + 1:]:
+                        if h2 - h1 < 2:
+                            continue
+                        model.add_row(
+                            [x[(d, h1, c, p)], x[(d, h2, c, p)]],
+                            1.0,
+                            "<=",
+                            1,
+                            ("ConsecutiveBlock_d{}_p{}_c{}_h{}_{}", (d, p, c, h1, h2)),
+                        )
 
-        prob.solve(solver)
+        # 7) Nessun blocco di 2 ore che attraversi mattina/pomeriggio
+        if 0 < L < H:
+            for (d, h, c, p) in idx.keys:
+                if h != L - 1 or (d, L, c, p) not in x:
+                    continue
+                if block_formulation == "block_start" and not self.class_teachers[p]:
+                    continue
+                model.add_row(
+                    [x[(d, L - 1, c, p)], x[(d, L, c, p)]], 1.0, "<=", 1, ("NoCrossLunchBlock_d{}_c{}_p{}", (d, c, p))
+                )
 
-        status = pulp.LpStatus[prob.status]
-        if status not in ("Optimal", "Feasible"):
+        # Variabili ausiliarie anti-buche
+        z_index = list(idx.by_dhp)
+        z = model.add_vars("z", z_index)
+        s = model.add_vars("s", z_index)
+
+        for (d, h, p), keys in idx.by_dhp.items():
+            model.add_row(
+                [x[k] for k in keys] + [z[(d, h, p)]],
+                [1.0] * len(keys) + [-1.0],
+                "==",
+                0,
+                ("Def_z_d{}_h{}_p{}", (d, h, p)),
+            )
+
+        for (d, h, p) in z_index:
+            prev = z.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
+                model.add_row([s[(d, h, p)], z[(d, h, p)]], [1.0, -1.0], ">=", 0, ("StartSeg_d{}_h{}_p{}", (d, h, p)))
+            else:
+                model.add_row(
+                    [s[(d, h, p)], z[(d, h, p)], prev], [1.0, -1.0, 1.0], ">=", 0, ("StartSeg_d{}_h{}_p{}", (d, h, p))
+                )
+            model.add_row([s[(d, h, p)], z[(d, h, p)]], [1.0, -1.0], "<=", 0, ("StartSegUpper_d{}_h{}_p{}", (d, h, p)))
+
+        # Obiettivo: w_gap * (numero segmenti) + w_last * (lezioni ultima ora)
+        w_gap = 10.0
+        w_last = 1.0
+        model.add_objective(s.values(), w_gap)
+        model.add_objective((x[k] for k in idx.keys if k[1] == H - 1), w_last)
+
+        return model, x, idx
+
+    def _plan_from_values(self, idx: WeeklyVarIndex, values: np.ndarray) -> np.ndarray:
+        """
+        Costruisce P[d,h,c] = id_prof (1..N) o 0 dai valori di x, allineati
+        a `idx.keys`, con uno scatter sulle tuple attive.
+        """
+        P = np.zeros((self.days, self.daily_hours, self.m), dtype=int)
+        on = active_keys(key_array(idx.keys, 4), values)
+        P[on[:, 0], on[:, 1], on[:, 2]] = on[:, 3] + 1
+        return P
+
+    def _warm_start_assignment(
+        self,
+        idx: WeeklyVarIndex,
+        plan: np.ndarray,
+        block_formulation: str = "pairwise",
+    ) -> Dict[str, Dict[tuple, float]]:
+        """
+        Converte un piano P[d,h,c] (es. da WeeklyPlanner) in una soluzione di
+        partenza completa: x, z, s e, con "block_start", b1/b2.
+        Le celle che non corrispondono a tuple ammissibili vengono ignorate:
+        CBC scarta da solo una partenza non ammissibile.
+        """
+        keyset = set(idx.keys)
+        x_on = {}
+        for d, h, c in zip(*np.nonzero(plan)):
+            key = (int(d), int(h), int(c), int(plan[d, h, c]) - 1)
+            if key in keyset:
+                x_on[key] = 1.0
+
+        z_on = {(d, h, p): 1.0 for (d, h, c, p) in x_on}
+        s_on = {(d, h, p): 1.0 for (d, h, p) in z_on if (d, h - 1, p) not in z_on}
+        assignment = {"x": x_on, "z": z_on, "s": s_on}
+
+        if block_formulation == "block_start":
+            hours_on: Dict[tuple, List[int]] = {}
+            for (d, h, c, p) in sorted(x_on):
+                if not self.class_teachers[p]:
+                    hours_on.setdefault((d, p, c), []).append(h)
+            b1: Dict[tuple, float] = {}
+            b2: Dict[tuple, float] = {}
+            for (d, p, c), hours in hours_on.items():
+                if len(hours) == 1:
+                    b1[(d, hours[0], c, p)] = 1.0
+                elif len(hours) == 2 and hours[1] == hours[0] + 1:
+                    b2[(d, hours[0], c, p)] = 1.0
+            assignment["b1"] = b1
+            assignment["b2"] = b2
+
+        return assignment
+
+    def _first_open_slot(self) -> Tuple[int, int] | None:
+        """Primo slot (d, h) non bloccato, in ordine di giorno e ora."""
+        for d in range(self.days):
+            for h in range(self.daily_hours):
+                if not self._is_blocked_slot(d, h):
+                    return d, h
+        return None
+
+    @staticmethod
+    def _fixed_keys(idx: WeeklyVarIndex, symmetry: SymmetryGroups | None) -> List[Tuple[int, int, int, int]]:
+        """Chiavi x[d,h,c,p] escluse dall'orbit fixing di `symmetry` (nessuna senza)."""
+        if symmetry is None:
+            return []
+        excluded = symmetry.fixed()
+        return [key for key in idx.keys if key in excluded]
+
+    def solve(
+        self,
+        time_limit_sec: int | None = 60,
+        block_formulation: str = "pairwise",
+        backend: str = "pulp",
+        warm_start: PlanResult | None = None,
+        threads: int | None = None,
+        symmetry_breaking: bool = True,
+    ) -> PlanResult:
+        """
+        Costruisce e risolve il modello MIP.
+
+        block_formulation sceglie come esprimere "0, 1 o 2 ore consecutive
+        al giorno" per (prof, classe):
+          - "pairwise": una riga per ogni coppia di ore non adiacenti
+          - "block_start": variabili di inizio blocco, righe lineari in H
+
+        backend sceglie come assemblare il modello:
+          - "pulp": espressioni PuLP (default)
+          - "matrix": array COO/CSC scritti in MPS e passati a CBC
+
+        warm_start (es. il risultato di WeeklyPlanner) viene convertito in
+        una soluzione di partenza completa: CBC parte con un incumbent e deve
+        solo migliorarlo. Se CBC termina con errore o senza soluzione intera
+        (può succedere quando il time limit scade nel preprocessing) viene
+        restituito il piano di partenza con il suo obiettivo, purché rispetti
+        bound e vincoli del modello (warm_start_valid nelle statistiche);
+        altrimenti nessun piano, con lo stato di CBC.
+
+        threads è passato a CBC (None = default del solver, un thread).
+
+        symmetry_breaking fissa l'orbita delle prime assegnazioni dei docenti
+        intercambiabili nel primo slot (vedi symmetry.py): le variabili
+        escluse hanno upper bound 0 e il warm start viene rinominato di
+        conseguenza. I gruppi trovati finiscono in `solve_stats["symmetry"]`.
+
+        time_limit_sec copre anche la costruzione del modello: CBC riceve
+        solo il tempo che resta.
+
+        Tempo di build, picco di memoria e tempo di solve sono riportati in
+        `PlanResult.solve_stats`.
+        """
+        if backend not in MIP_BACKENDS:
+            raise ValueError(f"backend non valido: {backend!r} (ammessi: {', '.join(MIP_BACKENDS)})")
+
+        t0 = time.perf_counter()
+        timer = BuildTimer(backend)
+
+        start_plan = np.asarray(warm_start.plans[0]) if warm_start is not None and warm_start.plans else None
+        symmetry = None
+        if symmetry_breaking:
+            symmetry = legacy_symmetry(self.H, self.A, self.class_teachers, self._first_open_slot())
+            if start_plan is not None:
+                plan = start_plan
+                start_plan = canonical_teachers(plan, symmetry, lambda key: [int(plan[key]) - 1])
+
+        if backend == "matrix":
+            built = self._build_matrix_model(block_formulation=block_formulation)
+            if built is None:
+                return PlanResult(plans=[], scores=[], week_labels=["A"])
+            model, x_cols, idx = built
+            fixed = self._fixed_keys(idx, symmetry)
+            for key in fixed:
+                model.upper[x_cols[key]] = 0.0
+            initial = None
+            fallback = False
+            if start_plan is not None:
+                initial = model.initial_values(self._warm_start_assignment(idx, start_plan, block_formulation))
+                fallback = timer.stats["warm_start_valid"] = model.is_feasible(initial)
+            timer.built(model.num_rows, model.num_cols)
+            if symmetry is not None:
+                timer.stats["symmetry"] = dict(symmetry.stats, fixed_vars=len(fixed))
+
+            solution = model.solve(time_limit_sec=remaining_limit(time_limit_sec, t0), threads=threads, initial=initial)
+            if not solution.ok and fallback:
+                stats = timer.solved(STATUS_FEASIBLE)
+                stats["warm_start_fallback"] = solution.status
+                return PlanResult(
+                    plans=[start_plan],
+                    scores=[model.objective_value(initial)],
+                    week_labels=["A"],
+                    solve_stats=[stats],
+                )
+            stats = timer.solved(solution.status, optimal=solution.status == STATUS_OPTIMAL)
+            if not solution.ok:
+                return PlanResult(plans=[], scores=[], week_labels=["A"], solve_stats=[stats])
+
+            cols = np.fromiter((x_cols[k] for k in idx.keys), dtype=np.int64, count=len(idx.keys))
+            P = self._plan_from_values(idx, solution.values[cols])
+            return PlanResult(plans=[P], scores=[solution.objective], week_labels=["A"], solve_stats=[stats])
+
+        built = self._build_model(block_formulation=block_formulation)
+        if built is None:
             return PlanResult(plans=[], scores=[], week_labels=["A"])
+        prob, x, idx = built
+        fixed = self._fixed_keys(idx, symmetry)
+        for key in fixed:
+            x[key].upBound = 0
+        use_warm_start = fallback = start_plan is not None
+        if use_warm_start:
+            set_pulp_start(prob, self._warm_start_assignment(idx, start_plan, block_formulation))
+            start_objective = float(pulp.value(prob.objective))
+            # controllo prima di risolvere: CBC sovrascrive i valori delle variabili
+            fallback = timer.stats["warm_start_valid"] = prob.valid(1e-6)
+        timer.built(len(prob.constraints), len(prob.variables()))
+        if symmetry is not None:
+            timer.stats["symmetry"] = dict(symmetry.stats, fixed_vars=len(fixed))
+
+        # -----------------------------------------------------------
+        # Risoluzione
+        # -----------------------------------------------------------
+        solver = pulp.PULP_CBC_CMD(
+            msg=False, timeLimit=remaining_limit(time_limit_sec, t0), warmStart=use_warm_start, threads=threads
+        )
+
+        status = solve_pulp(prob, solver)
+        if status not in ("Optimal", "Feasible") and fallback:
+            stats = timer.solved(STATUS_FEASIBLE)
+            stats["warm_start_fallback"] = status
+            return PlanResult(plans=[start_plan], scores=[start_objective], week_labels=["A"], solve_stats=[stats])
+
+        stats = timer.solved(status, optimal=prob.sol_status == pulp.LpSolutionOptimal)
+        if status not in ("Optimal", "Feasible"):
+            return PlanResult(plans=[], scores=[], week_labels=["A"], solve_stats=[stats])
 
-        # Ricostruisci P[d,h,c] = id_prof (1..N) o 0
-        P = np.zeros((D, H, M), dtype=int)
-        for d in range(D):
-            for h in range(H):
-                for c in range(M):
-                    for p in range(N):
-                        val = pulp.value(x[(d, h, c, p)])
-                        if val is not None and val > 0.5:
-                            P[d, h, c] = p + 1
-                            break
+        # Ricostruisci P[d,h,c] = id_prof (1..N) o 0 leggendo x in un solo passaggio
+        P = self._plan_from_values(idx, variable_values([x[k] for k in idx.keys]))
 
         objective_value = float(pulp.value(prob.objective))
 
-        return PlanResult(plans=[P], scores=[objective_value], week_labels=["A"])
+        return PlanResult(plans=[P], scores=[objective_value], week_labels=["A"], solve_stats=[stats])
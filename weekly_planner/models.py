@@ -54,3 +54,5 @@ class PlanResult:
     # Etichette opzionali (es. Settimana A/B) per i piani restituiti
     week_labels: List[str] | None = None
     subject_plans: Optional[List[np.ndarray]] = None  # shape (days, daily_hours, num_classes), subject_id 1-based o 0
+    # Statistiche per piano dei solver MIP (backend, build_sec, peak_rss_mb, solve_sec, ...)
+    solve_stats: Optional[List[dict]] = None
@@ -0,0 +1,28 @@
+# weekly_planner/parallel.py
+#
+# Contesto multiprocessing comune a portfolio, pool di processi dei planner
+# e job del backend. I planner vengono chiamati anche da FastAPI (thread di
+# asyncio.to_thread in un processo uvicorn con più thread): un fork
+# copierebbe i lock tenuti dagli altri thread e il figlio potrebbe bloccarsi.
+# Si usa quindi forkserver (figli generati da un processo server pulito) e,
+# dove manca, spawn. Le funzioni passate ai processi devono essere
+# serializzabili con pickle (funzioni di modulo o metodi di oggetti
+# serializzabili).
+
+from __future__ import annotations
+
+import multiprocessing as mp
+from multiprocessing.context import BaseContext
+
+# Moduli importati una volta nel server forkserver: i figli partono già con
+# numpy, PuLP e i planner caricati
+_PRELOAD = ["numpy", "pulp", "weekly_planner.planner", "weekly_planner.subject_planner"]
+
+
+def process_context() -> BaseContext:
+    """Contesto forkserver (spawn dove forkserver non esiste) per processi e pool."""
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(_PRELOAD)
+        return ctx
+    return mp.get_context("spawn")
@@ -2,13 +2,57 @@
 
 from __future__ import annotations
 
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
 import random
 import time
 
 import numpy as np
 
 from .models import PlannerConfig, PlanResult
+from .local_search import BlockLocalSearch, blocks_to_plans, extract_blocks
+from .scoring import ANTI_GAP_WEIGHTS, score_plan
+from .slots import SlotIndex
+
+
+@dataclass
+class OccupancyState:
+    """
+    Stato incrementale del generatore random: chi è occupato (tramite
+    l'indice delle partenze valide), quante ore ha ogni (prof, classe,
+    giorno) e quale blocco occupa ogni cella, aggiornato a ogni
+    assegnamento e rimozione.
+    """
+    slots: SlotIndex        # occupazione prof/classe e partenze valide dei blocchi
+    day_hours: np.ndarray   # (N, M, D) int: ore del prof p con la classe c nel giorno d
+    block_at: np.ndarray    # (D, H, M) int: id del blocco nella cella, -1 se libera
+    blocks: Dict[int, Tuple[int, int, int, int, int]] = field(default_factory=dict)  # id -> (prof, cls, day, start, size)
+    next_id: int = 0
+
+    @property
+    def prof_busy(self) -> np.ndarray:
+        """(N, D, H) bool: prof p occupato in (d, h)."""
+        return self.slots.prof_busy
+
+    def place(self, P: np.ndarray, prof: int, cls: int, day: int, start: int, size: int) -> int:
+        """Assegna a (prof, cls) le ore [start, start+size) del giorno `day` in P; ritorna l'id del blocco."""
+        P[day, start:start + size, cls] = prof + 1
+        self.slots.place(prof, cls, day, start, size)
+        self.day_hours[prof, cls, day] += size
+        block_id = self.next_id
+        self.next_id += 1
+        self.blocks[block_id] = (prof, cls, day, start, size)
+        self.block_at[day, start:start + size, cls] = block_id
+        return block_id
+
+    def remove(self, P: np.ndarray, block_id: int) -> Tuple[int, int, int, int, int]:
+        """Toglie il blocco da P e dallo stato; ritorna (prof, cls, day, start, size)."""
+        prof, cls, day, start, size = self.blocks.pop(block_id)
+        P[day, start:start + size, cls] = 0
+        self.slots.remove(prof, cls, day, start, size)
+        self.day_hours[prof, cls, day] -= size
+        self.block_at[day, start:start + size, cls] = -1
+        return prof, cls, day, start, size
 
 
 class WeeklyPlanner:
@@ -61,6 +105,7 @@ class WeeklyPlanner:
         if self.class_teachers.shape != (self.n,):
             self.class_teachers = np.resize(self.class_teachers, (self.n,))
         self.class_teachers = self.class_teachers.astype(bool)
+        self._slot_template: SlotIndex | None = None
 
     # ------------------------------------------------------------------
     # Controllo validità
@@ -75,20 +120,20 @@ class WeeklyPlanner:
         Controlla se il piano P rispetta H[p, c] (ore totali).
         P ha shape (days, daily_hours, m).
         """
-        valid = True
-
-        for c in range(self.m):
-            for p in range(self.n):
-                count = np.count_nonzero(P[:, :, c] == p + 1)
-                if count != self.H[p, c]:
-                    valid = False
-                    if show_error:
-                        print(
-                            f"Errore per prof {p} con classe {c}: "
-                            f"atteso {self.H[p, c]}, trovato {count}"
-                        )
+        # counts[p, c] = ore del prof p con la classe c, con un solo bincount
+        flat = P.reshape(-1, self.m)
+        ids = np.clip(flat, 0, self.n + 1) + (self.n + 2) * np.arange(self.m)
+        counts = np.bincount(ids.ravel(), minlength=(self.n + 2) * self.m).reshape(self.m, self.n + 2)[:, 1:self.n + 1].T
+
+        mismatch = counts != self.H
+        if show_error:
+            for c, p in zip(*np.nonzero(mismatch.T)):
+                print(
+                    f"Errore per prof {p} con classe {c}: "
+                    f"atteso {self.H[p, c]}, trovato {counts[p, c]}"
+                )
 
-        return valid
+        return not mismatch.any()
 
     def _is_class_teacher(self, prof: int) -> bool:
         return bool(self.class_teachers[prof]) if 0 <= prof < len(self.class_teachers) else False
@@ -105,65 +150,117 @@ class WeeklyPlanner:
         - penalizza giornate molto spezzate
         - piccola penalità per attraversare la pausa pranzo
 
-        Più basso è meglio.
+        Più basso è meglio. Calcolata da `scoring.score_plan` (i giorni in
+        cui il prof non è mai disponibile non contano).
         """
-        opt = 0.0
-
-        # pesi
-        weight_gap = 1.0
-        weight_segments = 0.01
-        weight_lunch_cross = 0.0001
-
-        for p in range(self.n):
-            for d in range(self.days):
-                if not self.D[p, d].any():
-                    continue
-
-                # vettore z[h] = 1 se il prof p ha lezione a quell'ora in quel giorno
-                z = np.array(
-                    [np.any(P[d, h, :] == p + 1) for h in range(self.daily_hours)],
-                    dtype=int,
-                )
+        return score_plan(
+            P,
+            self.n,
+            self.last_morning_hour,
+            ANTI_GAP_WEIGHTS,
+            day_mask=self.D.any(axis=2),
+        )
 
-                if z.sum() <= 1:
-                    continue  # nessuna buca possibile
-
-                # individua ore effettivamente lavorate
-                hours = np.where(z == 1)[0]
-                first = hours[0]
-                last = hours[-1]
-
-                # penalizza buche interne (slot tra first e last con z=0)
-                gaps = 0
-                for h in range(first, last + 1):
-                    if z[h] == 0:
-                        gaps += 1
-                opt += weight_gap * gaps
-
-                # penalizza numero di segmenti (blocchi contigui di lavoro)
-                segments = 1
-                for i in range(1, len(hours)):
-                    if hours[i] > hours[i - 1] + 1:
-                        segments += 1
-                if segments > 1:
-                    opt += weight_segments * (segments - 1)
-
-                # penalità per attraversare pausa pranzo
-                for i in range(1, len(hours)):
-                    h_prev = hours[i - 1]
-                    h_curr = hours[i]
-                    if h_prev < self.last_morning_hour <= h_curr:
-                        opt += weight_lunch_cross
-
-        return opt
+    def improve_plan(
+        self,
+        P: np.ndarray,
+        time_limit_sec: float = 2.0,
+        seed: int | None = None,
+    ) -> tuple[np.ndarray, float, dict]:
+        """
+        Migliora P con la ricerca locale (vedi local_search) mantenendo
+        tutti i vincoli: max 2 ore al giorno per (prof, classe) non docente
+        di classe, niente ore a cavallo della pausa pranzo, disponibilità,
+        mercoledì. Ritorna (piano, score, statistiche).
+        """
+        day_caps = {
+            (c, p): (None if self._is_class_teacher(p) else 2)
+            for p in range(self.n) for c in range(self.m)
+        }
+        search = BlockLocalSearch(
+            self.days, self.daily_hours, self.n, self.m, self.D,
+            self.last_morning_hour, self.wednesday_afternoon_free,
+            extract_blocks(P), day_caps, ANTI_GAP_WEIGHTS,
+            day_mask=self.D.any(axis=2),
+            load_by_teacher=True,
+            rng=random.Random(seed),
+        )
+        best = search.run(time_limit_sec)
+        improved, _ = blocks_to_plans(best, self.days, self.daily_hours, self.m)
+        return improved, self._optimization_value(improved), search.stats
 
     # ------------------------------------------------------------------
     # Generazione base dei piani
     # ------------------------------------------------------------------
 
+    def _sample_slot(self, state: OccupancyState, prof: int, cls: int, size: int) -> tuple[int, int] | None:
+        # Orario, pausa pranzo, mercoledì, disponibilità e sovrapposizioni
+        # sono già nell'indice delle partenze; qui resta solo il limite
+        # per (prof, classe, giorno): al massimo 2 ore, e un blocco da 2
+        # solo in un giorno senza altre ore con la classe.
+        if self._is_class_teacher(prof):
+            return state.slots.sample(prof, cls, size)
+        return state.slots.sample(prof, cls, size, day_load=state.day_hours[prof, cls], day_cap=2)
+
+    def _eject_and_place(
+        self,
+        P: np.ndarray,
+        state: OccupancyState,
+        block: tuple[int, int, int],
+        depth: int,
+        locked: Set[int],
+    ) -> bool:
+        """
+        Riparazione a catena per un blocco (prof, cls, size) senza partenze
+        libere: tra le partenze ammesse dai vincoli statici sceglie quella
+        che richiede di espellere meno blocchi (sovrapposizioni di prof e
+        classe, limite di 2 ore al giorno), li toglie, piazza il blocco e
+        reinserisce gli espulsi, riparando a loro volta fino a `depth`
+        livelli. I blocchi piazzati dalla catena (`locked`) non vengono
+        più espulsi. Se fallisce, gli espulsi restano fuori (il piano non
+        passa _control).
+        """
+        prof, cls, size = block
+        H = self.daily_hours
+        capped = not self._is_class_teacher(prof)
+        best = None
+        best_key = None
+        for idx in np.flatnonzero(state.slots.static_starts(size)[prof]):
+            day, start = divmod(int(idx), H)
+            hours = slice(start, start + size)
+            victims = set(state.block_at[day, hours, cls].tolist())
+            rows, cols = np.nonzero(P[day, hours] == prof + 1)
+            victims.update(state.block_at[day, start + rows, cols].tolist())
+            victims.discard(-1)
+            if capped:
+                own = set(state.block_at[day, P[day, :, cls] == prof + 1, cls].tolist())
+                if sum(state.blocks[b][4] for b in own - victims) + size > 2:
+                    victims |= own
+            if victims & locked:
+                continue
+            key = (len(victims), sum(state.blocks[b][4] for b in victims), random.random())
+            if best_key is None or key < best_key:
+                best, best_key = (day, start, victims), key
+        if best is None:
+            return False
+
+        day, start, victims = best
+        evicted = [state.remove(P, b) for b in victims]
+        locked.add(state.place(P, prof, cls, day, start, size))
+        random.shuffle(evicted)
+        for (v_prof, v_cls, _, _, v_size) in evicted:
+            slot = self._sample_slot(state, v_prof, v_cls, v_size)
+            if slot is not None:
+                locked.add(state.place(P, v_prof, v_cls, slot[0], slot[1], v_size))
+                continue
+            if depth <= 1 or not self._eject_and_place(P, state, (v_prof, v_cls, v_size), depth - 1, locked):
+                return False
+        return True
+
     def _generate_single_plan_basic(
         self,
         max_attempts: int = 100000000000,
+        repair_depth: int = 3,
     ) -> np.ndarray | None:
         """
         Genera un singolo piano P (days, daily_hours, m) in modo random,
@@ -178,8 +275,14 @@ class WeeklyPlanner:
               * al massimo 1 ora singola (se H[p,c] è dispari)
           - per (prof, classe, giorno): 0, 1 o 2 ore
           - nessun blocco di 2 ore che attraversi mattina/pomeriggio
+
+        Ogni blocco viene estratto uniformemente tra le partenze valide
+        (vedi SlotIndex); se non ce ne sono si tenta la riparazione a catena
+        (_eject_and_place, profondità repair_depth) e solo se fallisce il
+        blocco resta non piazzato.
         """
         P = np.zeros((self.days, self.daily_hours, self.m), dtype=int)
+        state = self._empty_state()
 
         # Costruzione dei "blocchi di lezione":
         #   - blocchi da 2 ore
@@ -207,113 +310,38 @@ class WeeklyPlanner:
         attempts = 0
 
         for (prof, cls, size) in blocks:
-            placed = False
-
-            for _ in range(300):  # tentativi per blocco
-                day = random.randrange(self.days)
-
-                # mercoledì pomeriggio libero: valida sia per blocchi da 1 che da 2
-                if self.wednesday_afternoon_free and day == 2:
-                    # se qualsiasi ora del blocco cade nel pomeriggio, salta
-                    if size == 1:
-                        # per ora singola, controlliamo l'ora dopo
-                        pass
-                    else:
-                        # per un blocco da 2 ore, se qualsiasi ora cade nel pomeriggio -> scartiamo giorno
-                        # (semplifichiamo, così evitiamo complessità)
-                        # useremo il controllo sull'ora più avanti, quindi qui non facciamo nulla
-                        pass
-
-                if size == 1:
-                    # blocco da 1 ora
-                    hour = random.randrange(self.daily_hours)
-
-                    # mercoledì pomeriggio libero per la singola ora
-                    if (
-                        self.wednesday_afternoon_free
-                        and day == 2
-                        and hour >= self.last_morning_hour
-                    ):
-                        continue
-
-                    # disponibilità prof
-                    if not self._is_available(prof, day, hour):
-                        continue
-
-                    # slot per quella classe deve essere libero
-                    if P[day, hour, cls] != 0:
-                        continue
-
-                    # prof non può avere lezione contemporaneamente in un'altra classe
-                    if np.any(P[day, hour, :] == prof + 1):
-                        continue
-
-                    # max 2 ore al giorno per (prof, classe)
-                    if (not self._is_class_teacher(prof)) and np.count_nonzero(P[day, :, cls] == prof + 1) >= 2:
-                        continue
-
-                    # ok, assegniamo la singola ora
-                    P[day, hour, cls] = prof + 1
-                    placed = True
-                    break
-
-                else:
-                    # blocco da 2 ore consecutive
-                    # scegliamo un'ora di inizio tale che hour+1 sia valido
-                    if self.daily_hours < 2:
-                        # impossibile piazzare un blocco da 2
-                        break
-
-                    start_hour = random.randrange(self.daily_hours - 1)
-                    h1 = start_hour
-                    h2 = start_hour + 1
-
-                    # nessun blocco di 2 ore che attraversi mattina/pomeriggio
-                    if (
-                        self.last_morning_hour > 0
-                        and self.last_morning_hour < self.daily_hours
-                        and h1 == self.last_morning_hour - 1
-                        and h2 == self.last_morning_hour
-                    ):
-                        continue
-
-                    # mercoledì pomeriggio libero per blocco da 2
-                    if self.wednesday_afternoon_free and day == 2:
-                        if h1 >= self.last_morning_hour or h2 >= self.last_morning_hour:
-                            continue
-
-                    # disponibilità prof (stesso giorno per entrambe le ore)
-                    if not (self._is_available(prof, day, h1) and self._is_available(prof, day, h2)):
-                        continue
-
-                    # slot per quella classe devono essere liberi
-                    if P[day, h1, cls] != 0 or P[day, h2, cls] != 0:
-                        continue
-
-                    # prof non può avere lezione contemporaneamente in un'altra classe
-                    if np.any(P[day, h1, :] == prof + 1) or np.any(
-                        P[day, h2, :] == prof + 1
-                    ):
-                        continue
-
-                    # per questo (prof,classe,giorno) non devono esserci già ore
-                    # (altrimenti superiamo le 2 ore/giorno o rompiamo i blocchi)
-                    if (not self._is_class_teacher(prof)) and np.count_nonzero(P[day, :, cls] == prof + 1) > 0:
-                        continue
-
-                    # ok, assegniamo il blocco da 2 ore consecutive
-                    P[day, h1, cls] = prof + 1
-                    P[day, h2, cls] = prof + 1
-                    placed = True
-                    break
-
-            if not placed:
+            slot = self._sample_slot(state, prof, cls, size)
+            if slot is None:
+                if repair_depth > 0 and self._eject_and_place(P, state, (prof, cls, size), repair_depth, set()):
+                    continue
                 attempts += 1
                 if attempts > max_attempts:
                     return None
+                continue
+
+            day, start = slot
+            state.place(P, prof, cls, day, start, size)
 
         return P
 
+    def _empty_state(self) -> OccupancyState:
+        # I vincoli statici dell'indice si calcolano una volta per planner
+        if self._slot_template is None:
+            self._slot_template = SlotIndex(
+                self.days,
+                self.daily_hours,
+                self.m,
+                self.D,
+                self.last_morning_hour,
+                self.wednesday_afternoon_free,
+                sizes=(1, 2),
+            )
+        return OccupancyState(
+            slots=self._slot_template.copy(),
+            day_hours=np.zeros((self.n, self.m, self.days), dtype=int),
+            block_at=np.full((self.days, self.daily_hours, self.m), -1, dtype=int),
+        )
+
     def generate_plans_basic(
         self,
         num_variants: int = 3,
@@ -362,10 +390,12 @@ class WeeklyPlanner:
         target_score: float = 0.1,
         time_limit_sec: float = 10.0,
         show_progress: bool = False,
+        improve_sec: float = 0.0,
     ) -> PlanResult:
         """
         Tenta piani random finché non trova uno score abbastanza buono
-        o fino a time_limit_sec. Ritorna sempre il migliore trovato.
+        o fino a time_limit_sec. Ritorna sempre il migliore trovato,
+        migliorato con improve_sec secondi di ricerca locale (se > 0).
         """
         start = time.perf_counter()
         best_plan: np.ndarray | None = None
@@ -392,4 +422,9 @@ class WeeklyPlanner:
         if best_plan is None:
             return PlanResult(plans=[], scores=[], week_labels=["A"])
 
+        if improve_sec > 0 and best_score > target_score:
+            best_plan, best_score, stats = self.improve_plan(best_plan, improve_sec, seed=random.getrandbits(32))
+            if show_progress:
+                print(f"[local search] score {stats['initial_score']:.4f} -> {best_score:.4f}")
+
         return PlanResult(plans=[best_plan], scores=[best_score], week_labels=["A"])
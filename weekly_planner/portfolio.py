@@ -0,0 +1,254 @@
+# weekly_planner/portfolio.py
+#
+# Portfolio di solver in parallelo: MIP (anche multi-thread) e riavvii
+# euristici con seed diversi girano in processi separati. Tutti i piani
+# vengono rivalutati con la stessa metrica (l'obiettivo del MIP); alla scadenza (o appena un MIP
+# dimostra l'ottimalità) si tiene il migliore e si uccidono gli altri,
+# compresi i processi CBC figli.
+
+from __future__ import annotations
+
+import os
+import queue as queue_mod
+import random
+import signal
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from .mip_planner import MIPWeeklyPlanner
+from .models import PlanResult, PlannerConfig
+from .parallel import process_context
+from .planner import WeeklyPlanner
+from .subject_greedy_planner import SubjectGreedyPlanner
+from .subject_planner import SubjectMIPPlanner, SubjectPlanningData
+
+ENGINE_KINDS = ("mip", "heuristic")
+
+
+@dataclass
+class EngineSpec:
+    """
+    Un motore del portfolio.
+      - kind="mip": SubjectMIPPlanner / MIPWeeklyPlanner con `threads` per CBC
+      - kind="heuristic": SubjectGreedyPlanner / WeeklyPlanner con `seed`
+    """
+    name: str
+    kind: str
+    seed: Optional[int] = None
+    threads: Optional[int] = None
+    backend: str = "pulp"
+
+
+def default_engines(config: PlannerConfig, workers: int | None = None) -> List[EngineSpec]:
+    """
+    Portfolio di default: un MIP single-thread, un MIP multi-thread (se ci
+    sono almeno due CPU) e riavvii euristici con seed consecutivi per le
+    CPU rimanenti (almeno uno).
+    """
+    cpus = workers or os.cpu_count() or 1
+    engines = [EngineSpec(name="mip", kind="mip", threads=1)]
+    if cpus > 1:
+        engines.append(EngineSpec(name=f"mip-{cpus}t", kind="mip", threads=cpus, backend="matrix"))
+
+    base_seed = config.seed if config.seed is not None else 0
+    for i in range(max(1, cpus - len(engines))):
+        engines.append(EngineSpec(name=f"heuristic-{i}", kind="heuristic", seed=base_seed + i))
+    return engines
+
+
+def shared_scores(
+    config: PlannerConfig,
+    subject_ctx: SubjectPlanningData | None,
+    result: PlanResult,
+) -> List[float]:
+    """
+    Rivaluta ogni piano con una sola metrica (più basso = meglio), qualunque
+    sia il motore che l'ha prodotto: per i piani a materie l'obiettivo del
+    modello orario di SubjectMIPPlanner (buche, distribuzione sui giorni,
+    preferenze, più docenti per materia, ultime ore), così un euristico non
+    vince su termini che ignora; `_optimization_value` di WeeklyPlanner
+    altrimenti.
+    """
+    if subject_ctx is not None:
+        scorer = SubjectMIPPlanner(config, subject_ctx)
+        return [
+            scorer._plan_objective(subject_ctx.required_hours[w], P, S)
+            for w, (P, S) in enumerate(zip(result.plans, result.subject_plans))
+        ]
+    scorer = WeeklyPlanner(config)
+    return [float(scorer._optimization_value(P)) for P in result.plans]
+
+
+def run_engine(
+    spec: EngineSpec,
+    config: PlannerConfig,
+    subject_ctx: SubjectPlanningData | None,
+    time_limit_sec: float,
+) -> PlanResult:
+    """Esegue un singolo motore del portfolio nel processo corrente."""
+    if spec.kind not in ENGINE_KINDS:
+        raise ValueError(f"kind non valido: {spec.kind!r} (ammessi: {', '.join(ENGINE_KINDS)})")
+
+    if spec.kind == "mip":
+        budget = max(1, int(time_limit_sec))
+        if subject_ctx is not None:
+            planner = SubjectMIPPlanner(config, subject_ctx)
+            return planner.solve(
+                time_limit_sec=budget, backend=spec.backend, threads=spec.threads, joint_weeks=True
+            )
+        return MIPWeeklyPlanner(config).solve(
+            time_limit_sec=budget, backend=spec.backend, threads=spec.threads
+        )
+
+    # Euristici: 70% del budget ai riavvii, il resto alla ricerca locale
+    improve_sec = 0.3 * time_limit_sec
+    if subject_ctx is not None:
+        if len(subject_ctx.week_labels) > 1:
+            # Come i MIP (joint_weeks): materie comuni uguali tra le
+            # settimane; la ricerca locale non si applica, tutto ai riavvii
+            return SubjectGreedyPlanner(config, subject_ctx, seed=spec.seed).generate(
+                time_limit_sec=time_limit_sec, shared_weeks=True
+            )
+        return SubjectGreedyPlanner(config, subject_ctx, seed=spec.seed).generate(
+            time_limit_sec=time_limit_sec - improve_sec, improve_sec=improve_sec
+        )
+    if spec.seed is not None:
+        random.seed(spec.seed)
+        np.random.seed(spec.seed)
+    return WeeklyPlanner(config).generate_until_time(
+        target_score=0.1,
+        time_limit_sec=time_limit_sec - improve_sec,
+        show_progress=False,
+        improve_sec=improve_sec,
+    )
+
+
+def _engine_main(spec, config, subject_ctx, deadline, results) -> None:
+    # Gruppo di processi proprio: alla cancellazione uccidiamo anche CBC.
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        # Budget dalla scadenza assoluta: l'avvio del processo (forkserver,
+        # import) non deve far sforare il portfolio
+        result = run_engine(spec, config, subject_ctx, max(1.0, deadline - time.time()))
+        results.put((spec.name, result, None))
+    except Exception as exc:  # pragma: no cover - riportato al processo padre
+        results.put((spec.name, None, repr(exc)))
+
+
+def _kill(proc) -> None:
+    """Termina il processo del motore e tutto il suo gruppo (CBC incluso)."""
+    if not proc.is_alive():
+        return
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # setpgrp non ancora eseguito: il gruppo non esiste
+            proc.kill()
+    else:
+        proc.terminate()
+    proc.join(timeout=5)
+
+
+def _is_proven_optimal(result: PlanResult) -> bool:
+    return bool(result.plans) and bool(result.solve_stats) and all(
+        s.get("optimal") for s in result.solve_stats
+    )
+
+
+def solve_portfolio(
+    config: PlannerConfig,
+    subject_ctx: SubjectPlanningData | None = None,
+    engines: List[EngineSpec] | None = None,
+    time_limit_sec: float = 60.0,
+    on_incumbent: Callable[[str, PlanResult], None] | None = None,
+) -> PlanResult:
+    """
+    Lancia i motori in processi separati e ritorna il piano migliore secondo
+    `shared_scores` (somma sulle settimane). Si ferma alla scadenza, quando
+    tutti i motori hanno risposto, appena un MIP dimostra l'ottimalità o un
+    piano raggiunge score 0; i motori ancora attivi vengono uccisi.
+
+    Nel risultato `scores` contiene la metrica condivisa e `solve_stats`
+    riporta, per ogni motore, nome, esito e punteggio. `on_incumbent(nome,
+    risultato)` viene chiamata a ogni nuovo migliore.
+    """
+    engines = engines or default_engines(config)
+    week_labels = subject_ctx.week_labels if subject_ctx is not None else ["A"]
+
+    # I motori si fermano un po' prima della scadenza per restituire l'incumbent
+    engine_deadline = time.time() + max(1.0, time_limit_sec * 0.9)
+
+    ctx = process_context()
+    results = ctx.Queue()
+    procs = {}
+    for spec in engines:
+        proc = ctx.Process(
+            target=_engine_main,
+            args=(spec, config, subject_ctx, engine_deadline, results),
+            daemon=True,
+        )
+        proc.start()
+        procs[spec.name] = proc
+
+    best: PlanResult | None = None
+    best_total = float("inf")
+    engine_stats: List[dict] = []
+    deadline = time.perf_counter() + time_limit_sec
+    pending = set(procs)
+
+    try:
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                name, result, error = results.get(timeout=min(remaining, 0.5))
+            except queue_mod.Empty:
+                # Un motore morto senza rispondere non va atteso. Chi esce con
+                # codice 0 ha già messo il risultato (o l'errore) nella coda:
+                # resta in attesa finché non lo leggiamo
+                pending = {n for n in pending if procs[n].exitcode in (None, 0)}
+                continue
+
+            pending.discard(name)
+            entry = {"engine": name, "status": "error" if error else "ok"}
+            if error:
+                entry["error"] = error
+            elif not result.plans:
+                entry["status"] = "no_plan"
+            else:
+                scores = shared_scores(config, subject_ctx, result)
+                total = float(sum(scores))
+                entry["score"] = total
+                if total < best_total:
+                    best_total = total
+                    best = PlanResult(
+                        plans=result.plans,
+                        scores=scores,
+                        week_labels=result.week_labels or week_labels,
+                        subject_plans=result.subject_plans,
+                    )
+                    if on_incumbent is not None:
+                        on_incumbent(name, best)
+                # La metrica è >= 0: uno score nullo non è migliorabile
+                if _is_proven_optimal(result) or best_total <= 0:
+                    entry["status"] = "optimal"
+                    engine_stats.append(entry)
+                    break
+            engine_stats.append(entry)
+    finally:
+        for name in pending:
+            engine_stats.append({"engine": name, "status": "cancelled"})
+        for proc in procs.values():
+            _kill(proc)
+        results.close()
+
+    if best is None:
+        return PlanResult(plans=[], scores=[], week_labels=week_labels, solve_stats=engine_stats)
+    best.solve_stats = engine_stats
+    return best
@@ -0,0 +1,118 @@
+# weekly_planner/scoring.py
+#
+# Funzione di costo anti-buche condivisa dai planner, vettorizzata.
+# Un piano P[d, h, c] (id professore 1-based, 0 = libero) viene proiettato
+# con un solo scatter nel tensore booleano di occupazione O[p, d, h];
+# buche, segmenti e attraversamenti della pausa pranzo si ricavano con
+# operazioni di diff/argmax lungo le ore. Funziona anche su una pila di
+# piani (K, D, H, M).
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class GapWeights:
+    """Pesi della funzione di costo (più basso = meglio)."""
+    gap: float = 1.0             # per ogni ora buca tra prima e ultima ora del giorno
+    segments: float = 0.01       # per ogni blocco contiguo oltre il primo
+    lunch_cross: float = 0.0001  # se la giornata scavalca la pausa pranzo
+
+
+# WeeklyPlanner._optimization_value e SubjectRandomPlanner._score_plan
+ANTI_GAP_WEIGHTS = GapWeights()
+# SubjectGreedyPlanner._score_plan: solo buche
+TEACHER_GAP_WEIGHTS = GapWeights(gap=0.5, segments=0.0, lunch_cross=0.0)
+
+
+def occupancy_tensor(plans: np.ndarray, num_prof: int) -> np.ndarray:
+    """
+    O[..., p, d, h] = True se il prof p (0-based) ha lezione in (d, h).
+
+    `plans` ha shape (D, H, M) oppure (K, D, H, M); il risultato ha shape
+    (N, D, H) oppure (K, N, D, H). Valori fuori da 1..N vengono ignorati.
+    """
+    P = np.asarray(plans)
+    single = P.ndim == 3
+    if single:
+        P = P[None]
+    K, D, H, _ = P.shape
+
+    # Riga 0 = cella libera, riga N+1 = id non valido: scartate dopo lo scatter
+    ids = np.clip(P, 0, num_prof + 1)
+    occ = np.zeros((K, num_prof + 2, D, H), dtype=bool)
+    k_idx, d_idx, h_idx, _ = np.indices(P.shape, sparse=True)
+    occ[k_idx, ids, d_idx, h_idx] = True
+    occ = occ[:, 1:num_prof + 1]
+    return occ[0] if single else occ
+
+
+def gap_terms(occ: np.ndarray, last_morning_hour: int) -> np.ndarray:
+    """
+    Per ogni (..., p, d) ritorna [buche, segmenti - 1, attraversa_pranzo]
+    come interi; tutto a zero se il prof lavora al più un'ora quel giorno.
+    """
+    H = occ.shape[-1]
+    count = occ.sum(axis=-1)
+    busy = count >= 2
+
+    first = occ.argmax(axis=-1)
+    last = H - 1 - occ[..., ::-1].argmax(axis=-1)
+    gaps = (last - first + 1) - count
+
+    # segmenti = fronti di salita lungo le ore
+    rises = np.diff(occ.astype(np.int8), axis=-1, prepend=0) == 1
+    extra_segments = rises.sum(axis=-1) - 1
+
+    # due ore consecutive lavorate a cavallo di last_morning_hour esistono
+    # se e solo se c'è almeno un'ora prima e una dopo la soglia
+    split = min(max(last_morning_hour, 0), H)
+    cross = occ[..., :split].any(axis=-1) & occ[..., split:].any(axis=-1)
+
+    terms = np.stack([gaps, extra_segments, cross.astype(int)], axis=-1)
+    return np.where(busy[..., None], terms, 0)
+
+
+def score_plans(
+    plans: np.ndarray,
+    num_prof: int,
+    last_morning_hour: int,
+    weights: GapWeights = ANTI_GAP_WEIGHTS,
+    day_mask: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Score di una pila di piani (K, D, H, M) -> array (K,).
+
+    day_mask (N, D) esclude le coppie (prof, giorno) con valore False.
+    Le penalità vengono sommate nello stesso ordine dei vecchi cicli
+    (prof, giorno, termine) con una somma sequenziale, così il risultato
+    coincide bit per bit con l'implementazione a cicli.
+    """
+    P = np.asarray(plans)
+    if P.ndim == 3:
+        P = P[None]
+    occ = occupancy_tensor(P, num_prof)
+    terms = gap_terms(occ, last_morning_hour)
+    if day_mask is not None:
+        terms = terms * np.asarray(day_mask, dtype=bool)[None, :, :, None]
+
+    w = np.array([weights.gap, weights.segments, weights.lunch_cross], dtype=float)
+    addends = (terms * w).reshape(P.shape[0], -1)
+    if addends.shape[1] == 0:
+        return np.zeros(P.shape[0], dtype=float)
+    # np.add.accumulate è sequenziale (np.sum no: usa la somma a coppie)
+    return np.add.accumulate(addends, axis=1)[:, -1]
+
+
+def score_plan(
+    plan: np.ndarray,
+    num_prof: int,
+    last_morning_hour: int,
+    weights: GapWeights = ANTI_GAP_WEIGHTS,
+    day_mask: np.ndarray | None = None,
+) -> float:
+    """Score di un singolo piano (D, H, M)."""
+    return float(score_plans(plan, num_prof, last_morning_hour, weights, day_mask)[0])
@@ -0,0 +1,183 @@
+# weekly_planner/slots.py
+#
+# Indice delle partenze valide dei blocchi per i planner random/greedy.
+# Invece di estrarre (giorno, ora) a caso e scartare, si tiene per ogni
+# dimensione di blocco la maschera delle partenze ammesse per prof e per
+# classe, aggiornata a ogni assegnamento; le partenze valide di un
+# blocco (prof, classe, size) sono un AND di maschere e si estrae
+# uniformemente tra quelle. "Nessuno slot valido" si vede subito.
+# `remove` annulla un assegnamento (riparazioni a catena di WeeklyPlanner).
+
+from __future__ import annotations
+
+import copy
+import random
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class SlotIndex:
+    """
+    Partenze valide per blocchi di `size` ore consecutive nello stesso giorno.
+
+    Vincoli statici (precalcolati per (prof, size)):
+      - il blocco sta nella giornata
+      - non attraversa la pausa pranzo (start < last_morning_hour <= fine)
+      - mercoledì (giorno 2) pomeriggio libero, se attivo
+      - prof disponibile in tutte le ore del blocco
+    Vincoli dinamici (aggiornati da `place` e `remove`):
+      - prof libero in tutte le ore del blocco (in qualunque classe)
+      - classe libera in tutte le ore del blocco
+
+    Per ogni size si tengono due maschere di partenze ammesse, (N, D, H)
+    per prof (statico + libero) e (M, D, H) per classe: `place` spegne
+    solo le partenze toccate dal nuovo blocco. `copy()` duplica lo stato
+    senza ricalcolare i vincoli statici.
+    """
+
+    def __init__(
+        self,
+        days: int,
+        daily_hours: int,
+        num_classes: int,
+        availability: np.ndarray,  # (N, D, 2) mattina/pomeriggio
+        last_morning_hour: int,
+        wednesday_afternoon_free: bool = False,
+        sizes: Iterable[int] = (),
+    ):
+        self.days = days
+        self.daily_hours = daily_hours
+        self.last_morning_hour = last_morning_hour
+        self.wednesday_afternoon_free = wednesday_afternoon_free
+
+        # Disponibilità per ora: (N, D, H)
+        afternoon = np.arange(daily_hours) >= last_morning_hour
+        self.hour_avail = np.asarray(availability, dtype=bool)[:, :, afternoon.astype(int)]
+
+        num_prof = self.hour_avail.shape[0]
+        self.prof_busy = np.zeros((num_prof, days, daily_hours), dtype=bool)
+        self.class_busy = np.zeros((num_classes, days, daily_hours), dtype=bool)
+
+        self._static: Dict[int, np.ndarray] = {}
+        self._prof_ok: Dict[int, np.ndarray] = {}
+        self._class_ok: Dict[int, np.ndarray] = {}
+        for size in sizes:
+            self._ensure(size)
+
+    def copy(self) -> "SlotIndex":
+        """Copia indipendente dello stato (i vincoli statici sono condivisi, sola lettura)."""
+        other = copy.copy(self)
+        other.prof_busy = self.prof_busy.copy()
+        other.class_busy = self.class_busy.copy()
+        other._prof_ok = {s: m.copy() for s, m in self._prof_ok.items()}
+        other._class_ok = {s: m.copy() for s, m in self._class_ok.items()}
+        return other
+
+    # ------------------------------------------------------------------
+    # Maschere
+    # ------------------------------------------------------------------
+
+    def _window_all(self, mask: np.ndarray, size: int) -> np.ndarray:
+        """out[..., h] = mask[..., h:h+size].all(), False se il blocco esce dalla giornata."""
+        H = self.daily_hours
+        out = np.zeros(mask.shape, dtype=bool)
+        if size > H:
+            return out
+        out[..., :H - size + 1] = True
+        for k in range(size):
+            out[..., :H - size + 1] &= mask[..., k:H - size + 1 + k]
+        return out
+
+    def static_starts(self, size: int) -> np.ndarray:
+        """Maschera (N, D, H) delle partenze ammesse dai soli vincoli statici."""
+        static = self._static.get(size)
+        if static is None:
+            H = self.daily_hours
+            static = self._window_all(self.hour_avail, size)
+
+            starts = np.arange(H)
+            lmh = self.last_morning_hour
+            crosses = (starts < lmh) & (starts + size - 1 >= lmh)
+            static[..., crosses] = False
+            if self.wednesday_afternoon_free and self.days > 2:
+                static[:, 2, starts + size - 1 >= lmh] = False
+            self._static[size] = static
+        return static
+
+    def _ensure(self, size: int) -> None:
+        if size not in self._prof_ok:
+            self._prof_ok[size] = self.static_starts(size) & self._window_all(~self.prof_busy, size)
+            self._class_ok[size] = self._window_all(~self.class_busy, size)
+
+    def valid_starts(self, prof: int, cls: int, size: int) -> np.ndarray:
+        """Maschera (D, H) delle partenze valide per un blocco (prof, cls, size)."""
+        self._ensure(size)
+        return self._prof_ok[size][prof] & self._class_ok[size][cls]
+
+    # ------------------------------------------------------------------
+    # Estrazione e aggiornamento
+    # ------------------------------------------------------------------
+
+    def sample(
+        self,
+        prof: int,
+        cls: int,
+        size: int,
+        day_load: Optional[np.ndarray] = None,
+        day_cap: int = 0,
+        quick_draws: int = 4,
+    ) -> Optional[Tuple[int, int]]:
+        """
+        (giorno, ora di inizio) estratti uniformemente tra le partenze valide;
+        con day_load (D,) sono ammessi solo i giorni con
+        day_load[d] + size <= day_cap. None se non ci sono partenze valide.
+
+        Prima `quick_draws` proposte uniformi su tutta la griglia, ognuna
+        verificata in O(1) (economiche quando gli slot liberi abbondano);
+        poi l'enumerazione esplicita. In entrambi i casi l'estrazione è
+        uniforme sull'insieme valido.
+        """
+        self._ensure(size)
+        prof_ok = self._prof_ok[size][prof]
+        class_ok = self._class_ok[size][cls]
+        cells = self.days * self.daily_hours
+        for _ in range(quick_draws):
+            d, h = divmod(random.randrange(cells), self.daily_hours)
+            if prof_ok[d, h] and class_ok[d, h] and (day_load is None or day_load[d] + size <= day_cap):
+                return d, h
+
+        mask = prof_ok & class_ok
+        if day_load is not None:
+            mask &= (day_load + size <= day_cap)[:, None]
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return None
+        d, h = divmod(int(candidates[random.randrange(candidates.size)]), self.daily_hours)
+        return d, h
+
+    def remove(self, prof: int, cls: int, day: int, start: int, size: int) -> None:
+        """Libera le ore [start, start+size) del giorno `day` per prof e classe (inverso di place)."""
+        hours = slice(start, start + size)
+        self.prof_busy[prof, day, hours] = False
+        self.class_busy[cls, day, hours] = False
+        # Ricalcola solo le partenze che toccano le ore liberate
+        for s, ok in self._prof_ok.items():
+            lo = max(0, start - s + 1)
+            free = self._window_all(~self.prof_busy[prof, day], s)
+            ok[prof, day, lo:start + size] = self.static_starts(s)[prof, day, lo:start + size] & free[lo:start + size]
+        for s, ok in self._class_ok.items():
+            lo = max(0, start - s + 1)
+            free = self._window_all(~self.class_busy[cls, day], s)
+            ok[cls, day, lo:start + size] = free[lo:start + size]
+
+    def place(self, prof: int, cls: int, day: int, start: int, size: int) -> None:
+        """Registra le ore [start, start+size) del giorno `day` per prof e classe."""
+        hours = slice(start, start + size)
+        self.prof_busy[prof, day, hours] = True
+        self.class_busy[cls, day, hours] = True
+        # Un'ora occupata h esclude le partenze in [h - s + 1, h] per ogni size s
+        for s, ok in self._prof_ok.items():
+            ok[prof, day, max(0, start - s + 1):start + size] = False
+        for s, ok in self._class_ok.items():
+            ok[cls, day, max(0, start - s + 1):start + size] = False
@@ -0,0 +1,443 @@
+# weekly_planner/subject_csp.py
+#
+# Motore CSP a backtracking per una settimana del planner a materie.
+# Ogni task (classe, materia) viene piazzato a blocchi come nel greedy:
+# in un giorno con carico l il blocco è lungo min(daily_max - l, ore
+# residue). Il dominio del prossimo blocco di un task è, per ogni docente
+# ammesso, una bitmask (int Python) delle partenze (giorno, ora) valide:
+# bit d * H + h. La ricerca usa MRV (dominio più piccolo prima), forward
+# checking dopo ogni piazzamento e conflict-directed backjumping (CBJ).
+
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .slots import SlotIndex
+
+# Esito di SubjectWeekCSP.solve (stats["status"])
+CSP_SOLVED = "solved"
+CSP_INFEASIBLE = "infeasible"
+CSP_LIMIT = "limit"
+
+
+def mask_bits(mask: np.ndarray) -> int:
+    """Bitmask intera di una maschera booleana: bit i = mask.flat[i]."""
+    bits = 0
+    for i in np.flatnonzero(mask):
+        bits |= 1 << int(i)
+    return bits
+
+
+def packable(items: List[int], bins: List[int]) -> bool:
+    """
+    True se i task (ore in `items`) si possono assegnare ai docenti
+    (capacità residue in `bins`) senza superarne le capacità: bin packing
+    esatto, con gli item in ordine decrescente e i bin di pari capacità
+    provati una sola volta.
+    """
+    items = sorted(items, reverse=True)
+    bins = [b for b in bins if b > 0]
+    if sum(items) > sum(bins):
+        return False
+
+    def place(i: int) -> bool:
+        if i == len(items):
+            return True
+        tried = set()
+        for b, cap in enumerate(bins):
+            if cap >= items[i] and cap not in tried:
+                tried.add(cap)
+                bins[b] -= items[i]
+                if place(i + 1):
+                    return True
+                bins[b] += items[i]
+        return False
+
+    return place(0)
+
+
+def _spread(busy: int, size: int) -> int:
+    """Partenze che toccano almeno una cella occupata di `busy` in [start, start + size)."""
+    out = busy
+    for k in range(1, size):
+        out |= busy >> k
+    return out
+
+
+@dataclass
+class _Task:
+    cls: int
+    subject: int
+    hours: int
+    daily_max: int
+    candidates: Tuple[int, ...]  # docenti con capacità iniziale sufficiente
+
+
+@dataclass
+class _Frame:
+    """Livello di decisione: prossimo blocco del task `task`."""
+    task: int
+    options: List[Tuple[int, int]]  # (docente, cella di partenza)
+    next_option: int = 0
+    conflicts: Set[int] = field(default_factory=set)
+    # Piazzamento applicato (docente, giorno, ora, size) e dati per annullarlo
+    placed: Optional[Tuple[int, int, int, int]] = None
+    undo: Optional[dict] = None
+
+
+class SubjectWeekCSP:
+    """
+    Risolve una settimana (required[c, s] ore) come CSP sui blocchi.
+
+    Vincoli: classe e docente liberi nelle ore del blocco, disponibilità
+    e vincoli statici di SlotIndex (pausa pranzo, mercoledì), al più
+    daily_max ore al giorno per materia, un solo docente per task con
+    capacità prof_subject_caps sufficiente. Il forward checking controlla
+    anche che i task ancora senza docente entrino nelle capacità residue
+    (bin packing per materia). I blocchi di un task sono
+    piazzati in ordine crescente di cella (rompe le permutazioni
+    equivalenti dello stesso insieme di blocchi).
+
+    `fixed` = (plan, subject_plan) sono lezioni già piazzate (es. le
+    materie comuni della Settimana A dentro la B): occupano classe e
+    docente e finiscono nel piano restituito; `required` conta solo le ore
+    ancora da piazzare.
+
+    `stats` riporta nodes, backtracks, prunes (domini svuotati dal forward
+    checking), backjumps (livelli saltati dal CBJ), status ed elapsed_sec.
+    CSP_INFEASIBLE significa che non esiste soluzione in questo modello a
+    blocchi; CSP_LIMIT che il budget di nodi o tempo è finito.
+    """
+
+    def __init__(
+        self,
+        days: int,
+        daily_hours: int,
+        num_classes: int,
+        availability: np.ndarray,  # (N, D, 2)
+        last_morning_hour: int,
+        wednesday_afternoon_free: bool,
+        required: np.ndarray,  # (classi, materie)
+        prof_subject_caps: np.ndarray,  # (N, materie)
+        subject_daily_max: np.ndarray,  # (materie, classi)
+        rng: Optional[random.Random] = None,
+        fixed: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
+        self.days = days
+        self.daily_hours = daily_hours
+        self.num_classes = num_classes
+        self.rng = rng or random.Random()
+        self.caps0 = np.array(prof_subject_caps, dtype=int)
+        self.num_prof = self.caps0.shape[0]
+
+        self.slots = SlotIndex(days, daily_hours, num_classes, availability, last_morning_hour, wednesday_afternoon_free)
+        self._static: Dict[int, List[int]] = {}
+        H = daily_hours
+        self.day_bits = [((1 << H) - 1) << (d * H) for d in range(days)]
+
+        self.fixed = fixed
+        self.fixed_prof_busy = [0] * self.num_prof
+        self.fixed_class_busy = [0] * num_classes
+        if fixed is not None:
+            for d, h, c in zip(*np.nonzero(fixed[0])):
+                bit = 1 << int(d * H + h)
+                self.fixed_prof_busy[int(fixed[0][d, h, c]) - 1] |= bit
+                self.fixed_class_busy[int(c)] |= bit
+
+        self.tasks: List[_Task] = []
+        num_subjects = required.shape[1]
+        for c in range(num_classes):
+            for s in range(num_subjects):
+                hours = int(required[c, s])
+                if hours <= 0:
+                    continue
+                candidates = tuple(p for p in range(self.num_prof) if self.caps0[p, s] >= hours)
+                self.tasks.append(_Task(c, s, hours, int(subject_daily_max[s, c]), candidates))
+
+        # Task influenzati da un piazzamento su una classe / un docente
+        self.by_class: List[List[int]] = [[] for _ in range(num_classes)]
+        self.by_prof: List[List[int]] = [[] for _ in range(self.num_prof)]
+        self.by_subject: List[List[int]] = [[] for _ in range(num_subjects)]
+        for t, task in enumerate(self.tasks):
+            self.by_class[task.cls].append(t)
+            self.by_subject[task.subject].append(t)
+            for p in task.candidates:
+                self.by_prof[p].append(t)
+
+        self.stats: dict = {}
+
+    # ------------------------------------------------------------------
+    # Domini
+    # ------------------------------------------------------------------
+
+    def _static_bits(self, prof: int, size: int) -> int:
+        per_prof = self._static.get(size)
+        if per_prof is None:
+            static = self.slots.static_starts(size)
+            per_prof = [mask_bits(static[p]) for p in range(self.num_prof)]
+            self._static[size] = per_prof
+        return per_prof[prof]
+
+    def _domain(self, t: int) -> Dict[int, int]:
+        """Docente -> bitmask delle partenze valide per il prossimo blocco del task t."""
+        task = self.tasks[t]
+        remaining = self.remaining[t]
+        load = self.load[t]
+
+        # Giorni raggruppati per lunghezza del blocco
+        by_size: Dict[int, int] = {}
+        for d in range(self.days):
+            size = min(task.daily_max - load[d], remaining)
+            if size >= 1:
+                by_size[size] = by_size.get(size, 0) | self.day_bits[d]
+        if not by_size:
+            return {}
+
+        after = ~((1 << (self.last_cell[t] + 1)) - 1)
+        teacher = self.teacher[t]
+        if teacher is not None:
+            teachers = (teacher,)
+        else:
+            teachers = tuple(p for p in task.candidates if self.caps[p, task.subject] >= task.hours)
+
+        class_busy = self.class_busy[task.cls]
+        domain: Dict[int, int] = {}
+        for p in teachers:
+            busy = class_busy | self.prof_busy[p]
+            bits = 0
+            for size, days in by_size.items():
+                bits |= self._static_bits(p, size) & days & ~_spread(busy, size)
+            bits &= after
+            if bits:
+                domain[p] = bits
+        return domain
+
+    def _culprits(self, t: int, frames: List[_Frame], upto: int) -> Set[int]:
+        """Livelli < upto i cui piazzamenti possono aver ridotto il dominio del task t."""
+        task = self.tasks[t]
+        candidates = set(task.candidates)
+        out = set()
+        for level in range(upto):
+            placed_task = self.tasks[frames[level].task]
+            if placed_task.cls == task.cls or frames[level].placed[0] in candidates:
+                out.add(level)
+        return out
+
+    def _caps_ok(self, subject: int) -> bool:
+        """Le ore dei task della materia ancora senza docente entrano nelle capacità residue."""
+        items = [
+            self.tasks[t].hours for t in self.by_subject[subject]
+            if self.teacher[t] is None
+        ]
+        return not items or packable(items, [int(c) for c in self.caps[:, subject]])
+
+    def _subject_levels(self, subject: int, frames: List[_Frame], upto: int) -> Set[int]:
+        """Livelli < upto che hanno fissato il docente di un task della materia."""
+        return {
+            level for level in range(upto)
+            if self.tasks[frames[level].task].subject == subject and frames[level].undo["teacher"] is None
+        }
+
+    # ------------------------------------------------------------------
+    # Piazzamento e annullamento
+    # ------------------------------------------------------------------
+
+    def _apply(self, t: int, prof: int, cell: int) -> Tuple[Tuple[int, int, int, int], dict, Optional[int]]:
+        """Piazza il blocco e aggiorna i domini toccati; ritorna (piazzamento, undo, task svuotato)."""
+        task = self.tasks[t]
+        d, h = divmod(cell, self.daily_hours)
+        size = min(task.daily_max - self.load[t][d], self.remaining[t])
+        block = ((1 << size) - 1) << cell
+
+        undo = {
+            "teacher": self.teacher[t],
+            "last_cell": self.last_cell[t],
+            "domains": {},
+        }
+        self.prof_busy[prof] |= block
+        self.class_busy[task.cls] |= block
+        self.load[t][d] += size
+        self.remaining[t] -= size
+        self.last_cell[t] = cell
+        if self.teacher[t] is None:
+            self.teacher[t] = prof
+            self.caps[prof, task.subject] -= task.hours
+        if self.remaining[t] == 0:
+            self.open_tasks.discard(t)
+
+        wiped = None
+        touched = set(self.by_class[task.cls])
+        touched.update(self.by_prof[prof])
+        for u in touched:
+            if u not in self.open_tasks:
+                continue
+            undo["domains"][u] = self.domains[u]
+            domain = self._domain(u)
+            self.domains[u] = domain
+            if not domain and wiped is None:
+                wiped = u
+        if t not in self.open_tasks:
+            undo["domains"][t] = self.domains[t]
+            self.domains[t] = {}
+        return (prof, d, h, size), undo, wiped
+
+    def _revert(self, t: int, placed: Tuple[int, int, int, int], undo: dict) -> None:
+        task = self.tasks[t]
+        prof, d, h, size = placed
+        block = ((1 << size) - 1) << (d * self.daily_hours + h)
+        self.prof_busy[prof] &= ~block
+        self.class_busy[task.cls] &= ~block
+        self.load[t][d] -= size
+        self.remaining[t] += size
+        self.last_cell[t] = undo["last_cell"]
+        if undo["teacher"] is None:
+            self.teacher[t] = None
+            self.caps[prof, task.subject] += task.hours
+        self.open_tasks.add(t)
+        self.domains.update(undo["domains"])
+
+    # ------------------------------------------------------------------
+    # Ricerca
+    # ------------------------------------------------------------------
+
+    def _select_task(self) -> int:
+        """MRV: meno partenze valide; a parità, più ore residue."""
+        best, best_key = -1, None
+        for t in self.open_tasks:
+            size = sum(bits.bit_count() for bits in self.domains[t].values())
+            key = (size, -self.remaining[t], t)
+            if best_key is None or key < best_key:
+                best, best_key = t, key
+        return best
+
+    def _new_frame(self, t: int) -> _Frame:
+        options = [
+            (p, cell)
+            for p, bits in self.domains[t].items()
+            for cell in range(bits.bit_length())
+            if bits >> cell & 1
+        ]
+        self.rng.shuffle(options)
+        options.sort(key=lambda option: self._gap_rank(t, *option))
+        return _Frame(task=t, options=options)
+
+    def _gap_rank(self, t: int, prof: int, cell: int) -> int:
+        """
+        Ordine dei valori: prima i blocchi attaccati a lezioni del docente
+        (0), poi i giorni in cui il docente è libero (1), infine quelli che
+        lasciano una buca (2).
+        """
+        task = self.tasks[t]
+        H = self.daily_hours
+        d, h = divmod(cell, H)
+        size = min(task.daily_max - self.load[t][d], self.remaining[t])
+        day_busy = (self.prof_busy[prof] >> (d * H)) & ((1 << H) - 1)
+        if not day_busy:
+            return 1
+        if (h > 0 and day_busy >> (h - 1) & 1) or day_busy >> (h + size) & 1:
+            return 0
+        return 2
+
+    def _reset(self) -> None:
+        self.prof_busy = list(self.fixed_prof_busy)
+        self.class_busy = list(self.fixed_class_busy)
+        self.caps = self.caps0.copy()
+        self.load = [[0] * self.days for _ in self.tasks]
+        self.remaining = [task.hours for task in self.tasks]
+        self.teacher: List[Optional[int]] = [None] * len(self.tasks)
+        self.last_cell = [-1] * len(self.tasks)
+        self.open_tasks = set(range(len(self.tasks)))
+        self.domains = {t: self._domain(t) for t in self.open_tasks}
+
+    def solve(
+        self,
+        node_limit: Optional[int] = None,
+        time_limit_sec: Optional[float] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Ritorna (plan, subject_plan) oppure (None, None); l'esito è in
+        stats["status"].
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + time_limit_sec if time_limit_sec is not None else None
+        self.stats = {"engine": "csp", "nodes": 0, "backtracks": 0, "prunes": 0, "backjumps": 0}
+        self._reset()
+
+        status = CSP_INFEASIBLE
+        frames: List[_Frame] = []
+        subjects = range(len(self.by_subject))
+        if self.open_tasks and all(self.domains[t] for t in self.open_tasks) and all(map(self._caps_ok, subjects)):
+            frames.append(self._new_frame(self._select_task()))
+        elif not self.open_tasks:
+            status = CSP_SOLVED
+
+        while frames:
+            level = len(frames) - 1
+            frame = frames[level]
+            if frame.placed is not None:
+                self._revert(frame.task, frame.placed, frame.undo)
+                frame.placed = frame.undo = None
+
+            if frame.next_option >= len(frame.options):
+                # Vicolo cieco: salta al livello più profondo tra i responsabili
+                conflicts = frame.conflicts | self._culprits(frame.task, frames, level)
+                frames.pop()
+                self.stats["backtracks"] += 1
+                if not conflicts:
+                    break
+                target = max(conflicts)
+                while len(frames) - 1 > target:
+                    dropped = frames.pop()
+                    self._revert(dropped.task, dropped.placed, dropped.undo)
+                    self.stats["backjumps"] += 1
+                frames[target].conflicts |= conflicts - {target}
+                continue
+
+            if (node_limit is not None and self.stats["nodes"] >= node_limit) or (
+                deadline is not None and self.stats["nodes"] and self.stats["nodes"] % 256 == 0 and time.perf_counter() > deadline
+            ):
+                status = CSP_LIMIT
+                break
+
+            prof, cell = frame.options[frame.next_option]
+            frame.next_option += 1
+            self.stats["nodes"] += 1
+            frame.placed, frame.undo, wiped = self._apply(frame.task, prof, cell)
+
+            # Forward checking: un task senza partenze valide, oppure task
+            # della materia che non entrano più nelle capacità dei docenti
+            subject = self.tasks[frame.task].subject
+            if wiped is not None:
+                self.stats["prunes"] += 1
+                frame.conflicts |= self._culprits(wiped, frames, level)
+                continue
+            if frame.undo["teacher"] is None and not self._caps_ok(subject):
+                self.stats["prunes"] += 1
+                frame.conflicts |= self._subject_levels(subject, frames, level)
+                continue
+            if not self.open_tasks:
+                status = CSP_SOLVED
+                break
+            frames.append(self._new_frame(self._select_task()))
+
+        self.stats["status"] = status
+        self.stats["elapsed_sec"] = time.perf_counter() - t0
+        if status != CSP_SOLVED:
+            return None, None
+
+        if self.fixed is not None:
+            plan, subject_plan = (np.array(a, dtype=int) for a in self.fixed)
+        else:
+            plan = np.zeros((self.days, self.daily_hours, self.num_classes), dtype=int)
+            subject_plan = np.zeros_like(plan)
+        for frame in frames:
+            task = self.tasks[frame.task]
+            prof, d, h, size = frame.placed
+            plan[d, h:h + size, task.cls] = prof + 1
+            subject_plan[d, h:h + size, task.cls] = task.subject + 1
+        return plan, subject_plan
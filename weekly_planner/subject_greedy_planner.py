@@ -1,21 +1,30 @@
 # subject_greedy_planner.py
 #
 # Planner greedy veloce e affidabile per materie.
-# Usa un algoritmo "stacking" che ordina gli assegnamenti per difficoltà
-# e li posiziona rispettando vincoli, con backtracking se necessario.
+# Ogni settimana è risolta dal motore CSP di subject_csp (blocchi scelti
+# per dominio minimo, forward checking, backjumping): le istanze quasi
+# impossibili vengono risolte o dimostrate impossibili invece di ripartire
+# da capo.
 
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional, Tuple
 import numpy as np
 
+from .local_search import improve_subject_plan
 from .models import PlanResult, PlannerConfig
+from .parallel import process_context
+from .scoring import TEACHER_GAP_WEIGHTS, score_plan
+from .subject_csp import CSP_INFEASIBLE, CSP_LIMIT, CSP_SOLVED, SubjectWeekCSP
 from .subject_planner import SubjectPlanningData
 
 
 class SubjectGreedyPlanner:
     """
     Planner greedy veloce che genera piani validi senza usare solver MIP.
-    Usa un algoritmo stacking + randomized placement con retry.
+    Usa una ricerca a backtracking con ordine casuale dei valori, riavviata
+    fino alla scadenza (anche in parallelo).
     """
 
     def __init__(self, config: PlannerConfig, ctx: SubjectPlanningData, seed: Optional[int] = None):
@@ -37,203 +46,250 @@ class SubjectGreedyPlanner:
                 A = np.repeat(A[:, :, None], 2, axis=2)
             self.avail = A
 
-        if seed is not None:
-            random.seed(seed)
-            np.random.seed(seed)
+        # Niente random.seed globale: ogni riavvio usa un flusso proprio
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(10_000_000_000)
 
     def _is_available(self, prof: int, day: int, hour: int) -> bool:
         slot = 0 if hour < self.last_morning_hour else 1
         return bool(self.avail[prof, day, slot])
 
     def _score_plan(self, plan: np.ndarray) -> float:
-        """Calcola uno score per il piano (minore è meglio)."""
-        score = 0.0
-        D, H, C = plan.shape
-        
-        # Penalizza buchi nelle giornate dei prof
-        for p in range(self.num_prof):
-            for d in range(D):
-                prof_hours = np.where(np.any(plan[d, :, :] == p + 1, axis=1))[0]
-                if len(prof_hours) <= 1:
-                    continue
-                first = prof_hours[0]
-                last = prof_hours[-1]
-                gaps = 0
-                for h in range(first, last + 1):
-                    if not np.any(plan[d, h, :] == p + 1):
-                        gaps += 1
-                score += 0.5 * gaps
-        
-        return score
+        """Calcola uno score per il piano (minore è meglio): 0.5 per ogni buca dei prof."""
+        return score_plan(plan, self.num_prof, self.last_morning_hour, TEACHER_GAP_WEIGHTS)
+
+    def _restart_rng(self, worker: int, week: int, restart: int) -> random.Random:
+        """Flusso casuale di un riavvio: dipende solo da seed, worker, settimana e indice."""
+        return random.Random(f"{self.seed}:{worker}:{week}:{restart}")
 
     def _try_generate_week(
         self,
         required: np.ndarray,  # shape (classes, subjects)
-        max_attempts: int = 50,
-        placement_tries: int = 500,
-    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        rng: random.Random,
+        node_limit: int = 200_000,
+        time_limit_sec: Optional[float] = None,
+        fixed: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], dict]:
         """
-        Tenta di generare un piano per una settimana.
-        Ritorna (plan, subject_plan) o (None, None) se fallisce dopo max_attempts.
+        Genera il piano di una settimana con il motore CSP (MRV, forward
+        checking, backjumping), partendo dalle lezioni già piazzate in
+        `fixed`. Ritorna (plan, subject_plan, stats); plan è None se la
+        settimana è impossibile (stats["status"] == "infeasible") o se il
+        budget di nodi/tempo è finito ("limit").
         """
+        csp = SubjectWeekCSP(
+            self.days, self.daily_hours, self.num_classes, self.avail,
+            self.last_morning_hour, self.wed_free,
+            required, self.ctx.prof_subject_caps, self.ctx.subject_daily_max,
+            rng=rng,
+            fixed=fixed,
+        )
+        plan, subject_plan = csp.solve(node_limit=node_limit, time_limit_sec=time_limit_sec)
+        return plan, subject_plan, csp.stats
 
-        for attempt in range(max_attempts):
-            plan = np.zeros((self.days, self.daily_hours, self.num_classes), dtype=int)
-            subject_plan = np.zeros((self.days, self.daily_hours, self.num_classes), dtype=int)
-            
-            # Crea lista di assegnamenti (class, subject, ore, difficoltà)
-            tasks = []
-            for c in range(self.num_classes):
-                for s in range(self.num_subjects):
-                    hours_needed = int(required[c, s])
-                    if hours_needed <= 0:
-                        continue
-                    
-                    # Difficoltà: quanti prof possono insegnare questa materia a questa classe
-                    teachers_available = 0
-                    for p in range(self.num_prof):
-                        if self.ctx.prof_subject_caps[p, s] >= hours_needed:
-                            teachers_available += 1
-                    
-                    difficulty = -teachers_available  # Negativo per sort ascendente (prima difficili)
-                    daily_max = int(self.ctx.subject_daily_max[s, c])
-                    
-                    tasks.append({
-                        "class": c,
-                        "subject": s,
-                        "hours_needed": hours_needed,
-                        "difficulty": difficulty,
-                        "daily_max": daily_max,
-                    })
-            
-            # Ordina per difficoltà (più difficili prima)
-            tasks.sort(key=lambda t: t["difficulty"])
-            
-            # Tracking
-            prof_caps_remaining = np.array(self.ctx.prof_subject_caps, dtype=int)
-            day_subject_load = np.zeros((self.days, self.num_classes, self.num_subjects), dtype=int)
-            teachers_for_cs = {}  # (class, subject) -> prof
-            
-            success = True
-            for task in tasks:
-                c = task["class"]
-                s = task["subject"]
-                hours_needed = task["hours_needed"]
-                daily_max = task["daily_max"]
-                
-                # Scegli prof (preferisci continuità)
-                preferred_prof = teachers_for_cs.get((c, s))
-
-                prof = None
-                if preferred_prof is not None:
-                    if prof_caps_remaining[preferred_prof, s] >= hours_needed:
-                        prof = preferred_prof
-                    elif self.ctx.single_teacher_rule:
-                        # Con single_teacher_rule il prof è già fissato: non si può cambiare
-                        success = False
-                        break
-                    else:
-                        candidates = [
-                            p for p in range(self.num_prof)
-                            if prof_caps_remaining[p, s] >= hours_needed
-                        ]
-                        if candidates:
-                            prof = random.choice(candidates)
-                else:
-                    candidates = [
-                        p for p in range(self.num_prof)
-                        if prof_caps_remaining[p, s] >= hours_needed
-                    ]
-                    if candidates:
-                        prof = random.choice(candidates)
-
-                if prof is None:
-                    success = False
+    def _search(
+        self,
+        worker: int,
+        time_limit_sec: float,
+        max_restarts: Optional[int] = None,
+    ) -> Tuple[List[Optional[tuple]], List[dict]]:
+        """
+        Riavvii fino alla scadenza per ogni settimana, tenendo il piano con
+        score migliore. Ogni settimana ha come scadenza la sua quota del
+        budget (il tempo non usato passa alle successive). Ci si ferma
+        prima se la settimana è impossibile o se lo score è 0.
+
+        Ritorna per settimana (plan, subject_plan, score) o None, più le
+        statistiche aggregate.
+        """
+        t0 = time.perf_counter()
+        weeks = len(self.ctx.required_hours)
+        best: List[Optional[tuple]] = []
+        stats: List[dict] = []
+        for week, required in enumerate(self.ctx.required_hours):
+            deadline = t0 + time_limit_sec * (week + 1) / weeks
+            week_best = None
+            week_stats = {
+                "engine": "csp", "status": CSP_LIMIT, "restarts": 0,
+                "nodes": 0, "backtracks": 0, "prunes": 0, "backjumps": 0,
+            }
+            while max_restarts is None or week_stats["restarts"] < max_restarts:
+                remaining = deadline - time.perf_counter()
+                if week_stats["restarts"] > 0 and remaining <= 0:
                     break
-                
-                # Posiziona le ore
-                hours_placed = 0
-                for _ in range(placement_tries):
-                    if hours_placed >= hours_needed:
-                        break
-                    
-                    # Scegli giorno e calcola block_size basandosi sul giorno scelto
-                    d = random.randrange(self.days)
-                    block_size = min(daily_max - day_subject_load[d, c, s],
-                                    hours_needed - hours_placed)
-                    block_size = max(1, block_size)
-                    start = random.randrange(max(1, self.daily_hours - block_size + 1))
-                    
-                    # Verifica vincoli
-                    if self.wed_free and d == 2 and start >= self.last_morning_hour:
-                        continue
-                    
-                    if 0 < self.last_morning_hour < self.daily_hours:
-                        if start <= self.last_morning_hour - 1 < start + block_size - 1:
-                            continue
-                    
-                    # Verifica che le celle siano libere e il prof disponibile
-                    cells_ok = True
-                    for k in range(block_size):
-                        h = start + k
-                        if h >= self.daily_hours:
-                            cells_ok = False
-                            break
-                        if plan[d, h, c] != 0:
-                            cells_ok = False
-                            break
-                        if not self._is_available(prof, d, h):
-                            cells_ok = False
-                            break
-                        if day_subject_load[d, c, s] + block_size > daily_max:
-                            cells_ok = False
-                            break
-                        # Evita che lo stesso prof insegni 2 materie contemporaneamente
-                        if np.any(plan[d, h, :] == prof + 1):
-                            cells_ok = False
-                            break
-                    
-                    if not cells_ok:
-                        continue
-                    
-                    # Piazza il blocco
-                    for k in range(block_size):
-                        h = start + k
-                        plan[d, h, c] = prof + 1
-                        subject_plan[d, h, c] = s + 1
-
-                    day_subject_load[d, c, s] += block_size
-                    hours_placed += block_size
-                
-                if hours_placed < hours_needed:
-                    success = False
+                rng = self._restart_rng(worker, week, week_stats["restarts"])
+                plan, subj_plan, run = self._try_generate_week(required, rng, time_limit_sec=max(remaining, 0.0))
+                week_stats["restarts"] += 1
+                for key in ("nodes", "backtracks", "prunes", "backjumps"):
+                    week_stats[key] += run[key]
+
+                if run["status"] == CSP_INFEASIBLE:
+                    week_stats["status"] = CSP_INFEASIBLE
                     break
-                
-                prof_caps_remaining[prof, s] -= hours_needed
-                teachers_for_cs[(c, s)] = prof
-            
-            if success:
-                return plan, subject_plan
+                if plan is not None:
+                    week_stats["status"] = CSP_SOLVED
+                    score = self._score_plan(plan)
+                    if week_best is None or score < week_best[2]:
+                        week_best = (plan, subj_plan, score)
+                    if score <= 0:
+                        break
+            best.append(week_best)
+            stats.append(week_stats)
+            if week_best is None:
+                break
+        return best, stats
 
-        return None, None
+    def _search_shared(
+        self,
+        worker: int,
+        time_limit_sec: float,
+        max_restarts: Optional[int] = None,
+    ) -> Tuple[List[Optional[tuple]], List[dict]]:
+        """
+        Come `_search`, ma le materie comuni (ctx.shared_subjects) hanno lo
+        stesso orario in tutte le settimane: ogni riavvio genera la prima
+        settimana, poi le altre con quelle lezioni fissate, piazzando solo
+        le ore delle materie Settimana A/B. Si tiene la combinazione
+        completa con la somma degli score minore.
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + time_limit_sec
+        shared = self.ctx.shared_subjects()
+        weeks = len(self.ctx.required_hours)
+        best: List[Optional[tuple]] = [None] * weeks
+        best_total = float("inf")
+        stats = [
+            {"engine": "csp", "status": CSP_LIMIT, "restarts": 0,
+             "nodes": 0, "backtracks": 0, "prunes": 0, "backjumps": 0}
+            for _ in range(weeks)
+        ]
+        restarts = 0
+        while max_restarts is None or restarts < max_restarts:
+            if restarts > 0 and time.perf_counter() >= deadline:
+                break
+            combo = []
+            fixed = None
+            for week, required in enumerate(self.ctx.required_hours):
+                if week > 0:
+                    required = np.where(shared[None, :], 0, required)
+                rng = self._restart_rng(worker, week, restarts)
+                remaining = max(deadline - time.perf_counter(), 0.0)
+                plan, subj_plan, run = self._try_generate_week(required, rng, time_limit_sec=remaining, fixed=fixed)
+                stats[week]["restarts"] += 1
+                for key in ("nodes", "backtracks", "prunes", "backjumps"):
+                    stats[week][key] += run[key]
+                if plan is None:
+                    # Dopo la prima settimana l'impossibilità vale solo per
+                    # queste lezioni comuni: si riprova con un altro riavvio
+                    if run["status"] == CSP_INFEASIBLE and week == 0:
+                        stats[0]["status"] = CSP_INFEASIBLE
+                    break
+                stats[week]["status"] = CSP_SOLVED
+                combo.append((plan, subj_plan, self._score_plan(plan)))
+                if week == 0:
+                    common = (subj_plan > 0) & shared[np.clip(subj_plan - 1, 0, None)]
+                    fixed = (np.where(common, plan, 0), np.where(common, subj_plan, 0))
+            restarts += 1
+            if stats[0]["status"] == CSP_INFEASIBLE:
+                break
+            if len(combo) == weeks:
+                total = sum(score for _, _, score in combo)
+                if total < best_total:
+                    best, best_total = combo, total
+                if total <= 0:
+                    break
+        return best, stats
 
-    def generate(self, time_limit_sec: float = 5.0) -> PlanResult:
+    def generate(
+        self,
+        time_limit_sec: float = 5.0,
+        workers: int = 1,
+        max_restarts: Optional[int] = None,
+        improve_sec: float = 0.0,
+        shared_weeks: bool = False,
+    ) -> PlanResult:
         """
-        Genera piani per tutte le settimane.
+        Genera piani per tutte le settimane con riavvii fino a esaurire
+        `time_limit_sec` (o `max_restarts` per settimana), tenendo per ogni
+        settimana il piano con score migliore.
+
+        Con workers > 1 i riavvii girano in un pool di processi, ognuno col
+        proprio flusso casuale derivato da seed e indice del worker: con lo
+        stesso seed e max_restarts il risultato è riproducibile. Con
+        improve_sec > 0 il piano migliore di ogni settimana passa poi per
+        la ricerca locale (local_search), divisa tra le settimane. Le
+        statistiche di ricerca (restarts, nodes, backtracks, prunes,
+        backjumps, status) di ogni settimana finiscono in
+        `PlanResult.solve_stats`.
+
+        Con shared_weeks (e più settimane) le materie senza A/B hanno lo
+        stesso orario in tutte le settimane (vedi `_search_shared`); si
+        sceglie la combinazione migliore di un solo worker e la ricerca
+        locale non si applica, perché sposterebbe le lezioni comuni in una
+        settimana sola.
         """
+        shared_weeks = shared_weeks and len(self.ctx.required_hours) > 1
+        search = self._search_shared if shared_weeks else self._search
+        if workers <= 1:
+            outcomes = [search(0, time_limit_sec, max_restarts)]
+        else:
+            ctx = process_context()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(search, worker, time_limit_sec, max_restarts)
+                    for worker in range(workers)
+                ]
+                outcomes = [f.result() for f in futures]
+        if shared_weeks:
+            # le settimane vanno prese tutte dallo stesso worker
+            complete = [o for o in outcomes if all(b is not None for b in o[0])]
+            if complete:
+                chosen = min(complete, key=lambda o: sum(b[2] for b in o[0]))
+                outcomes = [chosen] + [([None] * len(o[0]), o[1]) for o in outcomes if o is not chosen]
+            improve_sec = 0.0
+
         plans: List[np.ndarray] = []
         subject_plans: List[np.ndarray] = []
         scores: List[float] = []
+        stats: List[dict] = []
+        for week in range(len(self.ctx.required_hours)):
+            week_stats = {"engine": "csp", "status": CSP_LIMIT, "workers": workers}
+            week_best = None
+            for worker_best, worker_stats in outcomes:
+                if week >= len(worker_stats):
+                    continue
+                run = worker_stats[week]
+                for key in ("restarts", "nodes", "backtracks", "prunes", "backjumps"):
+                    week_stats[key] = week_stats.get(key, 0) + run[key]
+                if run["status"] == CSP_INFEASIBLE or week_stats["status"] == CSP_INFEASIBLE:
+                    week_stats["status"] = CSP_INFEASIBLE
+                elif run["status"] == CSP_SOLVED:
+                    week_stats["status"] = CSP_SOLVED
+                candidate = worker_best[week]
+                # a parità di score vince il worker con indice minore (deterministico)
+                if candidate is not None and (week_best is None or candidate[2] < week_best[2]):
+                    week_best = candidate
+            stats.append(week_stats)
 
-        for week_idx, required in enumerate(self.ctx.required_hours):
-            plan, subj_plan = self._try_generate_week(required, max_attempts=50, placement_tries=500)
-
-            if plan is None:
+            if week_best is None:
                 # Se fallisce una settimana, il piano intero è fallito
-                return PlanResult(plans=[], scores=[], week_labels=self.ctx.week_labels)
+                return PlanResult(plans=[], scores=[], week_labels=self.ctx.week_labels, solve_stats=stats)
 
+            plan, subj_plan, score = week_best
+            if improve_sec > 0 and score > 0:
+                plan, subj_plan, score, week_stats["local_search"] = improve_subject_plan(
+                    self.config, self.ctx, plan, subj_plan, TEACHER_GAP_WEIGHTS,
+                    self.ctx.prof_subject_caps,
+                    time_limit_sec=improve_sec / len(self.ctx.required_hours),
+                    seed=self._restart_rng(workers, week, 0).getrandbits(32),
+                )
             plans.append(plan)
             subject_plans.append(subj_plan)
-            scores.append(self._score_plan(plan))
+            scores.append(score)
 
-        return PlanResult(plans=plans, scores=scores, week_labels=self.ctx.week_labels, subject_plans=subject_plans)
+        return PlanResult(
+            plans=plans,
+            scores=scores,
+            week_labels=self.ctx.week_labels,
+            subject_plans=subject_plans,
+            solve_stats=stats,
+        )
@@ -5,15 +5,52 @@
 
 from __future__ import annotations
 
+import os
 import random
-from dataclasses import dataclass
-from typing import Any, List, Optional, Tuple
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pulp
 
+from .mip_matrix import (
+    STATUS_FEASIBLE,
+    STATUS_INFEASIBLE,
+    STATUS_NOT_SOLVED,
+    STATUS_OPTIMAL,
+    BuildTimer,
+    MatrixModel,
+    active_keys,
+    key_array,
+    remaining_limit,
+    set_pulp_start,
+    solve_pulp,
+    variable_values,
+)
+from .mip_planner import MIP_BACKENDS
 from .models import PlanResult, PlannerConfig
-
+from .parallel import process_context
+from .scoring import ANTI_GAP_WEIGHTS, score_plan
+from .local_search import improve_subject_plan
+from .slots import SlotIndex
+from .subject_csp import SubjectWeekCSP
+from .symmetry import SymmetryGroups, canonical_teachers, subject_symmetry
+
+# Modi di risolvere il MIP a materie: un solo modello con la scelta dei
+# docenti, assegnazione docenti e poi orario (vedi _solve_two_stage),
+# oppure ore per giorno e poi un orario per giorno (vedi _solve_by_day)
+SUBJECT_MIP_MODES = ("joint", "two_stage", "by_day")
+
+# Variabili del modello orario: ore singole x[d,h,c,s,p] con la contiguità
+# ricostruita da z/start, oppure blocchi interi (vedi SubjectBlockIndex)
+SUBJECT_FORMULATIONS = ("hourly", "blocks")
+
+# Assegnazione di una settimana: (classe, materia) -> {prof: ore}
+Assignment = Dict[Tuple[int, int], Dict[int, int]]
+# Ore di un giorno per (classe, materia, prof)
+DayPattern = Dict[Tuple[int, int, int], int]
 
 @dataclass
 class SubjectPlanningData:
@@ -25,6 +62,9 @@ class SubjectPlanningData:
     aggregate_hours_rule: bool
     single_teacher_rule: bool
     subject_names: List[str]
+    # shape (materie,): True per le materie Settimana A/B (ore diverse per
+    # settimana); le altre devono avere lo stesso orario in tutte le settimane
+    alt_weeks: Optional[np.ndarray] = None
 
     @property
     def num_subjects(self) -> int:
@@ -34,6 +74,17 @@ class SubjectPlanningData:
     def total_required(self) -> List[int]:
         return [int(req.sum()) for req in self.required_hours]
 
+    def shared_subjects(self) -> np.ndarray:
+        """
+        Materie con orario comune a tutte le settimane: non Settimana A/B
+        (alt_weeks) e con le stesse ore richieste in ogni settimana.
+        """
+        required = np.stack(self.required_hours)
+        same = (required == required[0]).all(axis=(0, 1))
+        if self.alt_weeks is None:
+            return same
+        return same & ~np.asarray(self.alt_weeks, dtype=bool)
+
 
 def _normalize_hours(arr: Any, length: int) -> List[int]:
     try:
@@ -71,12 +122,17 @@ def normalize_subject_input(req: Any, config: PlannerConfig) -> Optional[Subject
     if generate_both:
         week_labels.append("Settimana B")
 
+    alt_weeks = np.array([
+        bool(row.get("altWeeks") if isinstance(row, dict) else getattr(row, "altWeeks", False))
+        for row in subject_rows
+    ], dtype=bool)
+
     # Ore richieste per materia/classe per settimana
     required_hours: List[np.ndarray] = []
     for week_idx, _ in enumerate(week_labels):
         mat = np.zeros((num_classes, num_subjects), dtype=int)
         for s, row in enumerate(subject_rows):
-            alt = bool(row.get("altWeeks") if isinstance(row, dict) else getattr(row, "altWeeks", False))
+            alt = bool(alt_weeks[s])
             base_hours = _normalize_hours(row.get("hours") if isinstance(row, dict) else getattr(row, "hours", []), num_classes)
             hours_a = _normalize_hours(
                 row.get("hoursA") if isinstance(row, dict) else getattr(row, "hoursA", []),
@@ -149,6 +205,7 @@ def normalize_subject_input(req: Any, config: PlannerConfig) -> Optional[Subject
         aggregate_hours_rule=aggregate_hours_rule,
         single_teacher_rule=single_teacher_rule,
         subject_names=subj_names,
+        alt_weeks=alt_weeks,
     )
 
 
@@ -183,6 +240,75 @@ def validate_subject_data(ctx: SubjectPlanningData, config: PlannerConfig) -> Li
     return errors
 
 
+@dataclass
+class SubjectVarIndex:
+    """
+    Indice sparso delle variabili x[d,h,c,s,p] del modello MIP a materie.
+
+    Contiene solo le tuple ammissibili e le liste di adiacenza usate per
+    costruire le somme dei vincoli, così la dimensione del modello cresce
+    con il carico didattico reale e non con il prodotto cartesiano completo.
+    """
+    pairs: List[Tuple[int, int]]  # coppie (classe, materia) con ore richieste
+    keys: List[Tuple[int, int, int, int, int]] = field(default_factory=list)
+    by_cs: Dict[Tuple[int, int], List[tuple]] = field(default_factory=dict)
+    by_dhc: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    by_dhp: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    by_ps: Dict[Tuple[int, int], List[tuple]] = field(default_factory=dict)
+    by_dcs: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    by_dhcs: Dict[Tuple[int, int, int, int], List[tuple]] = field(default_factory=dict)
+    by_csp: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    hours_by_dcs: Dict[Tuple[int, int, int], List[int]] = field(default_factory=dict)
+    profs_by_cs: Dict[Tuple[int, int], List[int]] = field(default_factory=dict)
+
+    def add(self, key: Tuple[int, int, int, int, int]) -> None:
+        d, h, c, s, p = key
+        self.keys.append(key)
+        self.by_cs.setdefault((c, s), []).append(key)
+        self.by_dhc.setdefault((d, h, c), []).append(key)
+        self.by_dhp.setdefault((d, h, p), []).append(key)
+        self.by_ps.setdefault((p, s), []).append(key)
+        self.by_dcs.setdefault((d, c, s), []).append(key)
+        if (d, h, c, s) not in self.by_dhcs:
+            self.hours_by_dcs.setdefault((d, c, s), []).append(h)
+        self.by_dhcs.setdefault((d, h, c, s), []).append(key)
+        if (c, s, p) not in self.by_csp:
+            self.profs_by_cs.setdefault((c, s), []).append(p)
+        self.by_csp.setdefault((c, s, p), []).append(key)
+
+
+@dataclass
+class SubjectBlockIndex:
+    """
+    Indice delle variabili y[c,s,p,d,inizio,durata] della formulazione a
+    blocchi: ogni variabile è un'intera lezione contigua. Le liste di
+    copertura (per classe e per docente, slot per slot) sostituiscono le
+    somme sulle ore del modello orario.
+    """
+    pairs: List[Tuple[int, int]]  # coppie (classe, materia) con ore richieste
+    keys: List[Tuple[int, int, int, int, int, int]] = field(default_factory=list)
+    by_cs: Dict[Tuple[int, int], List[tuple]] = field(default_factory=dict)
+    by_csp: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    by_ps: Dict[Tuple[int, int], List[tuple]] = field(default_factory=dict)
+    by_dcs: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    cover_dhc: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    cover_dhp: Dict[Tuple[int, int, int], List[tuple]] = field(default_factory=dict)
+    profs_by_cs: Dict[Tuple[int, int], List[int]] = field(default_factory=dict)
+
+    def add(self, key: Tuple[int, int, int, int, int, int]) -> None:
+        c, s, p, d, start, length = key
+        self.keys.append(key)
+        self.by_cs.setdefault((c, s), []).append(key)
+        if (c, s, p) not in self.by_csp:
+            self.profs_by_cs.setdefault((c, s), []).append(p)
+        self.by_csp.setdefault((c, s, p), []).append(key)
+        self.by_ps.setdefault((p, s), []).append(key)
+        self.by_dcs.setdefault((d, c, s), []).append(key)
+        for h in range(start, start + length):
+            self.cover_dhc.setdefault((d, h, c), []).append(key)
+            self.cover_dhp.setdefault((d, h, p), []).append(key)
+
+
 class SubjectMIPPlanner:
     """
     Planner MIP che lavora direttamente su materie.
@@ -212,242 +338,346 @@ class SubjectMIPPlanner:
         slot = 0 if hour < self.last_morning_hour else 1
         return bool(self.avail[prof, day, slot])
 
-    def solve(self, time_limit_sec: int | None = 60) -> PlanResult:
+    def solve(
+        self,
+        time_limit_sec: int | None = 60,
+        backend: str = "pulp",
+        warm_start: PlanResult | None = None,
+        threads: int | None = None,
+        mode: str = "joint",
+        formulation: str = "hourly",
+        joint_weeks: bool = False,
+        symmetry_breaking: bool = True,
+    ) -> PlanResult:
+        """
+        Risolve una settimana alla volta. backend = "pulp" (espressioni PuLP)
+        oppure "matrix" (array scritti in MPS, vedi mip_matrix); le
+        statistiche di build/solve finiscono in `PlanResult.solve_stats`.
+
+        warm_start (es. il risultato di SubjectGreedyPlanner, con plans e
+        subject_plans) fornisce a CBC una soluzione di partenza per settimana;
+        threads è passato a CBC.
+
+        mode = "joint" decide docenti e orario nello stesso modello;
+        "two_stage" assegna prima i docenti con un modello piccolo e poi
+        risolve l'orario a docenti fissati (vedi `_solve_two_stage`);
+        "by_day" distribuisce prima le ore sui giorni e poi risolve un
+        orario per giorno in parallelo (vedi `_solve_by_day`).
+
+        formulation = "hourly" usa una variabile per ora; "blocks" una per
+        blocco di lezione (classe, materia, prof, giorno, inizio, durata),
+        con contiguità e pausa pranzo garantite per costruzione.
+
+        joint_weeks = True risolve le settimane A/B in un solo modello in cui
+        le materie senza A/B hanno un orario comune a tutte le settimane
+        (vedi `_solve_joint_weeks`); richiede mode "joint". Senza A/B (una
+        settimana) non cambia nulla.
+
+        symmetry_breaking (mode "joint") fissa l'orbita delle prime
+        assegnazioni dei docenti intercambiabili (vedi symmetry.py); i
+        gruppi di classi e docenti trovati finiscono in
+        `solve_stats["symmetry"]`.
+        """
+        if backend not in MIP_BACKENDS:
+            raise ValueError(f"backend non valido: {backend!r} (ammessi: {', '.join(MIP_BACKENDS)})")
+        if mode not in SUBJECT_MIP_MODES:
+            raise ValueError(f"mode non valido: {mode!r} (ammessi: {', '.join(SUBJECT_MIP_MODES)})")
+        if formulation not in SUBJECT_FORMULATIONS:
+            raise ValueError(
+                f"formulation non valida: {formulation!r} (ammesse: {', '.join(SUBJECT_FORMULATIONS)})"
+            )
+        if joint_weeks and len(self.ctx.week_labels) > 1:
+            if mode != "joint":
+                raise ValueError(f"joint_weeks richiede mode='joint' (non {mode!r})")
+            return self._solve_joint_weeks(
+                time_limit_sec, backend, warm_start, threads, formulation, symmetry_breaking
+            )
+
+        solve_week = {
+            "joint": self._solve_single_week,
+            "two_stage": self._solve_two_stage,
+            "by_day": self._solve_by_day,
+        }[mode]
+        # two_stage e by_day fissano i docenti: non restano docenti intercambiabili
+        week_kwargs = {"symmetry_breaking": symmetry_breaking} if mode == "joint" else {}
+
         plans: List[np.ndarray] = []
         subject_plans: List[np.ndarray] = []
         scores: List[float] = []
+        stats: List[dict] = []
 
         for week_idx, label in enumerate(self.ctx.week_labels):
-            plan, subj_plan, score = self._solve_single_week(
+            start = None
+            if (
+                warm_start is not None
+                and warm_start.subject_plans
+                and week_idx < len(warm_start.plans)
+                and week_idx < len(warm_start.subject_plans)
+            ):
+                start = (warm_start.plans[week_idx], warm_start.subject_plans[week_idx])
+            plan, subj_plan, score, week_stats = solve_week(
                 self.ctx.required_hours[week_idx],
                 time_limit_sec=time_limit_sec,
+                backend=backend,
+                start=start,
+                threads=threads,
+                formulation=formulation,
+                **week_kwargs,
             )
+            stats.append(week_stats)
             if plan is None:
-                return PlanResult(plans=[], scores=[], week_labels=self.ctx.week_labels)
+                return PlanResult(plans=[], scores=[], week_labels=self.ctx.week_labels, solve_stats=stats)
             plans.append(plan)
             subject_plans.append(subj_plan)
             scores.append(score)
 
-        return PlanResult(plans=plans, scores=scores, week_labels=self.ctx.week_labels, subject_plans=subject_plans)
+        return PlanResult(
+            plans=plans,
+            scores=scores,
+            week_labels=self.ctx.week_labels,
+            subject_plans=subject_plans,
+            solve_stats=stats,
+        )
 
-    def _solve_single_week(
+    def _is_blocked_slot(self, day: int, hour: int) -> bool:
+        """True se lo slot è escluso a priori (mercoledì pomeriggio libero)."""
+        return bool(self.wed_free and self.days > 2 and day == 2 and hour >= self.last_morning_hour)
+
+    def _build_index(
         self,
-        required: np.ndarray,  # shape (classes, subjects)
-        time_limit_sec: int | None = 60,
-    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], float]:
+        required: np.ndarray,
+        assignment: Assignment | None = None,
+        days: Sequence[int] | None = None,
+    ) -> SubjectVarIndex:
+        """
+        Enumera le sole tuple (d, h, c, s, p) ammissibili (solo nei giorni
+        `days`, se indicati):
+          - la classe richiede la materia (required[c, s] > 0)
+          - il prof ha ore dichiarate per la materia (prof_subject_caps[p, s] > 0)
+            oppure, con `assignment`, è tra i docenti assegnati a (c, s)
+          - il prof è disponibile nello slot e lo slot non è bloccato
+        """
+        caps = self.ctx.prof_subject_caps
+        teachers_by_s = [
+            [p for p in range(self.num_prof) if int(caps[p, s]) > 0]
+            for s in range(self.num_subjects)
+        ]
+        teachers = {}
+        for (c, s) in zip(*np.nonzero(required)):
+            c, s = int(c), int(s)
+            teachers[(c, s)] = sorted(assignment.get((c, s), {})) if assignment is not None else teachers_by_s[s]
+        pairs = [
+            (c, s)
+            for c in range(self.num_classes)
+            for s in range(self.num_subjects)
+            if int(required[c, s]) > 0
+        ]
+
+        idx = SubjectVarIndex(pairs=pairs)
+        for d in (range(self.days) if days is None else days):
+            for h in range(self.daily_hours):
+                if self._is_blocked_slot(d, h):
+                    continue
+                available = [self._is_available(p, d, h) for p in range(self.num_prof)]
+                for c, s in pairs:
+                    for p in teachers[(c, s)]:
+                        if available[p]:
+                            idx.add((d, h, c, s, p))
+        return idx
+
+    def _index_is_feasible(
+        self,
+        required: np.ndarray,
+        idx: SubjectVarIndex,
+        assignment: Assignment | None = None,
+    ) -> bool:
+        """
+        Una coppia (classe, materia) con meno tuple ammissibili delle ore
+        richieste (o, con `assignment`, un docente con meno tuple delle ore
+        assegnate) rende il modello infeasible: inutile costruirlo.
+        """
+        if assignment is not None and any(
+            len(idx.by_csp.get((c, s, p), [])) < hours
+            for (c, s), teachers in assignment.items()
+            for p, hours in teachers.items()
+        ):
+            return False
+        return all(
+            len(idx.by_cs.get((c, s), [])) >= int(required[c, s])
+            for c, s in idx.pairs
+        )
+
+    def _build_model(
+        self,
+        required: np.ndarray,
+        idx: SubjectVarIndex,
+        assignment: Assignment | None = None,
+    ) -> Tuple[pulp.LpProblem, Dict[tuple, pulp.LpVariable]]:
+        """Costruisce il modello PuLP di una settimana sull'indice sparso."""
         D = self.days
         H = self.daily_hours
-        C = self.num_classes
-        S = self.num_subjects
-        P = self.num_prof
 
         prob = pulp.LpProblem("SubjectWeeklyTimetable", pulp.LpMinimize)
 
-        # Variabili: x[d,h,c,s,p] ∈ {0,1}
-        x_idx = [(d, h, c, s, p) for d in range(D) for h in range(H) for c in range(C) for s in range(S) for p in range(P)]
-        x = pulp.LpVariable.dicts("x", x_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        # Variabili: x[d,h,c,s,p] ∈ {0,1} solo per le tuple ammissibili
+        x = pulp.LpVariable.dicts("x", idx.keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Aggregazioni per materia
-        z_idx = [(d, h, c, s) for d in range(D) for h in range(H) for c in range(C) for s in range(S)]
-        z = pulp.LpVariable.dicts("z", z_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        z = pulp.LpVariable.dicts("z", list(idx.by_dhcs), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Inizio segmento per materia
-        start_idx = [(d, h, c, s) for d in range(D) for h in range(H) for c in range(C) for s in range(S)]
-        start = pulp.LpVariable.dicts("start", start_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        start = pulp.LpVariable.dicts("start", list(idx.by_dhcs), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Day used per materia/classe
-        day_used_idx = [(d, c, s) for d in range(D) for c in range(C) for s in range(S)]
-        day_used = pulp.LpVariable.dicts("day_used", day_used_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        day_used = pulp.LpVariable.dicts("day_used", list(idx.by_dcs), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Prof working per slot
-        work_idx = [(d, h, p) for d in range(D) for h in range(H) for p in range(P)]
-        work = pulp.LpVariable.dicts("work", work_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        work = pulp.LpVariable.dicts("work", list(idx.by_dhp), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Segmenti prof
-        seg_idx = [(d, h, p) for d in range(D) for h in range(H) for p in range(P)]
-        seg_start = pulp.LpVariable.dicts("seg_start", seg_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        seg_start = pulp.LpVariable.dicts("seg_start", list(idx.by_dhp), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Prof utilizzato per materia/classe
-        t_used_idx = [(c, s, p) for c in range(C) for s in range(S) for p in range(P)]
-        t_used = pulp.LpVariable.dicts("t_used", t_used_idx, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        t_used = pulp.LpVariable.dicts("t_used", list(idx.by_csp), lowBound=0, upBound=1, cat=pulp.LpBinary)
 
         # Copertura ore materia/classe
-        for c in range(C):
-            for s in range(S):
-                required_hours = int(required[c, s])
-                if required_hours <= 0:
-                    # Nessun vincolo se non servono ore
-                    continue
-                vars_list = [
-                    x[(d, h, c, s, p)]
-                    for d in range(D)
-                    for h in range(H)
-                    for p in range(P)
-                ]
-                prob += (
-                    pulp.lpSum(vars_list) == required_hours,
-                    f"Hours_c{c}_s{s}",
-                )
+        for (c, s), keys in idx.by_cs.items():
+            prob += (
+                pulp.lpSum(x[k] for k in keys) == int(required[c, s]),
+                f"Hours_c{c}_s{s}",
+            )
 
         # Classe: 1 materia/prof per slot
-        for d in range(D):
-            for h in range(H):
-                for c in range(C):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, s, p)] for s in range(S) for p in range(P)) <= 1,
-                        f"ClassOne_d{d}_h{h}_c{c}",
-                    )
+        for (d, h, c), keys in idx.by_dhc.items():
+            if len(keys) > 1:
+                prob += (
+                    pulp.lpSum(x[k] for k in keys) <= 1,
+                    f"ClassOne_d{d}_h{h}_c{c}",
+                )
 
         # Prof: 1 classe/slot
-        for d in range(D):
-            for h in range(H):
-                for p in range(P):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, s, p)] for c in range(C) for s in range(S)) <= 1,
-                        f"ProfOne_d{d}_h{h}_p{p}",
-                    )
-
-        # Disponibilità prof
-        for p in range(P):
-            for d in range(D):
-                for h in range(H):
-                    if not self._is_available(p, d, h):
-                        for c in range(C):
-                            for s in range(S):
-                                prob += (x[(d, h, c, s, p)] == 0, f"Unavailable_d{d}_h{h}_c{c}_s{s}_p{p}")
-
-        # Mercoledì pomeriggio libero
-        if self.wed_free and D > 2:
-            wed = 2
-            for h in range(self.last_morning_hour, H):
-                for c in range(C):
-                    for s in range(S):
-                        for p in range(P):
-                            prob += (x[(wed, h, c, s, p)] == 0, f"WedFree_d{wed}_h{h}_c{c}_s{s}_p{p}")
+        for (d, h, p), keys in idx.by_dhp.items():
+            if len(keys) > 1:
+                prob += (
+                    pulp.lpSum(x[k] for k in keys) <= 1,
+                    f"ProfOne_d{d}_h{h}_p{p}",
+                )
 
         # Capacità prof per materia (non superare ore dichiarate)
         caps = self.ctx.prof_subject_caps
-        for p in range(P):
-            for s in range(S):
-                cap = int(caps[p, s])
-                if cap <= 0:
-                    for d in range(D):
-                        for h in range(H):
-                            for c in range(C):
-                                prob += (x[(d, h, c, s, p)] == 0, f"NoCap_p{p}_s{s}_d{d}_h{h}_c{c}")
-                else:
+        for (p, s), keys in idx.by_ps.items():
+            cap = int(caps[p, s])
+            if len(keys) > cap:
+                prob += (
+                    pulp.lpSum(x[k] for k in keys) <= cap,
+                    f"Cap_p{p}_s{s}",
+                )
+
+        # Ore fissate per docente (two_stage, coppie con più docenti assegnati)
+        if assignment is not None:
+            for (c, s, p), keys in idx.by_csp.items():
+                if len(assignment[(c, s)]) > 1:
                     prob += (
-                        pulp.lpSum(x[(d, h, c, s, p)] for d in range(D) for h in range(H) for c in range(C)) <= cap,
-                        f"Cap_p{p}_s{s}",
+                        pulp.lpSum(x[k] for k in keys) == assignment[(c, s)][p],
+                        f"Assign_c{c}_s{s}_p{p}",
                     )
 
         # Limite giornaliero materia/classe
-        for d in range(D):
-            for c in range(C):
-                for s in range(S):
-                    max_day = int(self.ctx.subject_daily_max[s, c])
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, s, p)] for h in range(H) for p in range(P)) <= max_day,
-                        f"DailyMax_d{d}_c{c}_s{s}",
-                    )
+        for (d, c, s), keys in idx.by_dcs.items():
+            max_day = int(self.ctx.subject_daily_max[s, c])
+            prob += (
+                pulp.lpSum(x[k] for k in keys) <= max_day,
+                f"DailyMax_d{d}_c{c}_s{s}",
+            )
 
         # Collega z a x
-        for d in range(D):
-            for h in range(H):
-                for c in range(C):
-                    for s in range(S):
-                        prob += (
-                            pulp.lpSum(x[(d, h, c, s, p)] for p in range(P)) - z[(d, h, c, s)] == 0,
-                            f"Def_z_d{d}_h{h}_c{c}_s{s}",
-                        )
-
-        # Materia: un solo segmento per giorno (niente slot separati)
-        for d in range(D):
-            for c in range(C):
-                for s in range(S):
-                    # h = 0
-                    prob += (start[(d, 0, c, s)] >= z[(d, 0, c, s)], f"Start0_d{d}_c{c}_s{s}")
-                    prob += (start[(d, 0, c, s)] <= z[(d, 0, c, s)], f"Start0Upper_d{d}_c{c}_s{s}")
-                    for h in range(1, H):
-                        prob += (
-                            start[(d, h, c, s)] >= z[(d, h, c, s)] - z[(d, h - 1, c, s)],
-                            f"Start_d{d}_h{h}_c{c}_s{s}",
-                        )
-                        prob += (
-                            start[(d, h, c, s)] <= z[(d, h, c, s)],
-                            f"StartUpper_d{d}_h{h}_c{c}_s{s}",
-                        )
-                    prob += (
-                        pulp.lpSum(start[(d, h, c, s)] for h in range(H)) <= 1,
-                        f"SingleSegment_d{d}_c{c}_s{s}",
-                    )
+        for (d, h, c, s), keys in idx.by_dhcs.items():
+            prob += (
+                pulp.lpSum(x[k] for k in keys) - z[(d, h, c, s)] == 0,
+                f"Def_z_d{d}_h{h}_c{c}_s{s}",
+            )
 
-        # Giorni utilizzati per materia/classe
-        for d in range(D):
-            for c in range(C):
-                for s in range(S):
-                    prob += (
-                        day_used[(d, c, s)] >= pulp.lpSum(z[(d, h, c, s)] for h in range(H)) * (1.0 / max(1, H)),
-                        f"DayUsedLower_d{d}_c{c}_s{s}",
-                    )
+        # Materia: un solo segmento per giorno (niente slot separati).
+        # Se z[d,h-1,c,s] non esiste vale 0 e il vincolo inferiore si riduce a start >= z.
+        for (d, c, s), hours in idx.hours_by_dcs.items():
+            for h in hours:
+                prev = z.get((d, h - 1, c, s)) if h > 0 else None
+                if prev is None:
+                    prob += (start[(d, h, c, s)] >= z[(d, h, c, s)], f"Start_d{d}_h{h}_c{c}_s{s}")
+                else:
                     prob += (
-                        day_used[(d, c, s)] <= pulp.lpSum(z[(d, h, c, s)] for h in range(H)),
-                        f"DayUsedUpper_d{d}_c{c}_s{s}",
+                        start[(d, h, c, s)] >= z[(d, h, c, s)] - prev,
+                        f"Start_d{d}_h{h}_c{c}_s{s}",
                     )
+                prob += (
+                    start[(d, h, c, s)] <= z[(d, h, c, s)],
+                    f"StartUpper_d{d}_h{h}_c{c}_s{s}",
+                )
+            prob += (
+                pulp.lpSum(start[(d, h, c, s)] for h in hours) <= 1,
+                f"SingleSegment_d{d}_c{c}_s{s}",
+            )
+
+            # Giorni utilizzati per materia/classe
+            prob += (
+                day_used[(d, c, s)] >= pulp.lpSum(z[(d, h, c, s)] for h in hours) * (1.0 / max(1, H)),
+                f"DayUsedLower_d{d}_c{c}_s{s}",
+            )
+            prob += (
+                day_used[(d, c, s)] <= pulp.lpSum(z[(d, h, c, s)] for h in hours),
+                f"DayUsedUpper_d{d}_c{c}_s{s}",
+            )
 
         # Prof usato per materia/classe
-        for c in range(C):
-            for s in range(S):
-                for p in range(P):
-                    prob += (
-                        t_used[(c, s, p)] >= pulp.lpSum(x[(d, h, c, s, p)] for d in range(D) for h in range(H)) * (1.0 / max(1, H * D)),
-                        f"TUsedLower_c{c}_s{s}_p{p}",
-                    )
-                    prob += (
-                        t_used[(c, s, p)] <= pulp.lpSum(x[(d, h, c, s, p)] for d in range(D) for h in range(H)),
-                        f"TUsedUpper_c{c}_s{s}_p{p}",
-                    )
+        for (c, s, p), keys in idx.by_csp.items():
+            prob += (
+                t_used[(c, s, p)] >= pulp.lpSum(x[k] for k in keys) * (1.0 / max(1, H * D)),
+                f"TUsedLower_c{c}_s{s}_p{p}",
+            )
+            prob += (
+                t_used[(c, s, p)] <= pulp.lpSum(x[k] for k in keys),
+                f"TUsedUpper_c{c}_s{s}_p{p}",
+            )
 
-                if self.ctx.single_teacher_rule:
+        if self.ctx.single_teacher_rule:
+            for (c, s), profs in idx.profs_by_cs.items():
+                if len(profs) > 1:
                     prob += (
-                        pulp.lpSum(t_used[(c, s, p)] for p in range(P)) <= 1,
+                        pulp.lpSum(t_used[(c, s, p)] for p in profs) <= 1,
                         f"SingleTeacher_c{c}_s{s}",
                     )
 
         # Prof work + segmenti per buche
-        for d in range(D):
-            for h in range(H):
-                for p in range(P):
-                    prob += (
-                        pulp.lpSum(x[(d, h, c, s, p)] for c in range(C) for s in range(S)) - work[(d, h, p)] == 0,
-                        f"DefWork_d{d}_h{h}_p{p}",
-                    )
+        for (d, h, p), keys in idx.by_dhp.items():
+            prob += (
+                pulp.lpSum(x[k] for k in keys) - work[(d, h, p)] == 0,
+                f"DefWork_d{d}_h{h}_p{p}",
+            )
 
-        for d in range(D):
-            for p in range(P):
-                prob += (seg_start[(d, 0, p)] >= work[(d, 0, p)], f"Seg0Lower_d{d}_p{p}")
-                prob += (seg_start[(d, 0, p)] <= work[(d, 0, p)], f"Seg0Upper_d{d}_p{p}")
-                for h in range(1, H):
-                    prob += (
-                        seg_start[(d, h, p)] >= work[(d, h, p)] - work[(d, h - 1, p)],
-                        f"Seg_d{d}_h{h}_p{p}",
-                    )
-                    prob += (
-                        seg_start[(d, h, p)] <= work[(d, h, p)],
-                        f"SegUpper_d{d}_h{h}_p{p}",
-                    )
+        for (d, h, p) in idx.by_dhp:
+            prev = work.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
+                prob += (seg_start[(d, h, p)] >= work[(d, h, p)], f"Seg_d{d}_h{h}_p{p}")
+            else:
+                prob += (
+                    seg_start[(d, h, p)] >= work[(d, h, p)] - prev,
+                    f"Seg_d{d}_h{h}_p{p}",
+                )
+            prob += (
+                seg_start[(d, h, p)] <= work[(d, h, p)],
+                f"SegUpper_d{d}_h{h}_p{p}",
+            )
 
         # Nessun blocco che attraversi pausa pranzo
         L = self.last_morning_hour
         if 0 < L < H:
-            for d in range(D):
-                for c in range(C):
-                    for s in range(S):
-                        for p in range(P):
-                            prob += (
-                                x[(d, L - 1, c, s, p)] + x[(d, L, c, s, p)] <= 1,
-                                f"NoCrossLunch_d{d}_c{c}_s{s}_p{p}",
-                            )
+            for (d, h, c, s, p) in idx.keys:
+                if h != L - 1 or (d, L, c, s, p) not in x:
+                    continue
+                prob += (
+                    x[(d, L - 1, c, s, p)] + x[(d, L, c, s, p)] <= 1,
+                    f"NoCrossLunch_d{d}_c{c}_s{s}_p{p}",
+                )
 
         # Obiettivo
         w_gap = 10.0
@@ -456,30 +686,18 @@ class SubjectMIPPlanner:
         w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
         w_last_hour = 0.2
 
-        gap_terms = [seg_start[(d, h, p)] for d in range(D) for h in range(H) for p in range(P)]
-        day_terms = [day_used[(d, c, s)] for d in range(D) for c in range(C) for s in range(S)]
+        gap_terms = list(seg_start.values())
+        day_terms = list(day_used.values())
 
         # Penalità per non preferenze
-        pref_penalties = []
         prefs = self.ctx.preferences
-        any_pref = prefs.any()
-        for d in range(D):
-            for h in range(H):
-                for c in range(C):
-                    for s in range(S):
-                        for p in range(P):
-                            if any_pref and not prefs[p, c]:
-                                pref_penalties.append(x[(d, h, c, s, p)])
-
-        last_terms = [
-            x[(d, H - 1, c, s, p)]
-            for d in range(D)
-            for c in range(C)
-            for s in range(S)
-            for p in range(P)
-        ]
+        pref_penalties = []
+        if prefs.any():
+            pref_penalties = [x[k] for k in idx.keys if not prefs[k[4], k[2]]]
+
+        last_terms = [x[k] for k in idx.keys if k[1] == H - 1]
 
-        multi_teacher_terms = [t_used[(c, s, p)] for c in range(C) for s in range(S) for p in range(P)]
+        multi_teacher_terms = list(t_used.values())
 
         prob += (
             w_gap * pulp.lpSum(gap_terms)
@@ -490,34 +708,1424 @@ class SubjectMIPPlanner:
             "Objective",
         )
 
-        solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit_sec) if time_limit_sec else pulp.PULP_CBC_CMD(msg=False)
-        prob.solve(solver)
+        return prob, x
 
-        status = pulp.LpStatus[prob.status]
-        if status not in ("Optimal", "Feasible"):
-            return None, None, float("inf")
-
-        Pmat = np.zeros((D, H, C), dtype=int)
-        Smat = np.zeros((D, H, C), dtype=int)
-        for d in range(D):
-            for h in range(H):
-                for c in range(C):
-                    prof_found = 0
-                    subj_found = 0
-                    for s in range(S):
-                        for p in range(P):
-                            val = pulp.value(x[(d, h, c, s, p)])
-                            if val is not None and val > 0.5:
-                                prof_found = p + 1
-                                subj_found = s + 1
+    def _build_matrix_model(
+        self,
+        required: np.ndarray,
+        idx: SubjectVarIndex,
+        assignment: Assignment | None = None,
+    ) -> Tuple[MatrixModel, Dict[tuple, int]]:
+        """
+        Stesso modello di `_build_model`, assemblato direttamente per array
+        con `MatrixModel` (niente oggetti espressione PuLP). Righe, colonne,
+        coefficienti e nomi (con names=True) coincidono con la versione PuLP.
+        """
+        D = self.days
+        H = self.daily_hours
+
+        model = MatrixModel(name="SubjectWeeklyTimetable")
+        x = model.add_vars("x", idx.keys)
+        z = model.add_vars("z", list(idx.by_dhcs))
+        start = model.add_vars("start", list(idx.by_dhcs))
+        day_used = model.add_vars("day_used", list(idx.by_dcs))
+        work = model.add_vars("work", list(idx.by_dhp))
+        seg_start = model.add_vars("seg_start", list(idx.by_dhp))
+        t_used = model.add_vars("t_used", list(idx.by_csp))
+
+        # Copertura ore materia/classe
+        for (c, s), keys in idx.by_cs.items():
+            model.add_row([x[k] for k in keys], 1.0, "==", int(required[c, s]), ("Hours_c{}_s{}", (c, s)))
+
+        # Classe: 1 materia/prof per slot
+        for (d, h, c), keys in idx.by_dhc.items():
+            if len(keys) > 1:
+                model.add_row([x[k] for k in keys], 1.0, "<=", 1, ("ClassOne_d{}_h{}_c{}", (d, h, c)))
+
+        # Prof: 1 classe/slot
+        for (d, h, p), keys in idx.by_dhp.items():
+            if len(keys) > 1:
+                model.add_row([x[k] for k in keys], 1.0, "<=", 1, ("ProfOne_d{}_h{}_p{}", (d, h, p)))
+
+        # Capacità prof per materia
+        caps = self.ctx.prof_subject_caps
+        for (p, s), keys in idx.by_ps.items():
+            cap = int(caps[p, s])
+            if len(keys) > cap:
+                model.add_row([x[k] for k in keys], 1.0, "<=", cap, ("Cap_p{}_s{}", (p, s)))
+
+        # Ore fissate per docente
+        if assignment is not None:
+            for (c, s, p), keys in idx.by_csp.items():
+                if len(assignment[(c, s)]) > 1:
+                    model.add_row(
+                        [x[k] for k in keys], 1.0, "==", assignment[(c, s)][p], ("Assign_c{}_s{}_p{}", (c, s, p))
+                    )
+
+        # Limite giornaliero materia/classe
+        for (d, c, s), keys in idx.by_dcs.items():
+            max_day = int(self.ctx.subject_daily_max[s, c])
+            model.add_row([x[k] for k in keys], 1.0, "<=", max_day, ("DailyMax_d{}_c{}_s{}", (d, c, s)))
+
+        # Collega z a x
+        for (d, h, c, s), keys in idx.by_dhcs.items():
+            model.add_row(
+                [x[k] for k in keys] + [z[(d, h, c, s)]],
+                [1.0] * len(keys) + [-1.0],
+                "==",
+                0,
+                ("Def_z_d{}_h{}_c{}_s{}", (d, h, c, s)),
+            )
+
+        # Un solo segmento per giorno + giorni utilizzati
+        inv_h = 1.0 / max(1, H)
+        for (d, c, s), hours in idx.hours_by_dcs.items():
+            for h in hours:
+                key = (d, h, c, s)
+                prev = z.get((d, h - 1, c, s)) if h > 0 else None
+                if prev is None:
+                    model.add_row([start[key], z[key]], [1.0, -1.0], ">=", 0, ("Start_d{}_h{}_c{}_s{}", key))
+                else:
+                    model.add_row([start[key], z[key], prev], [1.0, -1.0, 1.0], ">=", 0, ("Start_d{}_h{}_c{}_s{}", key))
+                model.add_row([start[key], z[key]], [1.0, -1.0], "<=", 0, ("StartUpper_d{}_h{}_c{}_s{}", key))
+            model.add_row([start[(d, h, c, s)] for h in hours], 1.0, "<=", 1, ("SingleSegment_d{}_c{}_s{}", (d, c, s)))
+
+            z_cols = [z[(d, h, c, s)] for h in hours]
+            model.add_row(
+                [day_used[(d, c, s)]] + z_cols,
+                [1.0] + [-inv_h] * len(z_cols),
+                ">=",
+                0,
+                ("DayUsedLower_d{}_c{}_s{}", (d, c, s)),
+            )
+            model.add_row(
+                [day_used[(d, c, s)]] + z_cols,
+                [1.0] + [-1.0] * len(z_cols),
+                "<=",
+                0,
+                ("DayUsedUpper_d{}_c{}_s{}", (d, c, s)),
+            )
+
+        # Prof usato per materia/classe
+        inv_dh = 1.0 / max(1, H * D)
+        for (c, s, p), keys in idx.by_csp.items():
+            x_cols = [x[k] for k in keys]
+            model.add_row(
+                [t_used[(c, s, p)]] + x_cols,
+                [1.0] + [-inv_dh] * len(x_cols),
+                ">=",
+                0,
+                ("TUsedLower_c{}_s{}_p{}", (c, s, p)),
+            )
+            model.add_row(
+                [t_used[(c, s, p)]] + x_cols,
+                [1.0] + [-1.0] * len(x_cols),
+                "<=",
+                0,
+                ("TUsedUpper_c{}_s{}_p{}", (c, s, p)),
+            )
+
+        if self.ctx.single_teacher_rule:
+            for (c, s), profs in idx.profs_by_cs.items():
+                if len(profs) > 1:
+                    model.add_row(
+                        [t_used[(c, s, p)] for p in profs], 1.0, "<=", 1, ("SingleTeacher_c{}_s{}", (c, s))
+                    )
+
+        # Prof work + segmenti per buche
+        for (d, h, p), keys in idx.by_dhp.items():
+            model.add_row(
+                [x[k] for k in keys] + [work[(d, h, p)]],
+                [1.0] * len(keys) + [-1.0],
+                "==",
+                0,
+                ("DefWork_d{}_h{}_p{}", (d, h, p)),
+            )
+
+        for (d, h, p) in idx.by_dhp:
+            key = (d, h, p)
+            prev = work.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
+                model.add_row([seg_start[key], work[key]], [1.0, -1.0], ">=", 0, ("Seg_d{}_h{}_p{}", key))
+            else:
+                model.add_row([seg_start[key], work[key], prev], [1.0, -1.0, 1.0], ">=", 0, ("Seg_d{}_h{}_p{}", key))
+            model.add_row([seg_start[key], work[key]], [1.0, -1.0], "<=", 0, ("SegUpper_d{}_h{}_p{}", key))
+
+        # Nessun blocco che attraversi pausa pranzo
+        L = self.last_morning_hour
+        if 0 < L < H:
+            for (d, h, c, s, p) in idx.keys:
+                if h != L - 1 or (d, L, c, s, p) not in x:
+                    continue
+                model.add_row(
+                    [x[(d, L - 1, c, s, p)], x[(d, L, c, s, p)]],
+                    1.0,
+                    "<=",
+                    1,
+                    ("NoCrossLunch_d{}_c{}_s{}_p{}", (d, c, s, p)),
+                )
+
+        # Obiettivo
+        w_gap = 10.0
+        w_day_spread = 4.0 if self.ctx.aggregate_hours_rule else 0.0
+        w_nonpref = 1.0
+        w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
+        w_last_hour = 0.2
+
+        model.add_objective(seg_start.values(), w_gap)
+        if w_day_spread:
+            model.add_objective(day_used.values(), w_day_spread)
+        prefs = self.ctx.preferences
+        if prefs.any():
+            model.add_objective((x[k] for k in idx.keys if not prefs[k[4], k[2]]), w_nonpref)
+        model.add_objective(t_used.values(), w_multi_teacher)
+        model.add_objective((x[k] for k in idx.keys if k[1] == H - 1), w_last_hour)
+
+        return model, x
+
+    def _plans_from_values(
+        self,
+        idx: SubjectVarIndex,
+        values: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Costruisce Pmat (prof 1-based) e Smat (materia 1-based) dai valori di
+        x allineati a `idx.keys`, con uno scatter sulle tuple attive.
+        """
+        shape = (self.days, self.daily_hours, self.num_classes)
+        Pmat = np.zeros(shape, dtype=int)
+        Smat = np.zeros(shape, dtype=int)
+        on = active_keys(key_array(idx.keys, 5), values)
+        Pmat[on[:, 0], on[:, 1], on[:, 2]] = on[:, 4] + 1
+        Smat[on[:, 0], on[:, 1], on[:, 2]] = on[:, 3] + 1
+        return Pmat, Smat
+
+    def _warm_start_assignment(
+        self,
+        idx: SubjectVarIndex,
+        plan: np.ndarray,
+        subject_plan: np.ndarray,
+    ) -> Dict[str, Dict[tuple, float]]:
+        """
+        Converte (plan, subject_plan) di una settimana in una soluzione di
+        partenza completa: x, z, start, day_used, work, seg_start, t_used.
+        Le celle che non corrispondono a tuple ammissibili vengono ignorate:
+        CBC scarta da solo una partenza non ammissibile.
+        """
+        keyset = set(idx.keys)
+        x_on: Dict[tuple, float] = {}
+        for d, h, c in zip(*np.nonzero(plan)):
+            key = (int(d), int(h), int(c), int(subject_plan[d, h, c]) - 1, int(plan[d, h, c]) - 1)
+            if key in keyset:
+                x_on[key] = 1.0
+
+        z_on = {(d, h, c, s): 1.0 for (d, h, c, s, p) in x_on}
+        # work dalle liste dell'indice: con joint_weeks una lezione comune occupa lo slot in ogni settimana
+        work_on = {key: 1.0 for key, keys in idx.by_dhp.items() if any(k in x_on for k in keys)}
+        return {
+            "x": x_on,
+            "z": z_on,
+            "start": {(d, h, c, s): 1.0 for (d, h, c, s) in z_on if (d, h - 1, c, s) not in z_on},
+            "day_used": {(d, c, s): 1.0 for (d, h, c, s) in z_on},
+            "work": work_on,
+            "seg_start": {(d, h, p): 1.0 for (d, h, p) in work_on if (d, h - 1, p) not in work_on},
+            "t_used": {(c, s, p): 1.0 for (d, h, c, s, p) in x_on},
+        }
+
+    # ------------------------------------------------------------------
+    # Formulazione a blocchi
+    # ------------------------------------------------------------------
+
+    def _build_block_index(
+        self,
+        required: np.ndarray,
+        assignment: Assignment | None = None,
+        days: Sequence[int] | None = None,
+    ) -> SubjectBlockIndex:
+        """
+        Enumera i blocchi (c, s, p, d, inizio, durata) ammissibili:
+          - durata al più min(ore richieste, massimo giornaliero, ore del
+            docente: prof_subject_caps o, con `assignment`, ore assegnate)
+          - tutte le ore del blocco libere per il docente e non bloccate
+          - il blocco non attraversa la pausa pranzo
+        Poi scarta i blocchi dominati: se una coppia ha r ore, massimo
+        giornaliero m e blocchi in n giorni, un blocco più corto di
+        r - (n - 1) * m lascia ore che non stanno negli altri giorni (con
+        `assignment` lo stesso vale per le ore di ciascun docente).
+        """
+        H = self.daily_hours
+        L = self.last_morning_hour
+        caps = self.ctx.prof_subject_caps
+        day_list = list(range(self.days) if days is None else days)
+        usable = np.array([
+            [[self._is_available(p, d, h) and not self._is_blocked_slot(d, h) for h in range(H)] for d in range(self.days)]
+            for p in range(self.num_prof)
+        ], dtype=bool).reshape(self.num_prof, self.days, H)
+
+        pairs = [
+            (c, s)
+            for c in range(self.num_classes)
+            for s in range(self.num_subjects)
+            if int(required[c, s]) > 0
+        ]
+        idx = SubjectBlockIndex(pairs=pairs)
+        for c, s in pairs:
+            hours = int(required[c, s])
+            daily_max = int(self.ctx.subject_daily_max[s, c])
+            if assignment is not None:
+                teachers = {p: n for p, n in sorted(assignment.get((c, s), {}).items())}
+            else:
+                teachers = {p: int(caps[p, s]) for p in range(self.num_prof) if int(caps[p, s]) > 0}
+
+            candidates: Dict[int, List[tuple]] = {}
+            for p, teacher_hours in teachers.items():
+                max_len = min(hours, daily_max, teacher_hours, H)
+                for d in day_list:
+                    for start in range(H):
+                        for length in range(1, max_len + 1):
+                            end = start + length
+                            if end > H or not usable[p, d, end - 1]:
+                                break
+                            if 0 < L < H and start < L < end:
                                 break
-                        if prof_found:
-                            break
-                    Pmat[d, h, c] = prof_found
-                    Smat[d, h, c] = subj_found
+                            if usable[p, d, start:end].all():
+                                candidates.setdefault(p, []).append((c, s, p, d, start, length))
+
+            pair_days = {k[3] for blocks in candidates.values() for k in blocks}
+            min_len = hours - (len(pair_days) - 1) * daily_max
+            for p, blocks in candidates.items():
+                floor = min_len
+                if assignment is not None:
+                    floor = teachers[p] - (len({k[3] for k in blocks}) - 1) * daily_max
+                for key in blocks:
+                    if key[5] >= floor:
+                        idx.add(key)
+        return idx
+
+    def _block_index_is_feasible(
+        self,
+        required: np.ndarray,
+        idx: SubjectBlockIndex,
+        assignment: Assignment | None = None,
+    ) -> bool:
+        """
+        Controllo rapido prima di costruire il modello: ogni coppia (e, con
+        `assignment`, ogni docente assegnato) deve avere blocchi la cui
+        durata massima per giorno copra le ore richieste.
+        """
+        def coverable(blocks: List[tuple], hours: int) -> bool:
+            longest: Dict[int, int] = {}
+            for key in blocks:
+                longest[key[3]] = max(longest.get(key[3], 0), key[5])
+            return sum(longest.values()) >= hours
+
+        if assignment is not None and any(
+            not coverable(idx.by_csp.get((c, s, p), []), hours)
+            for (c, s), teachers in assignment.items()
+            for p, hours in teachers.items()
+        ):
+            return False
+        return all(coverable(idx.by_cs.get((c, s), []), int(required[c, s])) for c, s in idx.pairs)
+
+    def _block_objective_weights(self, idx: SubjectBlockIndex) -> Dict[tuple, float]:
+        """
+        Costo di ogni blocco, con gli stessi pesi del modello orario: giorno
+        usato dalla materia, ore fuori preferenza, ultima ora della giornata.
+        """
+        H = self.daily_hours
+        w_day_spread = 4.0 if self.ctx.aggregate_hours_rule else 0.0
+        w_nonpref = 1.0
+        w_last_hour = 0.2
+        prefs = self.ctx.preferences
+        check_prefs = bool(prefs.any())
+        weights = {}
+        for key in idx.keys:
+            c, s, p, d, start, length = key
+            cost = w_day_spread
+            if check_prefs and not prefs[p, c]:
+                cost += w_nonpref * length
+            if start + length == H:
+                cost += w_last_hour
+            weights[key] = cost
+        return weights
+
+    def _build_block_model(
+        self,
+        required: np.ndarray,
+        idx: SubjectBlockIndex,
+        assignment: Assignment | None = None,
+    ) -> Tuple[pulp.LpProblem, Dict[tuple, pulp.LpVariable]]:
+        """
+        Modello PuLP a blocchi di una settimana. Contiguità, massimo
+        giornaliero e pausa pranzo sono già nell'indice: restano copertura
+        delle ore, un blocco per materia al giorno, conflitti di classe e
+        docente slot per slot, capacità e le variabili per le buche dei
+        docenti (work/seg_start) e per i docenti usati (t_used).
+        """
+        D = self.days
+
+        prob = pulp.LpProblem("SubjectWeeklyBlocks", pulp.LpMinimize)
+        y = pulp.LpVariable.dicts("y", idx.keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        work = pulp.LpVariable.dicts("work", list(idx.cover_dhp), lowBound=0, upBound=1, cat=pulp.LpBinary)
+        seg_start = pulp.LpVariable.dicts("seg_start", list(idx.cover_dhp), lowBound=0, upBound=1, cat=pulp.LpBinary)
+        t_used = pulp.LpVariable.dicts("t_used", list(idx.by_csp), lowBound=0, upBound=1, cat=pulp.LpBinary)
+
+        # Copertura ore materia/classe
+        for (c, s), keys in idx.by_cs.items():
+            prob += (pulp.lpSum(k[5] * y[k] for k in keys) == int(required[c, s]), f"Hours_c{c}_s{s}")
+
+        # Al più un blocco per materia/classe al giorno
+        for (d, c, s), keys in idx.by_dcs.items():
+            if len(keys) > 1:
+                prob += (pulp.lpSum(y[k] for k in keys) <= 1, f"OneBlock_d{d}_c{c}_s{s}")
+
+        # Classe: 1 blocco per slot
+        for (d, h, c), keys in idx.cover_dhc.items():
+            if len(keys) > 1:
+                prob += (pulp.lpSum(y[k] for k in keys) <= 1, f"ClassOne_d{d}_h{h}_c{c}")
+
+        # Prof: work = blocchi che coprono lo slot (work ≤ 1 vale anche come ProfOne)
+        for (d, h, p), keys in idx.cover_dhp.items():
+            prob += (pulp.lpSum(y[k] for k in keys) - work[(d, h, p)] == 0, f"DefWork_d{d}_h{h}_p{p}")
+
+        # Capacità prof per materia
+        caps = self.ctx.prof_subject_caps
+        for (p, s), keys in idx.by_ps.items():
+            cap = int(caps[p, s])
+            if sum(k[5] for k in keys) > cap:
+                prob += (pulp.lpSum(k[5] * y[k] for k in keys) <= cap, f"Cap_p{p}_s{s}")
+
+        # Ore fissate per docente
+        if assignment is not None:
+            for (c, s, p), keys in idx.by_csp.items():
+                if len(assignment[(c, s)]) > 1:
+                    prob += (
+                        pulp.lpSum(k[5] * y[k] for k in keys) == assignment[(c, s)][p],
+                        f"Assign_c{c}_s{s}_p{p}",
+                    )
+
+        # Prof usato per materia/classe (al più un blocco al giorno)
+        for (c, s, p), keys in idx.by_csp.items():
+            prob += (
+                t_used[(c, s, p)] >= pulp.lpSum(y[k] for k in keys) * (1.0 / max(1, D)),
+                f"TUsedLower_c{c}_s{s}_p{p}",
+            )
+            prob += (t_used[(c, s, p)] <= pulp.lpSum(y[k] for k in keys), f"TUsedUpper_c{c}_s{s}_p{p}")
+
+        if self.ctx.single_teacher_rule:
+            for (c, s), profs in idx.profs_by_cs.items():
+                if len(profs) > 1:
+                    prob += (pulp.lpSum(t_used[(c, s, p)] for p in profs) <= 1, f"SingleTeacher_c{c}_s{s}")
+
+        # Segmenti prof per buche
+        for (d, h, p) in idx.cover_dhp:
+            prev = work.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
+                prob += (seg_start[(d, h, p)] >= work[(d, h, p)], f"Seg_d{d}_h{h}_p{p}")
+            else:
+                prob += (seg_start[(d, h, p)] >= work[(d, h, p)] - prev, f"Seg_d{d}_h{h}_p{p}")
+            prob += (seg_start[(d, h, p)] <= work[(d, h, p)], f"SegUpper_d{d}_h{h}_p{p}")
+
+        # Obiettivo
+        w_gap = 10.0
+        w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
+        weights = self._block_objective_weights(idx)
+        prob += (
+            w_gap * pulp.lpSum(seg_start.values())
+            + pulp.lpSum(w * y[k] for k, w in weights.items() if w)
+            + w_multi_teacher * pulp.lpSum(t_used.values()),
+            "Objective",
+        )
+        return prob, y
+
+    def _build_block_matrix_model(
+        self,
+        required: np.ndarray,
+        idx: SubjectBlockIndex,
+        assignment: Assignment | None = None,
+    ) -> Tuple[MatrixModel, Dict[tuple, int]]:
+        """Stesso modello di `_build_block_model`, assemblato con `MatrixModel`."""
+        D = self.days
+
+        model = MatrixModel(name="SubjectWeeklyBlocks")
+        y = model.add_vars("y", idx.keys)
+        work = model.add_vars("work", list(idx.cover_dhp))
+        seg_start = model.add_vars("seg_start", list(idx.cover_dhp))
+        t_used = model.add_vars("t_used", list(idx.by_csp))
+
+        # Copertura ore materia/classe
+        for (c, s), keys in idx.by_cs.items():
+            model.add_row(
+                [y[k] for k in keys], [float(k[5]) for k in keys], "==", int(required[c, s]), ("Hours_c{}_s{}", (c, s))
+            )
+
+        # Al più un blocco per materia/classe al giorno
+        for (d, c, s), keys in idx.by_dcs.items():
+            if len(keys) > 1:
+                model.add_row([y[k] for k in keys], 1.0, "<=", 1, ("OneBlock_d{}_c{}_s{}", (d, c, s)))
+
+        # Classe: 1 blocco per slot
+        for (d, h, c), keys in idx.cover_dhc.items():
+            if len(keys) > 1:
+                model.add_row([y[k] for k in keys], 1.0, "<=", 1, ("ClassOne_d{}_h{}_c{}", (d, h, c)))
+
+        # Prof: work = blocchi che coprono lo slot
+        for (d, h, p), keys in idx.cover_dhp.items():
+            model.add_row(
+                [y[k] for k in keys] + [work[(d, h, p)]],
+                [1.0] * len(keys) + [-1.0],
+                "==",
+                0,
+                ("DefWork_d{}_h{}_p{}", (d, h, p)),
+            )
+
+        # Capacità prof per materia
+        caps = self.ctx.prof_subject_caps
+        for (p, s), keys in idx.by_ps.items():
+            cap = int(caps[p, s])
+            if sum(k[5] for k in keys) > cap:
+                model.add_row([y[k] for k in keys], [float(k[5]) for k in keys], "<=", cap, ("Cap_p{}_s{}", (p, s)))
+
+        # Ore fissate per docente
+        if assignment is not None:
+            for (c, s, p), keys in idx.by_csp.items():
+                if len(assignment[(c, s)]) > 1:
+                    model.add_row(
+                        [y[k] for k in keys],
+                        [float(k[5]) for k in keys],
+                        "==",
+                        assignment[(c, s)][p],
+                        ("Assign_c{}_s{}_p{}", (c, s, p)),
+                    )
+
+        # Prof usato per materia/classe
+        inv_d = 1.0 / max(1, D)
+        for (c, s, p), keys in idx.by_csp.items():
+            y_cols = [y[k] for k in keys]
+            model.add_row(
+                [t_used[(c, s, p)]] + y_cols,
+                [1.0] + [-inv_d] * len(y_cols),
+                ">=",
+                0,
+                ("TUsedLower_c{}_s{}_p{}", (c, s, p)),
+            )
+            model.add_row(
+                [t_used[(c, s, p)]] + y_cols,
+                [1.0] + [-1.0] * len(y_cols),
+                "<=",
+                0,
+                ("TUsedUpper_c{}_s{}_p{}", (c, s, p)),
+            )
+
+        if self.ctx.single_teacher_rule:
+            for (c, s), profs in idx.profs_by_cs.items():
+                if len(profs) > 1:
+                    model.add_row(
+                        [t_used[(c, s, p)] for p in profs], 1.0, "<=", 1, ("SingleTeacher_c{}_s{}", (c, s))
+                    )
+
+        # Segmenti prof per buche
+        for (d, h, p) in idx.cover_dhp:
+            key = (d, h, p)
+            prev = work.get((d, h - 1, p)) if h > 0 else None
+            if prev is None:
+                model.add_row([seg_start[key], work[key]], [1.0, -1.0], ">=", 0, ("Seg_d{}_h{}_p{}", key))
+            else:
+                model.add_row([seg_start[key], work[key], prev], [1.0, -1.0, 1.0], ">=", 0, ("Seg_d{}_h{}_p{}", key))
+            model.add_row([seg_start[key], work[key]], [1.0, -1.0], "<=", 0, ("SegUpper_d{}_h{}_p{}", key))
+
+        # Obiettivo
+        w_gap = 10.0
+        w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
+        model.add_objective(seg_start.values(), w_gap)
+        for key, w in self._block_objective_weights(idx).items():
+            if w:
+                model.add_objective([y[key]], w)
+        model.add_objective(t_used.values(), w_multi_teacher)
+        return model, y
+
+    def _plans_from_blocks(
+        self,
+        idx: SubjectBlockIndex,
+        values: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Pmat e Smat (1-based) dai valori di y allineati a `idx.keys`, espandendo ogni blocco attivo."""
+        shape = (self.days, self.daily_hours, self.num_classes)
+        Pmat = np.zeros(shape, dtype=int)
+        Smat = np.zeros(shape, dtype=int)
+        for c, s, p, d, start, length in active_keys(key_array(idx.keys, 6), values):
+            Pmat[d, start:start + length, c] = p + 1
+            Smat[d, start:start + length, c] = s + 1
+        return Pmat, Smat
+
+    def _warm_start_blocks(
+        self,
+        idx: SubjectBlockIndex,
+        plan: np.ndarray,
+        subject_plan: np.ndarray,
+    ) -> Dict[str, Dict[tuple, float]]:
+        """
+        Soluzione di partenza per il modello a blocchi: ogni tratto contiguo
+        con stessa materia e stesso docente diventa un blocco, se è tra
+        quelli dell'indice; work, seg_start e t_used seguono dai blocchi.
+        """
+        keyset = set(idx.keys)
+        y_on: Dict[tuple, float] = {}
+        for d in range(self.days):
+            for c in range(self.num_classes):
+                h = 0
+                while h < self.daily_hours:
+                    p, s = int(plan[d, h, c]), int(subject_plan[d, h, c])
+                    end = h + 1
+                    while (
+                        end < self.daily_hours
+                        and int(plan[d, end, c]) == p
+                        and int(subject_plan[d, end, c]) == s
+                    ):
+                        end += 1
+                    key = (c, s - 1, p - 1, d, h, end - h)
+                    if p > 0 and s > 0 and key in keyset:
+                        y_on[key] = 1.0
+                    h = end
+
+        work_on = {key: 1.0 for key, keys in idx.cover_dhp.items() if any(k in y_on for k in keys)}
+        return {
+            "y": y_on,
+            "work": work_on,
+            "seg_start": {(d, h, p): 1.0 for (d, h, p) in work_on if (d, h - 1, p) not in work_on},
+            "t_used": {(c, s, p): 1.0 for (c, s, p, d, start, length) in y_on},
+        }
+
+    def _solve_single_week(
+        self,
+        required: np.ndarray,  # shape (classes, subjects)
+        time_limit_sec: int | None = 60,
+        backend: str = "pulp",
+        start: Tuple[np.ndarray, np.ndarray] | None = None,
+        threads: int | None = None,
+        assignment: Assignment | None = None,
+        days: Sequence[int] | None = None,
+        formulation: str = "hourly",
+        index: SubjectVarIndex | SubjectBlockIndex | None = None,
+        symmetry_breaking: bool = False,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], float, dict]:
+        """
+        Costruisce e risolve il modello di una settimana; `index` sostituisce
+        l'indice enumerato da `_build_index` (usato da joint_weeks).
+
+        symmetry_breaking (senza `assignment` né `days`, che fissano già i
+        docenti) esclude con upper bound 0 le variabili tolte dall'orbit
+        fixing dei docenti intercambiabili (vedi symmetry.py) e rinomina
+        i docenti di `start` di conseguenza; i gruppi trovati finiscono in
+        stats["symmetry"].
+
+        Se CBC termina con errore o senza soluzione intera e `start` è un
+        piano completo del modello (niente `assignment` né `days`), ritorna
+        `start` con il suo obiettivo: con la soluzione di partenza CBC può
+        fermarsi nel preprocessing (o andare in crash) prima di averla
+        accettata come incumbent. Questo solo se la partenza rispetta
+        bound e vincoli del modello (warm_start_valid nelle statistiche):
+        altrimenti nessun piano, con lo stato di CBC.
+
+        Il time limit copre anche la costruzione dell'indice e del modello:
+        CBC riceve solo il tempo che resta.
+        """
+        t0 = time.perf_counter()
+        if formulation == "blocks":
+            build_index, is_feasible = self._build_block_index, self._block_index_is_feasible
+            build_model, build_matrix_model = self._build_block_model, self._build_block_matrix_model
+            warm_start, to_plans = self._warm_start_blocks, self._plans_from_blocks
+        else:
+            build_index, is_feasible = self._build_index, self._index_is_feasible
+            build_model, build_matrix_model = self._build_model, self._build_matrix_model
+            warm_start, to_plans = self._warm_start_assignment, self._plans_from_values
+
+        timer = BuildTimer(backend)
+        timer.stats["formulation"] = formulation
+        idx = build_index(required, assignment, days) if index is None else index
+        if not is_feasible(required, idx, assignment):
+            return None, None, float("inf"), timer.solved("Infeasible")
+
+        # la partenza è restituibile solo se è una soluzione di questo modello
+        fallback = start is not None and assignment is None and days is None
+
+        fixed: List[tuple] = []
+        if symmetry_breaking and assignment is None and days is None:
+            symmetry = subject_symmetry(
+                required,
+                self.ctx.prof_subject_caps,
+                self.ctx.subject_daily_max,
+                self.ctx.preferences,
+                self.avail,
+                self.ctx.single_teacher_rule,
+            )
+            excluded = symmetry.fixed()
+            # chiavi x (orario) o y (blocchi) -> (classe, materia, prof)
+            csp = (lambda k: k[:3]) if formulation == "blocks" else (lambda k: (k[2], k[3], k[4]))
+            fixed = [k for k in idx.keys if csp(k) in excluded]
+            timer.stats["symmetry"] = dict(symmetry.stats, fixed_vars=len(fixed))
+            if start is not None:
+                start = self._canonical_start(start, symmetry)
+
+        if backend == "matrix":
+            model, x_cols = build_matrix_model(required, idx, assignment)
+            for key in fixed:
+                model.upper[x_cols[key]] = 0.0
+            initial = None
+            if start is not None:
+                initial = model.initial_values(warm_start(idx, *start))
+            if fallback:
+                fallback = timer.stats["warm_start_valid"] = model.is_feasible(initial)
+            timer.built(model.num_rows, model.num_cols)
+            solution = model.solve(time_limit_sec=remaining_limit(time_limit_sec, t0), threads=threads, initial=initial)
+            if not solution.ok and fallback:
+                stats = timer.solved(STATUS_FEASIBLE)
+                stats["warm_start_fallback"] = solution.status
+                return start[0], start[1], model.objective_value(initial), stats
+            stats = timer.solved(solution.status, optimal=solution.status == STATUS_OPTIMAL)
+            if not solution.ok:
+                return None, None, float("inf"), stats
+
+            cols = np.fromiter((x_cols[k] for k in idx.keys), dtype=np.int64, count=len(idx.keys))
+            Pmat, Smat = to_plans(idx, solution.values[cols])
+            return Pmat, Smat, solution.objective, stats
+
+        prob, x = build_model(required, idx, assignment)
+        for key in fixed:
+            x[key].upBound = 0
+        start_objective = float("inf")
+        if start is not None:
+            set_pulp_start(prob, warm_start(idx, *start))
+            start_objective = float(pulp.value(prob.objective))
+        if fallback:
+            # controllo prima di risolvere: CBC sovrascrive i valori delle variabili
+            fallback = timer.stats["warm_start_valid"] = prob.valid(1e-6)
+        timer.built(len(prob.constraints), len(prob.variables()))
+
+        solver = pulp.PULP_CBC_CMD(
+            msg=False, timeLimit=remaining_limit(time_limit_sec, t0), warmStart=start is not None, threads=threads
+        )
+        status = solve_pulp(prob, solver)
+        if status not in ("Optimal", "Feasible") and fallback:
+            stats = timer.solved(STATUS_FEASIBLE)
+            stats["warm_start_fallback"] = status
+            return start[0], start[1], start_objective, stats
+
+        stats = timer.solved(status, optimal=prob.sol_status == pulp.LpSolutionOptimal)
+        if status not in ("Optimal", "Feasible"):
+            return None, None, float("inf"), stats
+
+        Pmat, Smat = to_plans(idx, variable_values([x[k] for k in idx.keys]))
 
         obj_val = float(pulp.value(prob.objective))
-        return Pmat, Smat, obj_val
+        return Pmat, Smat, obj_val, stats
+
+    def _canonical_start(
+        self,
+        start: Tuple[np.ndarray, np.ndarray],
+        symmetry: SymmetryGroups,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Partenza con i docenti rinominati come vuole l'orbit fixing (vedi `canonical_teachers`)."""
+        plan, subject_plan = np.asarray(start[0]), np.asarray(start[1])
+
+        def teachers_at(key: tuple) -> np.ndarray:
+            c, s = key
+            return plan[:, :, c][subject_plan[:, :, c] == s + 1] - 1
+
+        return canonical_teachers(plan, symmetry, teachers_at), subject_plan
+
+    def _weeks_planner(self, shared: np.ndarray) -> Tuple["SubjectMIPPlanner", np.ndarray]:
+        """
+        Istanza "virtuale" del modello congiunto: W * D giorni (settimana w
+        nei giorni w*D .. w*D + D - 1) e W * S materie (materia A/B s nella
+        settimana w -> w*S + s; le comuni restano s). Ritorna il planner
+        virtuale e le ore richieste (classi, W*S).
+        """
+        W, S = len(self.ctx.week_labels), self.num_subjects
+        required = np.zeros((self.num_classes, W * S), dtype=int)
+        for w, week_required in enumerate(self.ctx.required_hours):
+            for s in range(S):
+                if shared[s]:
+                    if w == 0:
+                        required[:, s] = week_required[:, s]
+                else:
+                    required[:, w * S + s] = week_required[:, s]
+
+        config = replace(
+            self.config,
+            days=W * self.days,
+            availability=np.tile(self.avail, (1, W, 1)),
+            wednesday_afternoon_free=False,
+        )
+        ctx = replace(
+            self.ctx,
+            week_labels=["".join(self.ctx.week_labels)],
+            required_hours=[required],
+            prof_subject_caps=np.tile(self.ctx.prof_subject_caps, (1, W)),
+            subject_daily_max=np.tile(self.ctx.subject_daily_max, (W, 1)),
+            subject_names=[name for _ in range(W) for name in self.ctx.subject_names],
+            alt_weeks=None,
+        )
+        return SubjectMIPPlanner(config, ctx), required
+
+    def _build_weeks_index(
+        self,
+        virtual: "SubjectMIPPlanner",
+        required: np.ndarray,
+        shared: np.ndarray,
+        formulation: str,
+    ) -> SubjectVarIndex | SubjectBlockIndex:
+        """
+        Indice del modello congiunto: l'indice di `virtual` (vedi
+        `_weeks_planner`) tenendo per ogni materia virtuale solo i giorni
+        della sua settimana (la prima per le comuni) e togliendo gli slot
+        bloccati nelle settimane successive. Una lezione
+        di materia comune è quindi una sola tupla, aggiunta anche alle liste
+        di classe e docente degli stessi slot nelle altre settimane: occupa
+        l'ora in ogni settimana e l'orario comune è identico per costruzione.
+        """
+        W, D, S = len(self.ctx.week_labels), self.days, self.num_subjects
+        blocks = formulation == "blocks"
+        full = virtual._build_block_index(required) if blocks else virtual._build_index(required)
+
+        def span(key: tuple) -> Tuple[int, int, int, int, range]:
+            # (giorno virtuale, classe, materia virtuale, prof, ore coperte)
+            if blocks:
+                c, vs, p, d, start, length = key
+                return d, c, vs, p, range(start, start + length)
+            d, h, c, vs, p = key
+            return d, c, vs, p, range(h, h + 1)
+
+        idx = type(full)(pairs=full.pairs)
+        for key in full.keys:
+            d, c, vs, p, hours = span(key)
+            if d // D != vs // S:
+                continue
+            if any(self._is_blocked_slot(d % D, h) for h in hours):
+                continue
+            idx.add(key)
+            if shared[vs % S]:
+                by_class, by_prof = (idx.cover_dhc, idx.cover_dhp) if blocks else (idx.by_dhc, idx.by_dhp)
+                for other in range(1, W):
+                    for h in hours:
+                        by_class.setdefault((other * D + d, h, c), []).append(key)
+                        by_prof.setdefault((other * D + d, h, p), []).append(key)
+        return idx
+
+    def _join_weeks(
+        self,
+        plans: List[np.ndarray],
+        subject_plans: List[np.ndarray],
+        shared: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Piani per settimana -> piano del modello congiunto (W*D giorni,
+        materie virtuali). Le lezioni delle materie comuni si leggono dalla
+        prima settimana; nelle altre restano solo le lezioni A/B.
+        """
+        W, D, S = len(self.ctx.week_labels), self.days, self.num_subjects
+        shape = (W * D, self.daily_hours, self.num_classes)
+        P_v, S_v = np.zeros(shape, dtype=int), np.zeros(shape, dtype=int)
+        for w in range(W):
+            P_w, S_w = np.asarray(plans[w]), np.asarray(subject_plans[w])
+            own = (S_w > 0) & ~shared[np.clip(S_w - 1, 0, S - 1)] if w else S_w > 0
+            P_v[w * D:(w + 1) * D][own] = P_w[own]
+            S_v[w * D:(w + 1) * D][own] = S_w[own] + (w * S if w else 0)
+        return P_v, S_v
+
+    def _split_weeks(
+        self,
+        P_v: np.ndarray,
+        S_v: np.ndarray,
+        shared: np.ndarray,
+    ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Inverso di `_join_weeks`: le lezioni comuni copiate in ogni settimana."""
+        W, D, S = len(self.ctx.week_labels), self.days, self.num_subjects
+        S_v = np.where(S_v > 0, (S_v - 1) % S + 1, 0)
+        common = S_v[:D] > 0
+        common[common] = shared[S_v[:D][common] - 1]
+        plans, subject_plans = [], []
+        for w in range(W):
+            P_w, S_w = P_v[w * D:(w + 1) * D].copy(), S_v[w * D:(w + 1) * D].copy()
+            P_w[common] = P_v[:D][common]
+            S_w[common] = S_v[:D][common]
+            plans.append(P_w)
+            subject_plans.append(S_w)
+        return plans, subject_plans
+
+    def _plan_objective(
+        self,
+        required: np.ndarray,
+        plan: np.ndarray,
+        subject_plan: np.ndarray,
+        formulation: str = "hourly",
+    ) -> float:
+        """Obiettivo del modello settimanale della formulazione data, valutato sul piano."""
+        if formulation == "blocks":
+            idx = self._build_block_index(required)
+            prob, _ = self._build_block_model(required, idx)
+            start = self._warm_start_blocks(idx, plan, subject_plan)
+        else:
+            idx = self._build_index(required)
+            prob, _ = self._build_model(required, idx)
+            start = self._warm_start_assignment(idx, plan, subject_plan)
+        set_pulp_start(prob, start)
+        return float(pulp.value(prob.objective))
+
+    def _solve_joint_weeks(
+        self,
+        time_limit_sec: int | None,
+        backend: str,
+        warm_start: PlanResult | None,
+        threads: int | None,
+        formulation: str = "hourly",
+        symmetry_breaking: bool = True,
+    ) -> PlanResult:
+        """
+        Settimane A/B in un solo modello (vedi `_build_weeks_index`): le
+        materie comuni hanno un'unica copia delle variabili, solo le ore
+        delle materie A/B hanno variabili per settimana. Conflitti di classe
+        e docente, capacità e buche restano per settimana; nell'obiettivo
+        del modello congiunto i termini delle materie comuni contano una
+        volta sola, mentre gli score restituiti sono l'obiettivo del
+        modello settimanale valutato su ciascun piano (confrontabili con
+        la risoluzione settimana per settimana). `time_limit_sec` è il budget
+        dell'intero modello congiunto, costruzione compresa.
+        """
+        t0 = time.perf_counter()
+        W = len(self.ctx.week_labels)
+        shared = self.ctx.shared_subjects()
+        virtual, required = self._weeks_planner(shared)
+        idx = self._build_weeks_index(virtual, required, shared, formulation)
+
+        start = None
+        if warm_start is not None and warm_start.subject_plans and len(warm_start.plans) >= W:
+            start = self._join_weeks(warm_start.plans, warm_start.subject_plans, shared)
+
+        P_v, S_v, _, stats = virtual._solve_single_week(
+            required,
+            time_limit_sec=remaining_limit(time_limit_sec, t0),
+            backend=backend,
+            start=start,
+            threads=threads,
+            formulation=formulation,
+            index=idx,
+            symmetry_breaking=symmetry_breaking,
+        )
+        stats.update(mode="joint_weeks", shared_subjects=int(shared.sum()))
+        if P_v is None:
+            return PlanResult(plans=[], scores=[], week_labels=self.ctx.week_labels, solve_stats=[stats] * W)
+
+        plans, subject_plans = self._split_weeks(P_v, S_v, shared)
+        scores = [
+            self._plan_objective(self.ctx.required_hours[w], plans[w], subject_plans[w], formulation)
+            for w in range(W)
+        ]
+
+        return PlanResult(
+            plans=plans,
+            scores=scores,
+            week_labels=self.ctx.week_labels,
+            subject_plans=subject_plans,
+            solve_stats=[stats] * W,
+        )
+
+    def _assign_teachers(
+        self,
+        required: np.ndarray,
+        cuts: List[Assignment],
+        time_limit_sec: int | None = None,
+        threads: int | None = None,
+    ) -> Tuple[Optional[Assignment], str]:
+        """
+        Stadio 1 di two_stage: ore a[c,s,p] di ogni docente per ogni
+        (classe, materia), con y[c,s,p] = docente usato:
+          - copertura esatta di required[c, s]
+          - capacità prof_subject_caps[p, s]
+          - ore totali del docente entro i suoi slot disponibili
+          - single_teacher_rule: un solo docente per coppia
+          - un taglio no-good per ogni assegnazione in `cuts` (esclude lo
+            stesso insieme di docenti su tutte le coppie)
+        L'obiettivo usa gli stessi pesi di preferenze e numero di docenti del
+        modello completo.
+
+        Ritorna (assegnazione, stato): l'assegnazione è None con stato
+        STATUS_INFEASIBLE solo se è dimostrato che non esiste, con
+        STATUS_NOT_SOLVED se il tempo è finito prima di trovarne una.
+        """
+        caps = self.ctx.prof_subject_caps
+        prefs = self.ctx.preferences
+        slots = np.array([
+            sum(
+                1
+                for d in range(self.days)
+                for h in range(self.daily_hours)
+                if not self._is_blocked_slot(d, h) and self._is_available(p, d, h)
+            )
+            for p in range(self.num_prof)
+        ])
+        keys = [
+            (int(c), int(s), p)
+            for c, s in zip(*np.nonzero(required))
+            for p in range(self.num_prof)
+            if int(caps[p, s]) > 0 and slots[p] > 0
+        ]
+        pairs = {(c, s) for c, s, _ in keys}
+        if len(pairs) < np.count_nonzero(required):
+            return None, STATUS_INFEASIBLE
+
+        prob = pulp.LpProblem("SubjectTeacherAssignment", pulp.LpMinimize)
+        a = pulp.LpVariable.dicts("a", keys, lowBound=0, cat=pulp.LpInteger)
+        y = pulp.LpVariable.dicts("y", keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
+
+        for (c, s) in pairs:
+            profs = [k for k in keys if k[:2] == (c, s)]
+            prob += (pulp.lpSum(a[k] for k in profs) == int(required[c, s]), f"Hours_c{c}_s{s}")
+            if self.ctx.single_teacher_rule and len(profs) > 1:
+                prob += (pulp.lpSum(y[k] for k in profs) <= 1, f"SingleTeacher_c{c}_s{s}")
+        for k in keys:
+            prob += (a[k] <= int(required[k[0], k[1]]) * y[k], f"Used_c{k[0]}_s{k[1]}_p{k[2]}")
+        for p in {k[2] for k in keys}:
+            mine = [k for k in keys if k[2] == p]
+            prob += (pulp.lpSum(a[k] for k in mine) <= int(slots[p]), f"Load_p{p}")
+            for s in {k[1] for k in mine}:
+                prob += (
+                    pulp.lpSum(a[k] for k in mine if k[1] == s) <= int(caps[p, s]),
+                    f"Cap_p{p}_s{s}",
+                )
+        for i, cut in enumerate(cuts):
+            used = {(c, s, p) for (c, s), teachers in cut.items() for p in teachers}
+            prob += (
+                pulp.lpSum(1 - y[k] for k in keys if k in used) + pulp.lpSum(y[k] for k in keys if k not in used) >= 1,
+                f"NoGood_{i}",
+            )
+
+        w_nonpref = 1.0
+        w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
+        pref_penalties = [a[k] for k in keys if not prefs[k[2], k[0]]] if prefs.any() else []
+        prob += (
+            w_nonpref * pulp.lpSum(pref_penalties) + w_multi_teacher * pulp.lpSum(y.values()),
+            "Objective",
+        )
+        status = solve_pulp(prob, pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit_sec, threads=threads))
+        if status != "Optimal":
+            return None, STATUS_INFEASIBLE if status == STATUS_INFEASIBLE else STATUS_NOT_SOLVED
+
+        assignment: Assignment = {}
+        for k, hours in zip(keys, variable_values([a[k] for k in keys])):
+            if hours > 0.5:
+                assignment.setdefault(k[:2], {})[k[2]] = int(round(hours))
+        return assignment, "Optimal"
+
+    def _assignment_from_plan(
+        self,
+        required: np.ndarray,
+        plan: np.ndarray,
+        subject_plan: np.ndarray,
+    ) -> Optional[Assignment]:
+        """Assegnazione letta da un piano (es. warm start); None se non copre `required`."""
+        assignment: Assignment = {}
+        for d, h, c in zip(*np.nonzero(plan)):
+            s, p = int(subject_plan[d, h, c]) - 1, int(plan[d, h, c]) - 1
+            teachers = assignment.setdefault((int(c), s), {})
+            teachers[p] = teachers.get(p, 0) + 1
+        covered = all(
+            sum(assignment.get((int(c), int(s)), {}).values()) == int(required[c, s])
+            for c, s in zip(*np.nonzero(required))
+        )
+        return assignment if covered and len(assignment) == np.count_nonzero(required) else None
+
+    def _solve_two_stage(
+        self,
+        required: np.ndarray,
+        time_limit_sec: int | None = 60,
+        backend: str = "pulp",
+        start: Tuple[np.ndarray, np.ndarray] | None = None,
+        threads: int | None = None,
+        formulation: str = "hourly",
+        max_rounds: int = 20,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], float, dict]:
+        """
+        Modalità gerarchica: lo stadio 1 (`_assign_teachers`) fissa i docenti
+        di ogni (classe, materia), lo stadio 2 è il modello orario sull'indice
+        ristretto ai docenti assegnati (con un solo docente per coppia la
+        dimensione P sparisce). Se lo stadio 2 è dimostrato infeasible,
+        l'assegnazione diventa un taglio no-good e si riparte dallo stadio 1,
+        fino a `max_rounds` giri o alla scadenza del budget complessivo.
+        Con `start` la prima assegnazione è quella del piano di partenza.
+
+        Le statistiche sono quelle dell'ultimo stadio 2 più mode, rounds
+        (modelli orario risolti) e cuts (assegnazioni scartate); se lo
+        stadio 1 non trova un'assegnazione lo stato è il suo (Infeasible
+        solo se dimostrato, altrimenti Not Solved). Un piano
+        trovato ha stato Feasible e optimal False: lo stadio 2 è ottimo al
+        più per l'assegnazione fissata (il suo stato è in stage2_status).
+        """
+        deadline = time.perf_counter() + time_limit_sec if time_limit_sec else None
+        assignment = self._assignment_from_plan(required, *start) if start is not None else None
+        cuts: List[Assignment] = []
+        stats = BuildTimer(backend).solved(STATUS_NOT_SOLVED)
+        rounds = 0
+        while rounds < max_rounds:
+            remaining = None
+            if deadline is not None:
+                remaining = int(deadline - time.perf_counter())
+                if remaining < 1:
+                    break
+            if assignment is None:
+                assignment, stage1 = self._assign_teachers(required, cuts, remaining, threads)
+                if assignment is None:
+                    # Infeasible solo se lo stadio 1 lo dimostra, non a tempo scaduto
+                    stats = BuildTimer(backend).solved(stage1)
+                    break
+                if deadline is not None:
+                    remaining = max(1, int(deadline - time.perf_counter()))
+
+            rounds += 1
+            plan, subj_plan, score, stats = self._solve_single_week(
+                required,
+                time_limit_sec=remaining,
+                backend=backend,
+                start=start,
+                threads=threads,
+                assignment=assignment,
+                formulation=formulation,
+            )
+            if plan is not None:
+                stats.update(
+                    mode="two_stage",
+                    rounds=rounds,
+                    cuts=len(cuts),
+                    stage2_status=stats["status"],
+                    status=STATUS_FEASIBLE,
+                    optimal=False,
+                )
+                return plan, subj_plan, score, stats
+            if stats["status"] != STATUS_INFEASIBLE:
+                # Tempo scaduto senza soluzione: l'assegnazione non è scartabile
+                break
+            cuts.append(assignment)
+            assignment = None
+
+        stats.update(mode="two_stage", rounds=rounds, cuts=len(cuts))
+        return None, None, float("inf"), stats
+
+    def _day_capacity(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (slot liberi del prof per giorno (N, D), ore consecutive massime del
+        prof in una mezza giornata (N, D), ore non bloccate per giorno (D,)):
+        limiti usati da `_distribute_days`.
+        """
+        L = self.last_morning_hour
+        slots = np.zeros((self.num_prof, self.days), dtype=int)
+        run = np.zeros((self.num_prof, self.days), dtype=int)
+        open_hours = np.zeros(self.days, dtype=int)
+        for d in range(self.days):
+            open_hours[d] = sum(1 for h in range(self.daily_hours) if not self._is_blocked_slot(d, h))
+            for p in range(self.num_prof):
+                current = 0
+                for h in range(self.daily_hours):
+                    ok = not self._is_blocked_slot(d, h) and self._is_available(p, d, h)
+                    # le ore della stessa materia non scavalcano la pausa pranzo
+                    current = (current + 1 if h != L else 1) if ok else 0
+                    slots[p, d] += ok
+                    run[p, d] = max(run[p, d], current)
+        return slots, run, open_hours
+
+    def _distribute_days(
+        self,
+        required: np.ndarray,
+        cuts: Dict[int, List[DayPattern]],
+        time_limit_sec: int | None = None,
+        threads: int | None = None,
+        start: Dict[int, DayPattern] | None = None,
+    ) -> Tuple[Optional[Dict[int, DayPattern]], str]:
+        """
+        Fase 1 di by_day: quante ore ha ogni (classe, materia, prof) in ogni
+        giorno. Le ore di un giorno sono codificate con binarie b[d,c,s,p,k]
+        (k ore, al più una k per giorno), con:
+          - copertura esatta di required[c, s] e capacità prof_subject_caps
+          - subject_daily_max[s, c] per giorno
+          - k entro le ore consecutive disponibili del prof in mezza giornata
+          - carico giornaliero del prof entro i suoi slot liberi, della
+            classe entro le ore non bloccate
+          - single_teacher_rule: un solo docente per coppia
+          - per ogni giorno infeasible già visto, un taglio che esclude lo
+            stesso schema e ogni schema con almeno quelle ore (più ore non
+            rendono un giorno risolvibile)
+        L'obiettivo usa i pesi del modello completo per preferenze, numero
+        di docenti e giorni usati (aggregate_hours_rule). `start` (es. la
+        distribuzione di un piano greedy) è la soluzione di partenza di CBC:
+        senza, CBC può esaurire il tempo nei tagli alla radice senza trovare
+        alcuna distribuzione.
+
+        Ritorna (distribuzione, stato): la distribuzione è None con stato
+        STATUS_INFEASIBLE solo se è dimostrato che non esiste, con
+        STATUS_NOT_SOLVED se il tempo è finito prima di trovarne una.
+        """
+        caps = self.ctx.prof_subject_caps
+        prefs = self.ctx.preferences
+        daily_max = self.ctx.subject_daily_max
+        slots, run, open_hours = self._day_capacity()
+
+        pairs = [(int(c), int(s)) for c, s in zip(*np.nonzero(required))]
+        teachers = {
+            (c, s): [p for p in range(self.num_prof) if int(caps[p, s]) > 0 and slots[p].any()]
+            for c, s in pairs
+        }
+        if any(not profs for profs in teachers.values()):
+            return None, STATUS_INFEASIBLE
+
+        b_keys = [
+            (d, c, s, p, k)
+            for c, s in pairs
+            for p in teachers[(c, s)]
+            for d in range(self.days)
+            for k in range(1, min(int(daily_max[s, c]), int(required[c, s]), int(caps[p, s]), int(run[p, d])) + 1)
+        ]
+        csp_keys = [(c, s, p) for c, s in pairs for p in teachers[(c, s)]]
+        dcs_keys = [(d, c, s) for c, s in pairs for d in range(self.days)]
+
+        prob = pulp.LpProblem("SubjectDayDistribution", pulp.LpMinimize)
+        b = pulp.LpVariable.dicts("b", b_keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        y = pulp.LpVariable.dicts("y", csp_keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
+        u = pulp.LpVariable.dicts("u", dcs_keys, lowBound=0, upBound=1, cat=pulp.LpBinary)
+
+        by = {}
+        for key in b_keys:
+            d, c, s, p, _ = key
+            for group in (("cs", c, s), ("dcs", d, c, s), ("dcsp", d, c, s, p), ("csp", c, s, p),
+                          ("ps", p, s), ("dp", d, p), ("dc", d, c)):
+                by.setdefault(group, []).append(key)
+
+        def hours(group: tuple):
+            return pulp.lpSum(k[4] * b[k] for k in by.get(group, []))
+
+        for c, s in pairs:
+            prob += (hours(("cs", c, s)) == int(required[c, s]), f"Hours_c{c}_s{s}")
+            if self.ctx.single_teacher_rule and len(teachers[(c, s)]) > 1:
+                prob += (pulp.lpSum(y[(c, s, p)] for p in teachers[(c, s)]) <= 1, f"SingleTeacher_c{c}_s{s}")
+            for p in teachers[(c, s)]:
+                prob += (
+                    pulp.lpSum(b[k] for k in by.get(("csp", c, s, p), [])) <= self.days * y[(c, s, p)],
+                    f"TUsed_c{c}_s{s}_p{p}",
+                )
+                for d in range(self.days):
+                    day_keys = by.get(("dcsp", d, c, s, p), [])
+                    if len(day_keys) > 1:
+                        prob += (pulp.lpSum(b[k] for k in day_keys) <= 1, f"OneValue_d{d}_c{c}_s{s}_p{p}")
+            for d in range(self.days):
+                day_keys = by.get(("dcs", d, c, s), [])
+                if day_keys:
+                    prob += (hours(("dcs", d, c, s)) <= int(daily_max[s, c]), f"DailyMax_d{d}_c{c}_s{s}")
+                    prob += (pulp.lpSum(b[k] for k in day_keys) <= len(day_keys) * u[(d, c, s)], f"DayUsed_d{d}_c{c}_s{s}")
+        for (p, s) in {(k[3], k[2]) for k in b_keys}:
+            prob += (hours(("ps", p, s)) <= int(caps[p, s]), f"Cap_p{p}_s{s}")
+        for (d, p) in {(k[0], k[3]) for k in b_keys}:
+            prob += (hours(("dp", d, p)) <= int(slots[p, d]), f"ProfDay_d{d}_p{p}")
+        for (d, c) in {(k[0], k[1]) for k in b_keys}:
+            prob += (hours(("dc", d, c)) <= int(open_hours[d]), f"ClassDay_d{d}_c{c}")
+
+        for d, patterns in cuts.items():
+            for i, pattern in enumerate(patterns):
+                prob += (
+                    pulp.lpSum(
+                        b[k] for (c, s, p), v in pattern.items()
+                        for k in by.get(("dcsp", d, c, s, p), []) if k[4] >= v
+                    ) <= len(pattern) - 1,
+                    f"DayCut_d{d}_{i}",
+                )
+
+        w_day_spread = 4.0 if self.ctx.aggregate_hours_rule else 0.0
+        w_nonpref = 1.0
+        w_multi_teacher = 2.0 if not self.ctx.single_teacher_rule else 0.5
+        pref_penalties = [k[4] * b[k] for k in b_keys if not prefs[k[3], k[1]]] if prefs.any() else []
+        prob += (
+            w_nonpref * pulp.lpSum(pref_penalties)
+            + w_multi_teacher * pulp.lpSum(y.values())
+            + w_day_spread * pulp.lpSum(u.values()),
+            "Objective",
+        )
+        if start is not None:
+            set_pulp_start(prob, {
+                "b": {(d, c, s, p, k): 1.0 for d, pattern in start.items() for (c, s, p), k in pattern.items()},
+                "y": {key: 1.0 for pattern in start.values() for key in pattern},
+                "u": {(d, c, s): 1.0 for d, pattern in start.items() for (c, s, _) in pattern},
+            })
+        status = solve_pulp(prob, pulp.PULP_CBC_CMD(
+            msg=False, timeLimit=time_limit_sec, warmStart=start is not None, threads=threads
+        ))
+        if status != "Optimal":
+            return None, STATUS_INFEASIBLE if status == STATUS_INFEASIBLE else STATUS_NOT_SOLVED
+
+        distribution: Dict[int, DayPattern] = {d: {} for d in range(self.days)}
+        for k, value in zip(b_keys, variable_values([b[k] for k in b_keys])):
+            if value > 0.5:
+                d, c, s, p, n_hours = k
+                distribution[d][(c, s, p)] = n_hours
+        return distribution, "Optimal"
+
+    def _plan_distribution(self, plan: np.ndarray, subject_plan: np.ndarray) -> Dict[int, DayPattern]:
+        """Ore di ogni (classe, materia, prof) in ogni giorno del piano: la distribuzione della fase 1 di by_day."""
+        distribution: Dict[int, DayPattern] = {d: {} for d in range(self.days)}
+        for d, h, c in zip(*np.nonzero(plan)):
+            key = (int(c), int(subject_plan[d, h, c]) - 1, int(plan[d, h, c]) - 1)
+            distribution[int(d)][key] = distribution[int(d)].get(key, 0) + 1
+        return distribution
+
+    def _greedy_distribution(self, required: np.ndarray, time_limit_sec: float) -> Optional[Dict[int, DayPattern]]:
+        """Distribuzione di un piano del motore CSP (vedi SubjectGreedyPlanner), None se non ne trova uno in tempo."""
+        csp = SubjectWeekCSP(
+            self.days, self.daily_hours, self.num_classes, self.avail,
+            self.last_morning_hour, self.wed_free,
+            required, self.ctx.prof_subject_caps, self.ctx.subject_daily_max,
+            rng=random.Random(self.config.seed),
+        )
+        plan, subject_plan = csp.solve(time_limit_sec=time_limit_sec)
+        return None if plan is None else self._plan_distribution(plan, subject_plan)
+
+    def _solve_day(
+        self,
+        day: int,
+        pattern: DayPattern,
+        time_limit_sec: int | None,
+        backend: str,
+        start: Tuple[np.ndarray, np.ndarray] | None,
+        threads: int | None,
+        formulation: str = "hourly",
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], float, dict]:
+        """Fase 2 di by_day: il modello (orario o a blocchi) ristretto al giorno `day` con le ore di `pattern` fissate."""
+        required = np.zeros((self.num_classes, self.num_subjects), dtype=int)
+        assignment: Assignment = {}
+        for (c, s, p), n_hours in pattern.items():
+            required[c, s] += n_hours
+            assignment.setdefault((c, s), {})[p] = n_hours
+        return self._solve_single_week(
+            required,
+            time_limit_sec=time_limit_sec,
+            backend=backend,
+            start=start,
+            threads=threads,
+            assignment=assignment,
+            days=[day],
+            formulation=formulation,
+        )
+
+    def _solve_by_day(
+        self,
+        required: np.ndarray,
+        time_limit_sec: int | None = 60,
+        backend: str = "pulp",
+        start: Tuple[np.ndarray, np.ndarray] | None = None,
+        threads: int | None = None,
+        formulation: str = "hourly",
+        max_rounds: int = 20,
+        workers: int | None = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], float, dict]:
+        """
+        Modalità per giorni: la fase 1 (`_distribute_days`) fissa le ore di
+        ogni (classe, materia, prof) in ogni giorno, la fase 2 risolve un
+        modello orario indipendente per giorno, in un pool di `workers`
+        processi (default: una CPU per giorno). I giorni dimostrati
+        infeasible tornano alla fase 1 come tagli, fino a `max_rounds` giri
+        o alla scadenza del budget complessivo. Con `start` la prima
+        distribuzione è quella del piano di partenza; senza, la fase 1 parte
+        dalla distribuzione di un piano greedy (motore CSP, al più 10% del
+        budget); in quel caso ogni fase 1 usa al più metà del tempo che
+        resta, il resto va ai giorni.
+
+        Lo score è la somma degli obiettivi dei giorni; le statistiche
+        riportano mode, rounds, cuts e quelle di ogni giorno in `days`. Lo
+        stato senza piano è Infeasible solo se la fase 1 dimostra che non
+        c'è distribuzione, altrimenti Not Solved (tempo finito). Un
+        piano trovato ha stato Feasible e optimal False anche se ogni giorno
+        è ottimo: la fase 1 fissa la distribuzione senza i termini delle
+        buche, quindi l'ottimo dei giorni non è quello della settimana
+        (days_optimal dice se tutti i giorni lo sono).
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + time_limit_sec if time_limit_sec else None
+        distribution = greedy = None
+        if start is not None:
+            distribution = self._plan_distribution(*start)
+        else:
+            greedy = self._greedy_distribution(required, 0.1 * time_limit_sec if time_limit_sec else 5.0)
+        workers = min(workers or os.cpu_count() or 1, self.days)
+        cuts: Dict[int, List[DayPattern]] = {}
+        day_stats: List[dict] = []
+        status = STATUS_NOT_SOLVED
+        rounds = 0
+
+        while rounds < max_rounds:
+            remaining = None
+            if deadline is not None:
+                remaining = int(deadline - time.perf_counter())
+                if remaining < 1:
+                    break
+            if distribution is None:
+                # con la partenza greedy la fase 1 ha comunque una soluzione:
+                # metà del tempo resta ai giorni
+                phase1_limit = max(1, remaining // 2) if remaining is not None and greedy else remaining
+                distribution, phase1 = self._distribute_days(required, cuts, phase1_limit, threads, start=greedy)
+                if distribution is None:
+                    status = phase1
+                    break
+                if deadline is not None:
+                    remaining = max(1, int(deadline - time.perf_counter()))
+
+            rounds += 1
+            days = [d for d in range(self.days) if distribution[d]]
+            jobs = [(d, distribution[d], remaining, backend, start, threads, formulation) for d in days]
+            if workers <= 1 or len(jobs) <= 1:
+                outcomes = [self._solve_day(*job) for job in jobs]
+            else:
+                ctx = process_context()
+                with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx) as pool:
+                    futures = [pool.submit(self._solve_day, *job) for job in jobs]
+                    outcomes = [f.result() for f in futures]
+            day_stats = [dict(out[3], day=d) for d, out in zip(days, outcomes)]
+
+            if all(out[0] is not None for out in outcomes):
+                shape = (self.days, self.daily_hours, self.num_classes)
+                Pmat = np.zeros(shape, dtype=int)
+                Smat = np.zeros(shape, dtype=int)
+                for out in outcomes:
+                    Pmat += out[0]
+                    Smat += out[1]
+                return Pmat, Smat, float(sum(out[2] for out in outcomes)), {
+                    "backend": backend,
+                    "formulation": formulation,
+                    "mode": "by_day",
+                    "status": STATUS_FEASIBLE,
+                    "optimal": False,
+                    "days_optimal": all(st.get("optimal") for st in day_stats),
+                    "rows": sum(st.get("rows", 0) for st in day_stats),
+                    "cols": sum(st.get("cols", 0) for st in day_stats),
+                    "solve_sec": time.perf_counter() - t0,
+                    "rounds": rounds,
+                    "cuts": sum(len(v) for v in cuts.values()),
+                    "days": day_stats,
+                }
+
+            infeasible = [d for d, out in zip(days, outcomes) if out[3]["status"] == STATUS_INFEASIBLE]
+            if len(infeasible) < sum(out[0] is None for out in outcomes):
+                # Un giorno senza soluzione a tempo scaduto: la distribuzione non è scartabile
+                break
+            for d in infeasible:
+                cuts.setdefault(d, []).append(distribution[d])
+            distribution = None
+
+        return None, None, float("inf"), {
+            "backend": backend,
+            "formulation": formulation,
+            "mode": "by_day",
+            "status": status,
+            "optimal": False,
+            "solve_sec": time.perf_counter() - t0,
+            "rounds": rounds,
+            "cuts": sum(len(v) for v in cuts.values()),
+            "days": day_stats,
+        }
 
 
 class SubjectRandomPlanner:
@@ -553,40 +2161,8 @@ class SubjectRandomPlanner:
         return bool(self.avail[prof, day, slot])
 
     def _score_plan(self, plan: np.ndarray) -> float:
-        # riprende la logica anti-buche
-        opt = 0.0
-        weight_gap = 1.0
-        weight_segments = 0.01
-        weight_lunch_cross = 0.0001
-        D, H, C = plan.shape
-        for p in range(self.num_prof):
-            for d in range(D):
-                z = np.array(
-                    [np.any(plan[d, h, :] == p + 1) for h in range(H)],
-                    dtype=int,
-                )
-                if z.sum() <= 1:
-                    continue
-                hours = np.where(z == 1)[0]
-                first = hours[0]
-                last = hours[-1]
-                gaps = 0
-                for h in range(first, last + 1):
-                    if z[h] == 0:
-                        gaps += 1
-                opt += weight_gap * gaps
-                segments = 1
-                for i in range(1, len(hours)):
-                    if hours[i] > hours[i - 1] + 1:
-                        segments += 1
-                if segments > 1:
-                    opt += weight_segments * (segments - 1)
-                for i in range(1, len(hours)):
-                    h_prev = hours[i - 1]
-                    h_curr = hours[i]
-                    if h_prev < self.last_morning_hour <= h_curr:
-                        opt += weight_lunch_cross
-        return opt
+        # riprende la logica anti-buche (vedi scoring)
+        return score_plan(plan, self.num_prof, self.last_morning_hour, ANTI_GAP_WEIGHTS)
 
     def _build_blocks_for_week(self, required: np.ndarray) -> List[dict]:
         blocks = []
@@ -631,59 +2207,32 @@ class SubjectRandomPlanner:
         block: dict,
         prof: int,
         day_subject_load: np.ndarray,
+        slots: SlotIndex,
     ) -> bool:
         size = block["size"]
         c = block["class"]
         s = block["subject"]
-        D = self.days
-        H = self.daily_hours
-        tries = 400
-        for _ in range(tries):
-            d = random.randrange(D)
-            if day_subject_load[d, c, s] > 0:
-                # già presente un blocco di questa materia in quel giorno: mantieni contiguità evitando split
-                continue
-            start = random.randrange(max(1, H - size + 1))
-            if self.wed_free and d == 2 and start >= self.last_morning_hour:
-                continue
-            # evita blocchi che attraversano pausa pranzo
-            if 0 < self.last_morning_hour < H:
-                if start <= self.last_morning_hour - 1 < start + size - 1:
-                    continue
-            ok = True
-            for k in range(size):
-                h = start + k
-                if h >= H:
-                    ok = False
-                    break
-                if day_subject_load[d, c, s] + size > self.ctx.subject_daily_max[s, c]:
-                    ok = False
-                    break
-                if not self._is_available(prof, d, h):
-                    ok = False
-                    break
-                if plan[d, h, c] != 0:
-                    ok = False
-                    break
-                if np.any(plan[d, h, :] == prof + 1):
-                    ok = False
-                    break
-                # stessa materia deve essere contigua: controlliamo le celle intorno al blocco
-                if k == 0 and h > 0 and np.any(plan[d, h - 1, c] == prof + 1):
-                    # ok, contiguità solo con stesso prof? lasciamo passare
-                    pass
-            if not ok:
-                continue
-            # Assign
-            for k in range(size):
-                h = start + k
-                plan[d, h, c] = prof + 1
-                subject_plan[d, h, c] = block["subject"] + 1
-                day_subject_load[d, c, s] += 1
-            return True
-        return False
-
-    def generate(self, time_limit_sec: float = 10.0) -> PlanResult:
+        if size > self.ctx.subject_daily_max[s, c]:
+            return False
+        # Un solo blocco per materia al giorno (contiguità): con day_cap=size
+        # sono ammessi solo i giorni in cui la materia non è ancora presente.
+        slot = slots.sample(prof, c, size, day_load=day_subject_load[:, c, s], day_cap=size)
+        if slot is None:
+            return False
+        d, start = slot
+        hours = slice(start, start + size)
+        plan[d, hours, c] = prof + 1
+        subject_plan[d, hours, c] = s + 1
+        day_subject_load[d, c, s] += size
+        slots.place(prof, c, d, start, size)
+        return True
+
+    def generate(self, time_limit_sec: float = 10.0, improve_sec: float = 0.0) -> PlanResult:
+        """
+        Un piano per settimana; con improve_sec > 0 ogni piano passa poi per
+        la ricerca locale (local_search) con le capacità dei docenti non
+        consumate dalle altre settimane.
+        """
         plans: List[np.ndarray] = []
         subject_plans: List[np.ndarray] = []
         scores: List[float] = []
@@ -694,6 +2243,10 @@ class SubjectRandomPlanner:
             plan = np.zeros((self.days, self.daily_hours, self.num_classes), dtype=int)
             subject_plan = np.zeros((self.days, self.daily_hours, self.num_classes), dtype=int)
             day_subject_load = np.zeros((self.days, self.num_classes, self.num_subjects), dtype=int)
+            slots = SlotIndex(
+                self.days, self.daily_hours, self.num_classes, self.avail,
+                self.last_morning_hour, self.wed_free,
+            )
             blocks = self._build_blocks_for_week(required)
             success = True
             for blk in blocks:
@@ -701,7 +2254,7 @@ class SubjectRandomPlanner:
                 if prof is None:
                     success = False
                     break
-                if not self._place_block(plan, subject_plan, blk, prof, day_subject_load):
+                if not self._place_block(plan, subject_plan, blk, prof, day_subject_load, slots):
                     success = False
                     break
                 remaining_caps[prof, blk["subject"]] -= blk["size"]
@@ -712,4 +2265,23 @@ class SubjectRandomPlanner:
             subject_plans.append(subject_plan)
             scores.append(self._score_plan(plan))
 
+        if improve_sec > 0:
+            caps = np.array(self.ctx.prof_subject_caps, dtype=int)
+            for w in range(len(plans)):
+                others = caps - remaining_caps - self._subject_hours(plans[w], subject_plans[w])
+                plans[w], subject_plans[w], scores[w], _ = improve_subject_plan(
+                    self.config, self.ctx, plans[w], subject_plans[w], ANTI_GAP_WEIGHTS,
+                    caps - others,
+                    time_limit_sec=improve_sec / len(plans),
+                    one_block_per_day=True,
+                    seed=random.getrandbits(32),
+                )
+
         return PlanResult(plans=plans, scores=scores, week_labels=self.ctx.week_labels, subject_plans=subject_plans)
+
+    def _subject_hours(self, plan: np.ndarray, subject_plan: np.ndarray) -> np.ndarray:
+        """used[p, s] = ore del prof p nella materia s nel piano."""
+        used = np.zeros((self.num_prof, self.num_subjects), dtype=int)
+        mask = plan > 0
+        np.add.at(used, (plan[mask] - 1, subject_plan[mask] - 1), 1)
+        return used
@@ -0,0 +1,198 @@
+# weekly_planner/symmetry.py
+#
+# Simmetrie dei modelli MIP. Classi con gli stessi dati (ore richieste,
+# massimi giornalieri, preferenze; colonna di H nel legacy) e docenti con
+# gli stessi dati (capacità o riga di H, disponibilità, preferenze) sono
+# intercambiabili: ogni soluzione ha una copia equivalente per ogni
+# permutazione dei membri di un gruppo e CBC le esplora tutte.
+#
+# Per i docenti si fissa l'orbita delle prime assegnazioni ("orbit
+# fixing"): si scorrono le posizioni in cui un docente del gruppo può
+# entrare (coppie (classe, materia), o le classi del primo slot nel
+# legacy), ognuna con il numero massimo di membri del gruppo che può
+# avere; una posizione può usare solo i primi membri, tanti quanti la
+# somma delle capacità delle posizioni fino a lei. Rinominare i docenti in
+# ordine di prima comparsa porta qualunque soluzione in una che rispetta
+# queste esclusioni con lo stesso obiettivo (`canonical_teachers`), quindi
+# l'ottimo non si perde. Le variabili escluse hanno upper bound 0: nessuna
+# riga in più, il presolve di CBC le toglie.
+#
+# I gruppi di classi sono solo rilevati e riportati nelle statistiche: un
+# ordine sulle classi va combinato con quello sui docenti (che dipende
+# dall'ordine delle classi) e righe d'ordine sulle firme delle classi
+# rallentavano CBC.
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SymmetryGroups:
+    """Gruppi (indici crescenti, almeno due membri) di classi e di docenti intercambiabili."""
+    classes: List[List[int]] = field(default_factory=list)
+    teachers: List[List[int]] = field(default_factory=list)
+    # per gruppo di docenti: posizioni in ordine, come (chiave, membri al più)
+    positions: List[List[Tuple[tuple, int]]] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.classes or self.teachers)
+
+    def fixed(self) -> Set[tuple]:
+        """Tuple (*chiave della posizione, docente) escluse dall'orbit fixing."""
+        out: Set[tuple] = set()
+        for members, positions in zip(self.teachers, self.positions):
+            allowed = 0
+            for key, capacity in positions:
+                allowed += capacity
+                if allowed >= len(members):
+                    break
+                out.update((*key, p) for p in members[allowed:])
+        return out
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "class_groups": len(self.classes),
+            "classes_in_groups": sum(len(g) for g in self.classes),
+            "teacher_groups": len(self.teachers),
+            "teachers_in_groups": sum(len(g) for g in self.teachers),
+            "fixed_positions": len(self.fixed()),
+        }
+
+
+def equivalence_groups(features: np.ndarray, active: np.ndarray | None = None) -> List[List[int]]:
+    """
+    Raggruppa le righe identiche di `features` (una riga per elemento);
+    con `active` considera solo gli elementi True. Ritorna i gruppi con
+    almeno due membri, in ordine di primo membro.
+    """
+    features = np.asarray(features).reshape(len(features), -1)
+    items = np.arange(len(features)) if active is None else np.flatnonzero(active)
+    if len(items) < 2:
+        return []
+    _, inverse = np.unique(features[items], axis=0, return_inverse=True)
+    inverse = np.asarray(inverse).reshape(-1)
+    groups = [items[inverse == g].tolist() for g in np.unique(inverse)]
+    return sorted((g for g in groups if len(g) > 1), key=lambda g: g[0])
+
+
+def _log(groups: SymmetryGroups) -> SymmetryGroups:
+    stats = groups.stats
+    logger.info(
+        "simmetrie: %d gruppi di classi (%d classi), %d gruppi di docenti (%d docenti), %d posizioni fissate",
+        stats["class_groups"],
+        stats["classes_in_groups"],
+        stats["teacher_groups"],
+        stats["teachers_in_groups"],
+        stats["fixed_positions"],
+    )
+    return groups
+
+
+def subject_symmetry(
+    required: np.ndarray,
+    prof_subject_caps: np.ndarray,
+    subject_daily_max: np.ndarray,
+    preferences: np.ndarray,
+    availability: np.ndarray,
+    single_teacher_rule: bool,
+) -> SymmetryGroups:
+    """
+    Gruppi del modello a materie di una settimana: classi con la stessa
+    riga di `required`, stessi massimi giornalieri e stessa colonna di
+    preferenze; docenti con stesse capacità, disponibilità e preferenze.
+    Le posizioni di un gruppo di docenti sono le coppie (classe, materia)
+    con ore richieste che il gruppo può coprire, in ordine; ognuna ha al
+    più un docente con single_teacher_rule, altrimenti uno per ora.
+    """
+    required = np.asarray(required)
+    caps = np.asarray(prof_subject_caps)
+    prefs = np.asarray(preferences, dtype=int)
+    class_features = np.hstack([required, np.asarray(subject_daily_max).T, prefs.T])
+    teacher_features = np.hstack([
+        caps,
+        np.asarray(availability, dtype=int).reshape(len(caps), -1),
+        prefs,
+    ])
+    teachers = equivalence_groups(teacher_features, caps.sum(axis=1) > 0)
+    positions = [
+        [
+            ((int(c), int(s)), 1 if single_teacher_rule else min(len(members), int(required[c, s])))
+            for c, s in zip(*np.nonzero(required))
+            if caps[members[0], s] > 0
+        ]
+        for members in teachers
+    ]
+    return _log(SymmetryGroups(
+        classes=equivalence_groups(class_features, required.sum(axis=1) > 0),
+        teachers=teachers,
+        positions=positions,
+    ))
+
+
+def legacy_symmetry(
+    hours_matrix: np.ndarray,
+    availability: np.ndarray,
+    class_teachers: np.ndarray,
+    first_slot: Tuple[int, int] | None,
+) -> SymmetryGroups:
+    """
+    Gruppi del modello legacy: classi con la stessa colonna H[:, c];
+    docenti con la stessa riga H[p, :], stessa disponibilità e stesso
+    flag di docente di classe. Le posizioni di un gruppo di docenti sono
+    le sue classi nel primo slot non bloccato `first_slot` (d, h), con un
+    docente ciascuna; senza slot (o con un gruppo non disponibile nello
+    slot) nessuna posizione.
+    """
+    H = np.asarray(hours_matrix)
+    avail = np.asarray(availability, dtype=bool)
+    teacher_features = np.hstack([
+        H,
+        avail.astype(int).reshape(len(H), -1),
+        np.asarray(class_teachers, dtype=int).reshape(-1, 1),
+    ])
+    teachers = equivalence_groups(teacher_features, H.sum(axis=1) > 0)
+    positions: List[List[Tuple[tuple, int]]] = []
+    for members in teachers:
+        if first_slot is None:
+            positions.append([])
+            continue
+        d, h = first_slot
+        positions.append([((d, h, int(c)), 1) for c in np.flatnonzero(H[members[0]])])
+    return _log(SymmetryGroups(
+        classes=equivalence_groups(H.T, H.sum(axis=0) > 0),
+        teachers=teachers,
+        positions=positions,
+    ))
+
+
+def canonical_teachers(
+    plan: np.ndarray,
+    groups: SymmetryGroups,
+    teachers_at: Callable[[tuple], Iterable[int]],
+) -> np.ndarray:
+    """
+    Rinomina i docenti (1-based in `plan`) di ogni gruppo in ordine di
+    prima comparsa lungo le sue posizioni; `teachers_at(chiave)` dà i
+    docenti (0-based) del piano in una posizione. Il piano rinominato
+    rispetta `groups.fixed()`: serve a non far scartare a CBC le
+    soluzioni di partenza.
+    """
+    plan = np.asarray(plan)
+    size = max(int(plan.max()), max((max(g) for g in groups.teachers), default=-1) + 1) + 1
+    mapping = np.arange(size)
+    for members, positions in zip(groups.teachers, groups.positions):
+        order: List[int] = []
+        for key, _ in positions:
+            order += [p for p in sorted(set(teachers_at(key))) if p in members and p not in order]
+        order += [p for p in members if p not in order]
+        for new, old in zip(members, order):
+            mapping[old + 1] = new + 1
+    return mapping[plan]